@@ -1,70 +1,131 @@
 from typing import Optional
 import json
 import os
+import threading
 from model.image_generation import Settings
 
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'workflow_api.json')
+
+# Parsed workflow_api.json, shared by every request and never mutated
+template: Optional[dict] = None
+_template_lock = threading.Lock()
+
+# (node id, input name, value taken from the settings) written on every request
+BASIC_SETTINGS_PATCHES = [
+    ("206", "ckpt_name", lambda settings: settings.model),
+    ("206", "empty_latent_width", lambda settings: int(settings.width)),
+    ("206", "empty_latent_height", lambda settings: int(settings.height)),
+    ("206", "batch_size", lambda settings: int(settings.n_images)),
+    ("222", "text", lambda settings: settings.pos_prompt),
+    ("229", "steps", lambda settings: int(settings.sampling_steps)),
+]
+
+REFERENCE_IMAGE_PATCH = ("280", "image")
+
+# Controlnet model -> (controlnet stacker id, image loader id)
+CONTROLNET_NODES = {
+    "Pose": ("208", "210"),
+    "Depth": ("211", "213"),
+    "Edge Detection": ("214", "216"),
+    "Resolution Enhancement": ("217", "218")
+}
+
+CONTROLNET_STACKER_PATCHES = [
+    ("strength", lambda settings: float(settings.controlnet_strength)/10),
+    ("start_percent", lambda settings: float(settings.controlnet_start_percent)/100),
+    ("end_percent", lambda settings: float(settings.controlnet_end_percent)/100),
+]
+
+# Nodes copied for every request, the rest of the workflow is shared with the template
+BASIC_NODES = tuple(sorted({node_id for node_id, _, _ in BASIC_SETTINGS_PATCHES} | {REFERENCE_IMAGE_PATCH[0]}))
+
+
+def reload_template() -> int:
+    """Parse workflow_api.json again, requests already in flight keep the old template"""
+
+    global template
+
+    with open(TEMPLATE_PATH, 'r') as file:
+        loaded = json.load(file)
+
+    template = loaded
+
+    return len(loaded)
+
+
+def get_template() -> dict:
+    if template is None:
+        with _template_lock:
+            if template is None:
+                reload_template()
+
+    return template
+
+
+def copy_nodes(workflow, node_ids):
+    # Only the patched nodes and their inputs are copied, everything else stays shared
+    for node_id in node_ids:
+        node = workflow[node_id]
+        workflow[node_id] = {**node, 'inputs': dict(node['inputs'])}
+
 
 def set_basic_settings(workflow, settings, reference_image_path):
     print("Setting basic settings")
-    
-    workflow["206"]['inputs']['ckpt_name'] = settings.model        
-    workflow["206"]['inputs']['empty_latent_width'] = int(settings.width)            
-    workflow["206"]['inputs']['empty_latent_height'] = int(settings.height)    
-    workflow["206"]['inputs']['batch_size'] = int(settings.n_images)
 
-    workflow["222"]['inputs']['text'] = settings.pos_prompt
+    for node_id, input_name, get_value in BASIC_SETTINGS_PATCHES:
+        workflow[node_id]['inputs'][input_name] = get_value(settings)
 
-    workflow["229"]['inputs']['steps'] = int(settings.sampling_steps)
+    node_id, input_name = REFERENCE_IMAGE_PATCH
+    workflow[node_id]['inputs'][input_name] = reference_image_path
 
-    workflow["280"]['inputs']['image'] = reference_image_path
 
-
-def set_controlnet_parameters(workflow, 
-                              settings, 
-                              controlnet_reference_image_path, 
-                              image_loader_id, 
+def set_controlnet_parameters(workflow,
+                              settings,
+                              controlnet_reference_image_path,
+                              image_loader_id,
                               controlnet_stacker_id):
-    
+
     workflow[str(image_loader_id)]['inputs']['image'] = controlnet_reference_image_path
 
-    workflow[str(controlnet_stacker_id)]['inputs']['strength'] = float(settings.controlnet_strength)/10
-    workflow[str(controlnet_stacker_id)]['inputs']['start_percent'] = float(settings.controlnet_start_percent)/100
-    workflow[str(controlnet_stacker_id)]['inputs']['end_percent'] = float(settings.controlnet_end_percent)/100
+    for input_name, get_value in CONTROLNET_STACKER_PATCHES:
+        workflow[str(controlnet_stacker_id)]['inputs'][input_name] = get_value(settings)
 
 
-def set_controlnet(workflow, settings, controlnet_reference_image_path):
+def get_controlnet_nodes(settings) -> Optional[tuple]:
     if settings.controlnet_enabled:
+        return CONTROLNET_NODES.get(settings.controlnet_model)
+
+    return None
+
+
+def set_controlnet(workflow, settings, controlnet_reference_image_path):
+    controlnet_nodes = get_controlnet_nodes(settings)
+
+    if controlnet_nodes:
         print("Controlnet is enabled")
-        link_map = {
-            "Pose": (208, 210),
-            "Depth": (211, 213),
-            "Edge Detection": (214, 216),
-            "Resolution Enhancement": (217, 218)
-        }
-        
-        if settings.controlnet_model in link_map:
-            controlnet_stacker_id, image_loader_id = link_map[settings.controlnet_model]
+        controlnet_stacker_id, image_loader_id = controlnet_nodes
 
-            print("CONTROLNET STACKER ID: ", controlnet_stacker_id)
-            print("IMAGE LOADER ID: ", image_loader_id)
+        print("CONTROLNET STACKER ID: ", controlnet_stacker_id)
+        print("IMAGE LOADER ID: ", image_loader_id)
 
-            set_controlnet_parameters(workflow, 
-                                      settings, 
-                                      controlnet_reference_image_path, 
-                                      image_loader_id, 
-                                      controlnet_stacker_id)
+        set_controlnet_parameters(workflow,
+                                  settings,
+                                  controlnet_reference_image_path,
+                                  image_loader_id,
+                                  controlnet_stacker_id)
 
 
-            workflow['206']['inputs']['cnet_stack'] = [
-              str(controlnet_stacker_id),
-              0
-            ]
+        workflow['206']['inputs']['cnet_stack'] = [
+          str(controlnet_stacker_id),
+          0
+        ]
 
 
 def generate_workflow(settings: Settings, reference_image_path, controlnet_reference_image_path) -> Optional[dict]:
     try:
-        with open('./comfyui/workflow_api.json', 'r') as file:
-            workflow = json.load(file)
+        workflow = dict(get_template())
+
+        copy_nodes(workflow, BASIC_NODES + (get_controlnet_nodes(settings) or ()))
 
         set_basic_settings(workflow, settings, reference_image_path)
         set_controlnet(workflow, settings, controlnet_reference_image_path)
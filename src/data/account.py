@@ -2,11 +2,39 @@ from bson.objectid import ObjectId
 
 from typing import Optional
 
+import os
+
+from cache import TTLCache
+
 from model.account import Account, Invite, PasswordReset, InsiderAccount
 
-from pymongo import ReturnDocument
+from pymongo import ReturnDocument, ASCENDING
 from .init import account_col, invite_col, password_reset_col, insider_account_col
 
+# Indexes backing the lookups below, created by data.indexes
+INDEXES = [
+    (account_col, [("username", ASCENDING)], {"unique": True}),
+    (account_col, [("email", ASCENDING)], {"unique": True}),
+    (account_col, [("user_id", ASCENDING)], {"unique": True}),
+    (insider_account_col, [("user_id", ASCENDING)], {}),
+    (password_reset_col, [("reset_id", ASCENDING)], {"unique": True}),
+]
+
+# Hot query shapes checked for collection scans by data.indexes
+QUERIES = [
+    (account_col, {"username": ""}, None),
+    (account_col, {"email": ""}, None),
+    (account_col, {"user_id": ""}, None),
+    (insider_account_col, {"user_id": ""}, None),
+    (password_reset_col, {"reset_id": ""}, None),
+]
+
+# Authenticated users keyed by username, used by get_current_user so that
+# every request does not have to go to Mongo. Writes to an account must
+# invalidate its entry.
+user_cache = TTLCache(maxsize=int(os.getenv('USER_CACHE_MAXSIZE', 10000)),
+                      ttl=float(os.getenv('USER_CACHE_TTL_SECONDS', 60)))
+
 def signup(email: str, 
            username: str, 
            password_hash: str) -> None:
@@ -45,6 +73,8 @@ def change_email(email: str, user: Account) -> bool:
         return_document=ReturnDocument.AFTER
     )
 
+    user_cache.invalidate(user.username)
+
     if not result:
         raise ValueError("Failed to change email - user does not exist.")
 
@@ -58,6 +88,17 @@ def get_by_username(username: str) -> Optional[Account]:
         return account
     return None
 
+def get_cached_by_username(username: str) -> Optional[Account]:
+    account = user_cache.get(username)
+
+    if account is None:
+        account = get_by_username(username)
+
+        if account is not None:
+            user_cache.set(username, account)
+
+    return account
+
 def get_by_id(user_id: str) -> Optional[Account]:
     print("GETTING USER DETAILS BY USER_ID")
     result = account_col.find_one({"user_id": user_id})
@@ -85,6 +126,8 @@ def change_profile_picture(profile_uri: str, user: Account) -> None:
         return_document=ReturnDocument.AFTER
     )
 
+    user_cache.invalidate(user.username)
+
     if not result:
         raise ValueError("Failed to change profile picture - user does not exist.")
 
@@ -92,6 +135,8 @@ def delete(user: Account) -> None:
     # Find and delete the account with the given user_id
     result = account_col.delete_one({"user_id": user.user_id})
 
+    user_cache.invalidate(user.username)
+
     # Check if an account was actually deleted
     if result.deleted_count == 0:
         raise ValueError("No account found with this user ID")
@@ -128,6 +173,9 @@ def set_new_password(password_hash: str, user_id: str) -> None:
         return_document=ReturnDocument.AFTER
     )
 
+    if result is not None:
+        user_cache.invalidate(result.get("username"))
+
     return result is not None
 
 
@@ -4,16 +4,33 @@ from uuid import uuid4
 
 from model.ai_verification import Prompt, SocialAccount
 
-from pymongo import ReturnDocument, WriteConcern
+from pymongo import ReturnDocument, WriteConcern, ASCENDING, DESCENDING
 from pymongo.errors import OperationFailure
 from .init import midjourney_prompt_col, social_account_col
-
-from .init import mongoClient
+from .pagination import after_cursor, get_page, get_page_size, get_projection, get_sort
+
+from .init import get_client
+
+# Indexes backing the lookups below, created by data.indexes
+INDEXES = [
+    (social_account_col, [("account_id", ASCENDING)], {}),
+    (social_account_col, [("user_id", ASCENDING), ("_id", DESCENDING)], {}),
+    (midjourney_prompt_col, [("account_id", ASCENDING)], {}),
+    (midjourney_prompt_col, [("user_id", ASCENDING)], {}),
+]
+
+# Hot query shapes checked for collection scans by data.indexes
+QUERIES = [
+    (social_account_col, {"account_id": ""}, None),
+    (social_account_col, {"user_id": ""}, [("_id", DESCENDING)]),
+    (midjourney_prompt_col, {"account_id": ""}, None),
+    (midjourney_prompt_col, {"user_id": ""}, None),
+]
 
 def add_account(social_account: SocialAccount, 
                 prompt: Prompt, 
                 user_id: str) -> Optional[Tuple[SocialAccount, Prompt]]:
-    session = mongoClient.start_session()
+    session = get_client().start_session()
     try:
         with session.start_transaction(write_concern=WriteConcern("majority")):
             social_account_dict = social_account.dict()
@@ -67,14 +84,22 @@ def update_account(social_account: SocialAccount) -> None:
         raise ValueError("Failed to update social account.")
 
 
-def get_accounts(user_id: str) -> Optional[List[SocialAccount]]:
-    results = social_account_col.find({"user_id": user_id})
+def get_accounts(user_id: str,
+                 cursor: Optional[str] = None,
+                 limit: Optional[int] = None) -> Tuple[List[SocialAccount], Optional[str]]:
+    page_size = get_page_size(limit)
+
+    results = social_account_col.find(after_cursor({"user_id": user_id}, cursor, None), get_projection(SocialAccount)) \
+                                .sort(get_sort(None)) \
+                                .limit(page_size + 1)
+
+    results, next_cursor = get_page(list(results), page_size, None)
 
     social_accounts = [SocialAccount(**result) for result in results]
 
     print("SOCIAL ACCOUNTS: ", social_accounts)
 
-    return social_accounts[::-1]
+    return social_accounts, next_cursor
 
 
 def delete_account(account_id: str) -> None:
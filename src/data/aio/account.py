@@ -0,0 +1,50 @@
+from typing import Optional
+
+from model.account import Account
+
+from ..account import user_cache
+from .init import account_col, insider_account_col
+
+
+async def is_insider(user_id: str) -> bool:
+    result = await insider_account_col.find_one({"user_id": user_id})
+    return result is not None
+
+
+async def get_by_username(username: str) -> Optional[Account]:
+    result = await account_col.find_one({"username": username})
+
+    if result is not None:
+        account = Account(**result)
+        return account
+    return None
+
+
+async def get_cached_by_username(username: str) -> Optional[Account]:
+    account = user_cache.get(username)
+
+    if account is None:
+        account = await get_by_username(username)
+
+        if account is not None:
+            user_cache.set(username, account)
+
+    return account
+
+
+async def get_by_id(user_id: str) -> Optional[Account]:
+    result = await account_col.find_one({"user_id": user_id})
+
+    if result is not None:
+        account = Account(**result)
+        return account
+    return None
+
+
+async def get_by_email(email: str) -> Optional[Account]:
+    result = await account_col.find_one({"email": email})
+
+    if result is not None:
+        account = Account(**result)
+        return account
+    return None
@@ -0,0 +1,30 @@
+from typing import Optional
+
+from model.billing import PaymentAccount
+
+from .init import payment_account_col
+
+
+async def get_payment_account(user_id: str, 
+                              paypal_subscription_id: str = None,
+                              radom_checkout_session_id: str = None,
+                              radom_subscription_id: str = None,
+                              gc_billing_request_id: str = None) -> Optional[PaymentAccount]:
+
+    if paypal_subscription_id is not None:
+        query = {"paypal_subscription_id": paypal_subscription_id}
+    elif radom_checkout_session_id is not None:
+        query = {"radom_checkout_session_id": radom_checkout_session_id}
+    elif radom_subscription_id is not None:
+        query = {"radom_subscription_id": radom_subscription_id}
+    elif gc_billing_request_id is not None:
+        query = {"gc_billing_request_id": gc_billing_request_id}
+    else:
+        query = {"user_id": user_id}
+
+    result = await payment_account_col.find_one(query)
+
+    if result is not None:
+        return PaymentAccount(**result)
+
+    return None
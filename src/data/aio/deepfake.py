@@ -0,0 +1,108 @@
+from typing import List, Optional, Tuple
+
+from datetime import datetime
+
+from model.deepfake import Message
+
+from .init import deepfake_col, face_landmarks_col
+from ..pagination import after_cursor, get_page, get_page_size, get_projection, get_sort
+
+
+async def create_message(user_id: Optional[str] = None,
+                         status: Optional[str] = None,
+                         facefusion_source_uris: Optional[List[str]] = None,
+                         facefusion_target_uri: Optional[str] = None,
+                         akool_source_uri: Optional[str] = None,
+                         akool_target_uri: Optional[str] = None,
+                         job_id: Optional[str] = None,
+                         output_url: Optional[str] = None) -> Optional[Message]:
+    message = Message(
+        user_id=user_id,
+        status=status,
+        facefusion_source_uris=facefusion_source_uris,
+        facefusion_target_uri=facefusion_target_uri,
+        akool_source_uri=akool_source_uri, 
+        akool_target_uri=akool_target_uri,
+        job_id=job_id,
+        output_url=output_url,
+        created_at=datetime.now()
+    )
+
+    result = await deepfake_col.insert_one(message.dict())
+    if not result.inserted_id:
+        raise ValueError("Failed to create message.")
+    
+    return message
+
+
+async def update_message(user_id: Optional[str] = None, 
+                         status: Optional[str] = None,
+                         job_id: Optional[str] = None,
+                         output_url: Optional[str] = None) -> Optional[str]:
+    message = Message(
+        user_id=user_id,
+        status=status,
+        job_id=job_id,
+        output_url=output_url
+    )
+
+    update_fields = {key: value for key, value in message.dict().items() if value is not None}
+
+    result = await deepfake_col.find_one_and_update(
+        {"job_id": job_id},
+        {"$set": update_fields},
+        {"user_id": 1}
+    )
+
+    # Owner of the job, webhooks that don't carry it use it to notify the user
+    if result:
+        return result.get("user_id")
+    return None
+
+
+async def get_message(job_id: str) -> Optional[Message]:
+    result = await deepfake_col.find_one({"job_id": job_id})
+
+    if result is not None:
+        return Message(**result)
+    return None
+
+
+async def get_history(user_id: str,
+                      cursor: Optional[str] = None,
+                      limit: Optional[int] = None) -> Tuple[List[Message], Optional[str]]:
+    page_size = get_page_size(limit)
+
+    results = await deepfake_col.find(after_cursor({"user_id": user_id}, cursor, "created_at"), get_projection(Message)) \
+                                .sort(get_sort("created_at")) \
+                                .limit(page_size + 1) \
+                                .to_list(length=page_size + 1)
+
+    results, next_cursor = get_page(results, page_size, "created_at")
+
+    return [Message(**result) for result in results], next_cursor
+
+
+async def count_active_jobs(user_id: str,
+                            since: datetime) -> int:
+    # FaceFusion jobs start as "started", Akool ones as "in progress", until their webhook lands
+    return await deepfake_col.count_documents({"user_id": user_id,
+                                               "status": {"$in": ["started", "in progress"]},
+                                               "created_at": {"$gte": since}})
+
+
+async def get_landmarks(image_key: str) -> Optional[str]:
+    result = await face_landmarks_col.find_one({"image_key": image_key}, {"_id": 0, "landmarks_str": 1})
+
+    if result:
+        return result.get("landmarks_str")
+    return None
+
+
+async def save_landmarks(image_key: str,
+                         landmarks_str: str) -> None:
+    await face_landmarks_col.update_one(
+        {"image_key": image_key},
+        {"$set": {"landmarks_str": landmarks_str, "detected_at": datetime.now()}},
+        upsert=True
+    )
@@ -0,0 +1,86 @@
+from typing import List
+
+from bson import ObjectId
+
+from datetime import datetime, timedelta
+
+from model.email import OutboxEmail
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from .init import email_outbox_col
+
+
+async def enqueue(email: OutboxEmail) -> str:
+    try:
+        result = await email_outbox_col.insert_one(email.dict())
+    except DuplicateKeyError:
+        # Already queued under the same dedup key, the existing record is the one that gets sent
+        existing = await email_outbox_col.find_one({"dedup_key": email.dedup_key}, {"_id": 1})
+        return str(existing["_id"])
+
+    return str(result.inserted_id)
+
+
+async def claim_batch(limit: int, 
+                      lease_seconds: float) -> List[dict]:
+    now = datetime.now()
+    claimed = []
+
+    # Claim one record at a time so concurrent dispatchers never send the same email.
+    # Records left in "sending" by a dispatcher that died are reclaimed once their lease expires.
+    while len(claimed) < limit:
+        record = await email_outbox_col.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"status": "sending", "lease_until": {"$lte": now}}
+            ]},
+            {"$set": {"status": "sending", 
+                      "lease_until": now + timedelta(seconds=lease_seconds)}},
+            sort=[("next_attempt_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+        if record is None:
+            break
+
+        claimed.append(record)
+
+    return claimed
+
+
+async def mark_sent(record_id: ObjectId) -> None:
+    await email_outbox_col.update_one(
+        {"_id": record_id},
+        {"$set": {"status": "sent", "sent_at": datetime.now(), "lease_until": None}}
+    )
+
+
+async def mark_retry(record_id: ObjectId,
+                     attempts: int,
+                     next_attempt_at: datetime,
+                     error: str) -> None:
+    await email_outbox_col.update_one(
+        {"_id": record_id},
+        {"$set": {"status": "pending", 
+                  "attempts": attempts,
+                  "next_attempt_at": next_attempt_at,
+                  "lease_until": None,
+                  "last_error": error}}
+    )
+
+
+async def mark_failed(record_id: ObjectId,
+                      attempts: int,
+                      error: str) -> None:
+    await email_outbox_col.update_one(
+        {"_id": record_id},
+        {"$set": {"status": "failed", 
+                  "attempts": attempts,
+                  "lease_until": None,
+                  "last_error": error}}
+    )
+
+
+async def count_pending() -> int:
+    return await email_outbox_col.count_documents({"status": {"$in": ["pending", "sending"]}})
@@ -0,0 +1,18 @@
+from typing import Optional
+
+from datetime import datetime
+
+from .init import job_event_col
+
+
+async def create_event(user_id: str,
+                       event: dict) -> None:
+    await job_event_col.insert_one({"user_id": user_id,
+                                    "event": event,
+                                    "created_at": datetime.now()})
+
+
+def watch_events(resume_after: Optional[dict] = None):
+    # Needs a replica set, which every Atlas cluster is
+    return job_event_col.watch([{"$match": {"operationType": "insert"}}],
+                               resume_after=resume_after)
@@ -0,0 +1,217 @@
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+
+from datetime import datetime, timedelta
+
+from model.image_generation import Message
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from .init import comfyui_col
+from ..pagination import after_cursor, get_page, get_page_size, get_projection, get_sort
+
+
+async def update_message(user_id: str, 
+                         status: Optional[str] = None, 
+                         message_id: Optional[str] = None, 
+                         s3_uris: Optional[List[str]] = None):
+    message = Message(
+        user_id=user_id,
+        status=status,
+        message_id=message_id,
+        s3_uris=s3_uris
+    )
+
+    # Only update created_at when status is 'started'
+    if status == 'started':
+        message.created_at = datetime.now()
+
+    update_fields = {key: value for key, value in message.dict().items() if value is not None}
+
+    if message_id:
+        await comfyui_col.update_one(
+            {"_id": ObjectId(message_id)},
+            {"$set": update_fields}
+        )
+    else:
+        result = await comfyui_col.insert_one(update_fields)
+        message_id = str(result.inserted_id)
+    
+    return message_id
+
+
+async def save_workflow(message_id: str,
+                        workflow: dict) -> None:
+    await comfyui_col.update_one(
+        {"_id": ObjectId(message_id)},
+        {"$set": {"workflow": workflow}}
+    )
+
+
+async def get_batch(user_id: str) -> Optional[Message]:
+    # Captured workflows and queued payloads are never needed by the frontend
+    result = await comfyui_col.find_one({"user_id": user_id}, {"workflow": 0, "payload": 0}, sort=[("created_at", DESCENDING)])
+
+    if result:
+        return Message(**result)
+    return None
+
+
+async def get_history(user_id: str,
+                      cursor: Optional[str] = None,
+                      limit: Optional[int] = None) -> Tuple[Optional[List[Message]], Optional[str]]:
+    # Ten batches per page unless asked otherwise, as the endpoint always returned
+    page_size = get_page_size(limit, 10)
+
+    result = await comfyui_col.find(after_cursor({"user_id": user_id, "status": "completed"}, cursor, "created_at"),
+                                    get_projection(Message)) \
+                              .sort(get_sort("created_at")) \
+                              .limit(page_size + 1) \
+                              .to_list(length=page_size + 1)
+
+    result, next_cursor = get_page(result, page_size, "created_at")
+
+    if result:
+        return [Message(**doc) for doc in result], next_cursor
+    return None, None
+
+
+async def enqueue_job(message_id: str,
+                      payload: dict,
+                      fair_start: float = 0.0,
+                      fair_tag: float = 0.0) -> None:
+    now = datetime.now()
+
+    await comfyui_col.update_one(
+        {"_id": ObjectId(message_id)},
+        {"$set": {"dispatch_status": "queued",
+                  "payload": payload,
+                  "attempts": 0,
+                  "fair_start": fair_start,
+                  "fair_tag": fair_tag,
+                  "queued_at": now,
+                  "next_attempt_at": now}}
+    )
+
+
+async def claim_job(backend: str,
+                    lease_seconds: float) -> Optional[dict]:
+    now = datetime.now()
+
+    # Jobs left in "dispatching" by a dispatcher that died are reclaimed once their lease expires
+    return await comfyui_col.find_one_and_update(
+        {"$or": [
+            {"dispatch_status": "queued", "next_attempt_at": {"$lte": now}},
+            {"dispatch_status": "dispatching", "lease_until": {"$lte": now}}
+        ]},
+        {"$set": {"dispatch_status": "dispatching",
+                  "backend": backend,
+                  "lease_until": now + timedelta(seconds=lease_seconds)},
+         "$inc": {"attempts": 1}},
+        sort=[("fair_tag", ASCENDING), ("queued_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def mark_dispatched(job_id: ObjectId) -> None:
+    # A webhook that beat us here has already moved the job on, that outcome stands
+    await comfyui_col.update_one(
+        {"_id": job_id, "dispatch_status": "dispatching"},
+        {"$set": {"dispatch_status": "dispatched",
+                  "dispatched_at": datetime.now(),
+                  "lease_until": None},
+         "$unset": {"payload": ""}}
+    )
+
+
+async def mark_retry(job_id: ObjectId,
+                     next_attempt_at: datetime,
+                     error: str) -> None:
+    await comfyui_col.update_one(
+        {"_id": job_id},
+        {"$set": {"dispatch_status": "queued",
+                  "next_attempt_at": next_attempt_at,
+                  "lease_until": None,
+                  "last_error": error}}
+    )
+
+
+async def mark_failed(job_id: ObjectId,
+                      error: str) -> None:
+    await comfyui_col.update_one(
+        {"_id": job_id},
+        {"$set": {"status": "failed",
+                  "dispatch_status": "failed",
+                  "lease_until": None,
+                  "last_error": error}}
+    )
+
+
+async def finish_job(message_id: str) -> None:
+    await comfyui_col.update_one(
+        {"_id": ObjectId(message_id), "dispatch_status": {"$in": ["dispatching", "dispatched"]}},
+        {"$set": {"dispatch_status": "done", "finished_at": datetime.now()}}
+    )
+
+
+async def time_out_jobs(dispatched_before: datetime) -> int:
+    # Frees the slots of jobs whose backend never reported back, a generation
+    # that did finish keeps its status even if the slot was never freed
+    result = await comfyui_col.update_many(
+        {"dispatch_status": "dispatched", "dispatched_at": {"$lte": dispatched_before}},
+        [{"$set": {"dispatch_status": "timed_out",
+                   "status": {"$cond": [{"$in": ["$status", ["completed", "failed"]]}, "$status", "failed"]}}}]
+    )
+
+    return result.modified_count
+
+
+async def count_in_flight(backend: str) -> int:
+    return await comfyui_col.count_documents({"dispatch_status": {"$in": ["dispatching", "dispatched"]},
+                                              "backend": backend})
+
+
+async def count_active_jobs(user_id: str) -> int:
+    return await comfyui_col.count_documents({"user_id": user_id,
+                                              "dispatch_status": {"$in": ["queued", "dispatching", "dispatched"]}})
+
+
+async def get_virtual_time() -> Optional[float]:
+    # The earliest start tag still waiting, or once nothing waits the latest one served
+    result = await comfyui_col.find_one({"dispatch_status": "queued"},
+                                        {"fair_start": 1},
+                                        sort=[("fair_start", ASCENDING)])
+
+    if result is None:
+        result = await comfyui_col.find_one({"dispatch_status": {"$in": ["dispatching", "dispatched"]}},
+                                            {"fair_start": 1},
+                                            sort=[("fair_start", DESCENDING)])
+
+    if result:
+        return result.get("fair_start")
+    return None
+
+
+async def get_last_finish_tag(user_id: str) -> Optional[float]:
+    result = await comfyui_col.find_one({"user_id": user_id,
+                                         "dispatch_status": {"$in": ["queued", "dispatching", "dispatched"]}},
+                                        {"fair_tag": 1},
+                                        sort=[("fair_tag", DESCENDING)])
+
+    if result:
+        return result.get("fair_tag")
+    return None
+
+
+async def count_queued() -> int:
+    return await comfyui_col.count_documents({"dispatch_status": "queued"})
+
+
+async def get_oldest_queued_at() -> Optional[datetime]:
+    result = await comfyui_col.find_one({"dispatch_status": "queued"},
+                                        {"queued_at": 1},
+                                        sort=[("queued_at", ASCENDING)])
+
+    if result:
+        return result.get("queued_at")
+    return None
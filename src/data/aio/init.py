@@ -0,0 +1,64 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import threading
+
+import os
+
+from ..init import MONGODB_URI, PoolMetricsListener, get_client_options, get_collections
+
+pool_listener = PoolMetricsListener()
+
+mongoClient = None
+_client_lock = threading.Lock()
+
+def get_client() -> AsyncIOMotorClient:
+    """Create the async MongoDB client on first use"""
+
+    global mongoClient
+
+    if mongoClient is None:
+        with _client_lock:
+            if mongoClient is None:
+                mongoClient = AsyncIOMotorClient(MONGODB_URI, **get_client_options(pool_listener))
+
+    return mongoClient
+
+def get_database():
+    return get_client()[f"{os.getenv('MONGODB_DB')}"]
+
+def get_db():
+    """Connect to MongoDB database instance through the async driver"""
+
+    return get_collections(get_database)
+
+def get_pool_stats() -> dict:
+    return pool_listener.get_stats()
+
+(account_col, 
+ insider_account_col,
+ invite_col, 
+ password_reset_col, 
+ payment_account_col,
+ checkout_session_metadata_col, 
+ paypal_checkout_metadata_col,
+ tos_col, 
+ plan_col, 
+ usage_history_col, 
+ comfyui_col,
+ settings_col, 
+ midjourney_col, 
+ midjourney_prompt_col, 
+ referral_col, 
+ payout_submission_col, 
+ payout_history_col, 
+ earnings_col, 
+ statistics_col, 
+ bug_col, 
+ deepfake_col, 
+ social_account_col,
+ email_outbox_col,
+ webhook_event_col,
+ webhook_receipt_col,
+ uploadcare_file_col,
+ face_landmarks_col,
+ job_event_col )= get_db()
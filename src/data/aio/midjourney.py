@@ -0,0 +1,98 @@
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+
+from datetime import datetime, timezone
+
+from model.midjourney import Message
+
+from pymongo import UpdateOne
+from .init import midjourney_col
+from ..midjourney import MESSAGE_PROJECTION, message_cache
+from ..pagination import after_cursor, get_page, get_page_size, get_projection, get_sort
+
+
+async def update(message: Message) -> None:
+    await midjourney_col.update_one(
+        {"messageId": message.messageId},
+        {"$set": message.dict()},
+        upsert=True
+    )
+
+    # The whole message is $set, so it is exactly what Mongo now holds
+    message_cache.set(message.messageId, message)
+
+
+async def update_many(messages: List[Message]) -> None:
+    # Leaves message_cache alone, it may already hold newer progress than these
+    await midjourney_col.bulk_write([
+        UpdateOne({"messageId": message.messageId}, {"$set": message.dict()}, upsert=True)
+        for message in messages
+    ], ordered=False)
+
+
+async def register_job(messageId: str,
+                       ref: str) -> None:
+    # Counts the job as outstanding before its first webhook, without touching one that already landed
+    await midjourney_col.update_one(
+        {"messageId": messageId},
+        {"$setOnInsert": {"ref": ref, "progress": 0, "error": None}},
+        upsert=True
+    )
+
+
+async def count_active_jobs(user_id: str,
+                            since: datetime) -> int:
+    # Messages have no creation date of ours, the _id carries it
+    return await midjourney_col.count_documents({"ref": user_id,
+                                                 "progress": {"$ne": 100},
+                                                 "error": None,
+                                                 "_id": {"$gte": ObjectId.from_datetime(since.astimezone(timezone.utc))}})
+
+
+async def valid_button(messageId: str,
+                       button: str) -> bool:
+    message = message_cache.get(messageId)
+
+    if message is not None and message.buttons and button in message.buttons:
+        return True
+
+    # Buttons only appear once a job completes, so only a cached yes is final
+    result = await midjourney_col.find_one({"messageId": messageId},
+                                           {"_id": 0, "buttons": 1})
+
+    if result is not None and result.get("buttons"):
+        return button in result["buttons"]
+
+    return False
+
+
+async def get_message(messageId: str) -> Optional[Message]:
+    message = message_cache.get(messageId)
+
+    if message is None:
+        result = await midjourney_col.find_one({"messageId": messageId}, MESSAGE_PROJECTION)
+
+        if result is None:
+            return None
+
+        message = Message(**result)
+        message_cache.set(messageId, message)
+
+    return message
+
+
+async def get_history(user_id: str,
+                      cursor: Optional[str] = None,
+                      limit: Optional[int] = None) -> Tuple[List[Message], Optional[str]]:
+    page_size = get_page_size(limit)
+
+    # Messages carry no creation date of ours, _id keeps them in the order they arrived
+    results = await midjourney_col.find(after_cursor({"ref": user_id}, cursor, None), get_projection(Message)) \
+                                  .sort(get_sort(None)) \
+                                  .limit(page_size + 1) \
+                                  .to_list(length=page_size + 1)
+
+    results, next_cursor = get_page(results, page_size, None)
+
+    return [Message(**result) for result in results], next_cursor
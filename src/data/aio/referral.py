@@ -0,0 +1,31 @@
+from pymongo import ReturnDocument
+
+from ..referral import get_earned, get_earnings_update, get_period_updates
+from .init import earnings_col, statistics_col
+
+
+async def update_statistics(user_id: str, 
+                            amount_bought: float, 
+                            clicked: bool, 
+                            signup_ref: bool,
+                            subscription_cancelled: bool):
+    if clicked:
+        increments = {'referral_link_clicks': 1}
+    elif signup_ref:
+        increments = {'referral_link_signups': 1}
+    elif (amount_bought is not None) and amount_bought != 0.00:
+        mask = -1 if subscription_cancelled else 1
+
+        earnings_before = await earnings_col.find_one_and_update(
+            {"user_id": user_id},
+            get_earnings_update(amount_bought, mask),
+            projection={"_id": 0, "total_purchases": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+
+        increments = {'purchases_made': mask, 'earned': get_earned(earnings_before, amount_bought, mask)}
+    else:
+        return
+
+    await statistics_col.bulk_write(get_period_updates(user_id, increments), ordered=False)
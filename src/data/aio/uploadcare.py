@@ -0,0 +1,22 @@
+from typing import Optional
+
+from datetime import datetime
+
+from .init import uploadcare_file_col
+
+
+async def get_file_info(file_id: str) -> Optional[dict]:
+    result = await uploadcare_file_col.find_one({"file_id": file_id}, {"_id": 0, "info": 1})
+
+    if result:
+        return result.get("info")
+    return None
+
+
+async def save_file_info(file_id: str,
+                         info: dict) -> None:
+    await uploadcare_file_col.update_one(
+        {"file_id": file_id},
+        {"$set": {"info": info, "cached_at": datetime.now()}},
+        upsert=True
+    )
@@ -0,0 +1,32 @@
+from model.usage_history import History
+
+from pymongo import ReturnDocument
+
+from ..usage_history import domain_to_index
+from .init import usage_history_col
+
+
+async def update(domain: str, user_id: str) -> None:
+    result = await usage_history_col.find_one_and_update(
+        {"user_id": user_id},
+        {"$inc": {domain_to_index[domain]: 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+    if result is None:
+        raise ValueError("Failed to update the usage history.")
+
+
+async def get(user_id: str) -> History:
+    result = await usage_history_col.find_one({"user_id": user_id})
+
+    if result is not None:
+        return History(**result)
+    else:
+        return History(user_id=user_id,
+                       images_generated=0,
+                       deepfakes_generated=0,
+                       ai_verification_generated=0,
+                       content_utilities_used=0,
+                       people_referred=0)
@@ -0,0 +1,104 @@
+from typing import List, Optional
+
+from bson import ObjectId
+
+from datetime import datetime, timedelta
+
+from model.webhook import WebhookEvent
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from .init import webhook_event_col, webhook_receipt_col
+
+
+async def create_event(event: WebhookEvent) -> str:
+    result = await webhook_event_col.insert_one(event.dict())
+    return str(result.inserted_id)
+
+
+async def claim_event(event_id: str,
+                      lease_seconds: float) -> Optional[dict]:
+    now = datetime.now()
+
+    return await webhook_event_col.find_one_and_update(
+        {"_id": ObjectId(event_id),
+         "$or": [
+             {"status": "pending"},
+             {"status": "processing", "lease_until": {"$lte": now}}
+         ]},
+        {"$set": {"status": "processing", 
+                  "lease_until": now + timedelta(seconds=lease_seconds)},
+         "$inc": {"attempts": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def has_earlier_unprocessed(event: dict) -> bool:
+    # Events of the same subscription received by another worker must be handled first
+    if not event.get("ordering_key"):
+        return False
+
+    earlier = await webhook_event_col.find_one({
+        "provider": event["provider"],
+        "ordering_key": event["ordering_key"],
+        "received_at": {"$lt": event["received_at"]},
+        "status": {"$in": ["pending", "processing"]}
+    }, {"_id": 1})
+
+    return earlier is not None
+
+
+async def release_event(event_id: ObjectId,
+                        error: Optional[str] = None) -> None:
+    await webhook_event_col.update_one(
+        {"_id": event_id},
+        {"$set": {"status": "pending", "lease_until": None, "last_error": error}}
+    )
+
+
+async def defer_event(event_id: ObjectId) -> None:
+    # Waiting behind an earlier event isn't an attempt, the claim's increment is taken back
+    await webhook_event_col.update_one(
+        {"_id": event_id},
+        {"$set": {"status": "pending", "lease_until": None},
+         "$inc": {"attempts": -1}}
+    )
+
+
+async def mark_processed(event_id: ObjectId) -> None:
+    await webhook_event_col.update_one(
+        {"_id": event_id},
+        {"$set": {"status": "processed", "lease_until": None, "processed_at": datetime.now()}}
+    )
+
+
+async def mark_failed(event_id: ObjectId,
+                      error: str) -> None:
+    await webhook_event_col.update_one(
+        {"_id": event_id},
+        {"$set": {"status": "failed", "lease_until": None, "last_error": error}}
+    )
+
+
+async def get_unprocessed(limit: int) -> List[dict]:
+    return await webhook_event_col.find(
+        {"status": {"$in": ["pending", "processing"]}},
+        {"_id": 1, "ordering_key": 1}
+    ).sort("received_at", ASCENDING).to_list(length=limit)
+
+
+async def create_receipt(provider: str,
+                         event_id: str) -> bool:
+    # The unique (provider, event_id) index makes the first delivery win
+    try:
+        await webhook_receipt_col.insert_one({"provider": provider,
+                                              "event_id": event_id,
+                                              "received_at": datetime.now()})
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def delete_receipt(provider: str,
+                         event_id: str) -> None:
+    await webhook_receipt_col.delete_one({"provider": provider, "event_id": event_id})
@@ -8,10 +8,52 @@ from model.billing import (PaymentAccount, TermsOfService, Plan,
                            RadomCheckoutSessionMetadata,
                            PaypalCheckoutMetadata)
 
+from pymongo import ASCENDING
+
 from .init import (payment_account_col, tos_col, plan_col, 
                    checkout_session_metadata_col,
                    paypal_checkout_metadata_col)
 
+# Indexes backing the lookups below, created by data.indexes
+INDEXES = [
+    (payment_account_col, [("user_id", ASCENDING)], {}),
+    (payment_account_col, [("paypal_subscription_id", ASCENDING)], {}),
+    (payment_account_col, [("radom_subscription_id", ASCENDING)], {}),
+    (payment_account_col, [("radom_checkout_session_id", ASCENDING)], {}),
+    (payment_account_col, [("gc_billing_request_id", ASCENDING)], {}),
+    (payment_account_col, [("gc_subscription_id", ASCENDING)], {}),
+    (checkout_session_metadata_col, [("user_id", ASCENDING)], {}),
+    (checkout_session_metadata_col, [("radom_checkout_session_id", ASCENDING)], {}),
+    (paypal_checkout_metadata_col, [("uuid", ASCENDING)], {}),
+    (paypal_checkout_metadata_col, [("paypal_subscription_id", ASCENDING)], {}),
+    (tos_col, [("user_id", ASCENDING)], {}),
+    (plan_col, [("plan_id", ASCENDING)], {"unique": True}),
+]
+
+# Hot query shapes checked for collection scans by data.indexes
+QUERIES = [
+    (payment_account_col, {"user_id": ""}, None),
+    (payment_account_col, {"paypal_subscription_id": ""}, None),
+    (payment_account_col, {"radom_subscription_id": ""}, None),
+    (payment_account_col, {"gc_billing_request_id": ""}, None),
+    (payment_account_col, {"gc_subscription_id": ""}, None),
+    (payment_account_col, {"$or": [{"user_id": ""},
+                                   {"gc_billing_request_id": ""},
+                                   {"gc_subscription_id": ""}]}, None),
+    (checkout_session_metadata_col, {"radom_checkout_session_id": ""}, None),
+    (paypal_checkout_metadata_col, {"uuid": ""}, None),
+]
+
+# The Plan collection is tiny and rarely changes, so it is kept in memory and
+# indexed by every identifier the billing providers refer to it by
+plan_catalog = {
+    "plans": [],
+    "plan_id": {},
+    "paypal_plan_id": {},
+    "radom_product_id": {},
+    "loaded_at": None
+}
+
 def create_payment_account(user_id: str, 
                            provider: Optional[str] = None,
                            paypal_plan_id: Optional[str] = None,
@@ -115,7 +157,7 @@ def set_payment_account_status(user_id: Optional[str] = None,
                                radom_subscription_id: Optional[str] = None,
                                gc_billing_request_id: Optional[str] = None,
                                gc_subscription_id: Optional[str] = None,
-                               status: Optional[str] = None) -> None:
+                               status: Optional[str] = None) -> Optional[str]:
     print("UPDATING PAYMENT ACCOUNT STATUS...")
     
     # Find the payment account by user_id
@@ -132,7 +174,7 @@ def set_payment_account_status(user_id: Optional[str] = None,
                 {"$set": {"status": status}}
             )
             print("UPDATED PAYMENT ACCOUNT")
-            return
+            return payment_account.get("user_id")
         else:
             print("PAYMENT ACCOUNT NOT FOUND")
         
@@ -149,7 +191,7 @@ def set_payment_account_status(user_id: Optional[str] = None,
                 {"$set": {"status": status}}
             )
             print("UPDATED PAYMENT ACCOUNT")
-            return
+            return payment_account.get("user_id")
         else:
             print("PAYMENT ACCOUNT NOT FOUND")
     
@@ -167,7 +209,7 @@ def set_payment_account_status(user_id: Optional[str] = None,
                 {"$set": {"status": status}}
             )
             print("UPDATED PAYMENT ACCOUNT")
-            return
+            return payment_account.get("user_id")
         else:
             print("PAYMENT ACCOUNT NOT FOUND")
 
@@ -185,7 +227,7 @@ def set_payment_account_status(user_id: Optional[str] = None,
                 {"$set": {"status": status}}
             )
             print("UPDATED PAYMENT ACCOUNT")
-            return
+            return payment_account.get("user_id")
         else:
             print("PAYMENT ACCOUNT NOT FOUND")
 
@@ -203,7 +245,7 @@ def set_payment_account_status(user_id: Optional[str] = None,
                 {"$set": {"status": status}}
             )
             print("UPDATED PAYMENT ACCOUNT")
-            return
+            return payment_account.get("user_id")
         else:
             print("PAYMENT ACCOUNT NOT FOUND")
 
@@ -300,13 +342,7 @@ def accept_tos(user_id: str) -> None:
     
 
 def get_available_plans() -> Optional[List[Plan]]:
-    print("GETTING AVAILABLE PLANS")
-
-    results = plan_col.find()
-
-    plans = [Plan(**result) for result in results]
-
-    return plans
+    return list(get_plan_catalog()["plans"])
 
 
 def paypal_create_checkout_session_metadata(user_id: str, 
@@ -422,32 +458,46 @@ def get_radom_checkout_session_metadata(radom_checkout_session_id: Optional[str]
     # If no result is found, return None
     return None
 
+def load_plan_catalog() -> int:
+    global plan_catalog
+
+    print("LOADING PLAN CATALOG")
+
+    plans = [Plan(**result) for result in plan_col.find()]
+
+    # Build the indexes aside and swap them in at once so readers never see
+    # a partially loaded catalog
+    plan_catalog = {
+        "plans": plans,
+        "plan_id": {plan.plan_id: plan for plan in plans},
+        "paypal_plan_id": {plan.paypal_plan_id: plan for plan in plans if plan.paypal_plan_id},
+        "radom_product_id": {plan.radom_product_id: plan for plan in plans if plan.radom_product_id},
+        "loaded_at": datetime.now()
+    }
+
+    return len(plans)
+
+
+def get_plan_catalog() -> dict:
+    if plan_catalog["loaded_at"] is None:
+        load_plan_catalog()
+
+    return plan_catalog
+
+
 def get_product(paypal_plan_id: Optional[str] = None,
                 radom_product_id: Optional[str] = None,
                 plan_id: Optional[str] = None) -> Optional[Plan]:
-    
-    print("GETTING PRODUCT...")
-    
-    query = {}
+    catalog = get_plan_catalog()
+
     if paypal_plan_id:
-        print("PAYPAL PLAN ID IS NOT NULL: ", paypal_plan_id)
-        query = {"paypal_plan_id": paypal_plan_id}
+        result = catalog["paypal_plan_id"].get(paypal_plan_id)
     elif radom_product_id:
-        print("RADOM PRODUCT ID IS NOT NULL: ", radom_product_id)
-        query = {"radom_product_id": radom_product_id}
+        result = catalog["radom_product_id"].get(radom_product_id)
     else:
-        print("PLAN ID IS NOT NULL: ", plan_id)
-        query = {"plan_id": plan_id}
+        result = catalog["plan_id"].get(plan_id)
 
-    print("LOOKING FOR RADOM PRODUCT/PAYPAL PLAN...")
-    # Query the MongoDB collection based on the non-None field
-    result = plan_col.find_one(query)
-    
-    # If a result is found, convert it to a Plan instance
-    if result:
-        print("RADOM PRODUCT/PAYPAL PLAN FOUND: ", result)
-        return Plan(**result)
-    
-    print("RADOM PRODUCT/PAYPAL PLAN NOT FOUND: ", result)
-    # If no result is found, return None
-    return None
\ No newline at end of file
+    if result is None:
+        print(f"PLAN NOT FOUND IN CATALOG: {paypal_plan_id or radom_product_id or plan_id}")
+
+    return result
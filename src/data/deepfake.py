@@ -1,11 +1,32 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from datetime import datetime
 
+import os
+
 from model.deepfake import Message
 
-from pymongo import ReturnDocument, DESCENDING
-from .init import deepfake_col
+from pymongo import ReturnDocument, ASCENDING, DESCENDING
+from .init import deepfake_col, face_landmarks_col
+from .pagination import after_cursor, get_page, get_page_size, get_projection, get_sort
+
+# How long detected face landmarks are reused, in memory and in Mongo
+AKOOL_LANDMARK_TTL_SECONDS = int(os.getenv('AKOOL_LANDMARK_TTL_SECONDS', 30 * 24 * 3600))
+
+# Indexes backing the lookups below, created by data.indexes
+INDEXES = [
+    (deepfake_col, [("job_id", ASCENDING)], {}),
+    (deepfake_col, [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], {}),
+    (face_landmarks_col, [("image_key", ASCENDING)], {"unique": True}),
+    (face_landmarks_col, [("detected_at", ASCENDING)], {"expireAfterSeconds": AKOOL_LANDMARK_TTL_SECONDS}),
+]
+
+# Hot query shapes checked for collection scans by data.indexes
+QUERIES = [
+    (deepfake_col, {"job_id": ""}, None),
+    (deepfake_col, {"user_id": ""}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    (face_landmarks_col, {"image_key": ""}, None),
+]
 
 
 def create_message(user_id: Optional[str] = None,
@@ -84,9 +105,15 @@ def get_message(job_id: str) -> Optional[Message]:
     return None
 
 
-def get_history(user_id: str) -> Optional[List[Message]]:
-    results = deepfake_col.find({"user_id": user_id}).sort("created_at", DESCENDING)
+def get_history(user_id: str,
+                cursor: Optional[str] = None,
+                limit: Optional[int] = None) -> Tuple[List[Message], Optional[str]]:
+    page_size = get_page_size(limit)
+
+    results = deepfake_col.find(after_cursor({"user_id": user_id}, cursor, "created_at"), get_projection(Message)) \
+                          .sort(get_sort("created_at")) \
+                          .limit(page_size + 1)
 
-    messages = [Message(**result) for result in results]
+    results, next_cursor = get_page(list(results), page_size, "created_at")
 
-    return messages
\ No newline at end of file
+    return [Message(**result) for result in results], next_cursor
\ No newline at end of file
@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from pymongo import ASCENDING
+
+from .init import email_outbox_col
+
+# The outbox is read and written from the event loop through data.aio.email,
+# only its indexes are declared here for data.indexes
+
+# Indexes backing the lookups below, created by data.indexes
+INDEXES = [
+    (email_outbox_col, [("status", ASCENDING), ("next_attempt_at", ASCENDING)], {}),
+    (email_outbox_col, [("status", ASCENDING), ("lease_until", ASCENDING)], {}),
+    (email_outbox_col, [("dedup_key", ASCENDING)], {"unique": True, "partialFilterExpression": {"dedup_key": {"$type": "string"}}}),
+]
+
+# Hot query shapes checked for collection scans by data.indexes
+QUERIES = [
+    (email_outbox_col, {"status": "pending", "next_attempt_at": {"$lte": datetime(1970, 1, 1)}}, [("next_attempt_at", ASCENDING)]),
+]
@@ -0,0 +1,16 @@
+import os
+
+from pymongo import ASCENDING
+
+from .init import job_event_col
+
+# Job events are written and watched from the event loop through data.aio.events,
+# only their indexes are declared here for data.indexes
+
+# Events only need to live long enough for every worker's change stream to see them
+EVENTS_TTL_SECONDS = int(os.getenv('EVENTS_TTL_SECONDS', 3600))
+
+# Indexes backing the lookups below, created by data.indexes
+INDEXES = [
+    (job_event_col, [("created_at", ASCENDING)], {"expireAfterSeconds": EVENTS_TTL_SECONDS}),
+]
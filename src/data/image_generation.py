@@ -1,4 +1,4 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 
 from bson import ObjectId
 
@@ -6,8 +6,34 @@ from datetime import datetime
 
 from model.image_generation import Settings, Message
 
-from pymongo import ReturnDocument, DESCENDING
+from pymongo import ReturnDocument, ASCENDING, DESCENDING
 from .init import comfyui_col, settings_col
+from .pagination import after_cursor, get_page, get_page_size, get_projection, get_sort
+
+# Indexes backing the lookups below, created by data.indexes
+INDEXES = [
+    (comfyui_col, [("user_id", ASCENDING), ("created_at", DESCENDING)], {}),
+    (comfyui_col, [("user_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], {}),
+    (comfyui_col, [("dispatch_status", ASCENDING), ("queued_at", ASCENDING)], {"sparse": True}),
+    (comfyui_col, [("dispatch_status", ASCENDING), ("fair_tag", ASCENDING), ("queued_at", ASCENDING)], {"sparse": True}),
+    (comfyui_col, [("user_id", ASCENDING), ("dispatch_status", ASCENDING), ("fair_tag", DESCENDING)], {}),
+    (comfyui_col, [("dispatch_status", ASCENDING), ("fair_start", ASCENDING)], {"sparse": True}),
+    (comfyui_col, [("dispatch_status", ASCENDING), ("backend", ASCENDING)], {"sparse": True}),
+    (comfyui_col, [("dispatch_status", ASCENDING), ("dispatched_at", ASCENDING)], {"sparse": True}),
+]
+
+# Hot query shapes checked for collection scans by data.indexes
+QUERIES = [
+    (comfyui_col, {"user_id": ""}, [("created_at", DESCENDING)]),
+    (comfyui_col, {"user_id": "", "status": "completed"}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    (comfyui_col, {"dispatch_status": "queued"}, [("queued_at", ASCENDING)]),
+    (comfyui_col, {"dispatch_status": "queued"}, [("fair_tag", ASCENDING), ("queued_at", ASCENDING)]),
+    (comfyui_col, {"user_id": "", "dispatch_status": {"$in": ["queued", "dispatching", "dispatched"]}}, None),
+    (comfyui_col, {"user_id": "", "dispatch_status": {"$in": ["queued", "dispatching", "dispatched"]}}, [("fair_tag", DESCENDING)]),
+    (comfyui_col, {"dispatch_status": "queued"}, [("fair_start", ASCENDING)]),
+    (comfyui_col, {"dispatch_status": {"$in": ["dispatching", "dispatched"]}, "backend": ""}, None),
+    (comfyui_col, {"dispatch_status": "dispatched", "dispatched_at": {"$lte": datetime(1970, 1, 1)}}, None),
+]
 
 def update_message(user_id: str, 
                    status: Optional[str] = None, 
@@ -57,15 +83,20 @@ def get_batch(user_id: str) -> Optional[Message]:
         return None
     
 
-def get_history(user_id: str) -> Optional[List[Message]]:
-    cursor = comfyui_col.find({
-        "user_id": user_id, "status": "completed"
-    }).sort("created_at", DESCENDING).limit(10)
-    
-    result = list(cursor)
-    
+def get_history(user_id: str,
+                cursor: Optional[str] = None,
+                limit: Optional[int] = None) -> Tuple[Optional[List[Message]], Optional[str]]:
+    page_size = get_page_size(limit, 10)
+
+    result = comfyui_col.find(after_cursor({"user_id": user_id, "status": "completed"}, cursor, "created_at"),
+                              get_projection(Message)) \
+                        .sort(get_sort("created_at")) \
+                        .limit(page_size + 1)
+
+    result, next_cursor = get_page(list(result), page_size, "created_at")
+
     if result:
         messages = [Message(**doc) for doc in result]
-        return messages
+        return messages, next_cursor
     else:
-        return None
\ No newline at end of file
+        return None, None
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""Creates the indexes declared next to each data module and reports the
+declared hot queries that would still scan a whole collection.
+
+Run from src/ with `python -m data.indexes` to create the indexes, or with
+`python -m data.indexes --check` to only report collection scans.
+"""
+
+from typing import List
+
+import argparse
+
+from pymongo.errors import OperationFailure
+
+from . import (account, ai_verification, billing, deepfake, email, events,
+               image_generation, midjourney, referral, uploadcare, usage_history,
+               webhook)
+
+DATA_MODULES = [
+    account,
+    ai_verification,
+    billing,
+    deepfake,
+    email,
+    events,
+    image_generation,
+    midjourney,
+    referral,
+    uploadcare,
+    usage_history,
+    webhook
+]
+
+
+def ensure_indexes() -> List[str]:
+    """Create every declared index, existing ones are left untouched"""
+
+    failures = []
+
+    for module in DATA_MODULES:
+        for collection, keys, options in getattr(module, "INDEXES", []):
+            try:
+                name = collection.create_index(keys, **options)
+                print(f"INDEX READY: {collection.name}.{name}")
+            except OperationFailure as e:
+                failure = f"{collection.name} {keys}: {e}"
+                print(f"FAILED TO CREATE INDEX {failure}")
+                failures.append(failure)
+
+    return failures
+
+
+def uses_collection_scan(plan) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(uses_collection_scan(value) for value in plan.values())
+
+    if isinstance(plan, list):
+        return any(uses_collection_scan(value) for value in plan)
+
+    return False
+
+
+def find_collection_scans() -> List[str]:
+    """Explain every declared hot query and return those without an index"""
+
+    scans = []
+
+    for module in DATA_MODULES:
+        for collection, query, sort in getattr(module, "QUERIES", []):
+            cursor = collection.find(query)
+
+            if sort:
+                cursor = cursor.sort(sort)
+
+            winning_plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+
+            if uses_collection_scan(winning_plan):
+                scan = f"{collection.name} {query} sort={sort}"
+                print(f"COLLECTION SCAN: {scan}")
+                scans.append(scan)
+
+    return scans
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Create and verify MongoDB indexes")
+    parser.add_argument("--check", action="store_true", help="only report queries that would collection-scan")
+    args = parser.parse_args()
+
+    failures = [] if args.check else ensure_indexes()
+    scans = find_collection_scans()
+
+    if failures or scans:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
 
 from dotenv import load_dotenv
 
+import threading
+
+import time
+
 import os
 
 # Determine the environment (default to production)
@@ -18,38 +22,181 @@ else:
 # Load the .env file
 load_dotenv(env_file)
 
-mongoClient = MongoClient(
-    f"mongodb+srv://{os.getenv('MONGODB_CREDENTIALS')}@atlascluster.2zt2wrb.mongodb.net/",
-    uuidRepresentation="standard"
-)
+MONGODB_URI = f"mongodb+srv://{os.getenv('MONGODB_CREDENTIALS')}@atlascluster.2zt2wrb.mongodb.net/"
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Counts connection checkouts and the time spent waiting for them"""
+
+    def __init__(self):
+        self.stats = {
+            "connections_open": 0,
+            "checked_out": 0,
+            "max_checked_out": 0,
+            "checkouts": 0,
+            "checkout_failures": 0,
+            "wait_time_total_ms": 0.0,
+            "wait_time_max_ms": 0.0,
+            "pool_cleared": 0
+        }
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.stats["pool_cleared"] += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.stats["connections_open"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.stats["connections_open"] -= 1
+
+    def connection_check_out_started(self, event):
+        # Checkout start and end are reported from the same thread
+        self._local.started_at = time.monotonic()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.stats["checkout_failures"] += 1
+
+    def connection_checked_out(self, event):
+        started_at = getattr(self._local, "started_at", None)
+        waited_ms = (time.monotonic() - started_at) * 1000 if started_at else 0.0
+
+        with self._lock:
+            self.stats["checkouts"] += 1
+            self.stats["checked_out"] += 1
+            self.stats["max_checked_out"] = max(self.stats["max_checked_out"], self.stats["checked_out"])
+            self.stats["wait_time_total_ms"] += waited_ms
+            self.stats["wait_time_max_ms"] = max(self.stats["wait_time_max_ms"], waited_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.stats["checked_out"] -= 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+
+        stats["wait_time_avg_ms"] = stats["wait_time_total_ms"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+
+class LazyCollection:
+    """Collection handle that resolves the client on first use"""
+
+    def __init__(self, get_database, name: str):
+        self._get_database = get_database
+        self._name = name
+        self._collection = None
+
+    def _resolve(self):
+        if self._collection is None:
+            self._collection = self._get_database()[self._name]
+        return self._collection
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+
+def get_client_options(pool_listener: PoolMetricsListener) -> dict:
+    """Connection pool settings of this deployment, read from the env file"""
+
+    options = {
+        "uuidRepresentation": "standard",
+        "maxPoolSize": int(os.getenv('MONGODB_MAX_POOL_SIZE', 100)),
+        "minPoolSize": int(os.getenv('MONGODB_MIN_POOL_SIZE', 0)),
+        "readPreference": os.getenv('MONGODB_READ_PREFERENCE', 'primary'),
+        "event_listeners": [pool_listener]
+    }
+
+    if os.getenv('MONGODB_MAX_IDLE_TIME_MS'):
+        options["maxIdleTimeMS"] = int(os.getenv('MONGODB_MAX_IDLE_TIME_MS'))
+
+    if os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS'):
+        options["waitQueueTimeoutMS"] = int(os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS'))
+
+    if os.getenv('MONGODB_COMPRESSORS'):
+        options["compressors"] = os.getenv('MONGODB_COMPRESSORS')
+
+    return options
+
+
+pool_listener = PoolMetricsListener()
+
+mongoClient = None
+_client_lock = threading.Lock()
+
+def get_client() -> MongoClient:
+    """Create the MongoDB client on first use"""
+
+    global mongoClient
+
+    if mongoClient is None:
+        with _client_lock:
+            if mongoClient is None:
+                mongoClient = MongoClient(MONGODB_URI, **get_client_options(pool_listener))
+
+    return mongoClient
+
+def get_database():
+    return get_client()[f"{os.getenv('MONGODB_DB')}"]
 
 def get_db():
     """Connect to MongoDB database instance"""
 
-    db = mongoClient[f"{os.getenv('MONGODB_DB')}"]
-    account_col = db['Account']
-    insider_account_col = db['InsiderAccount']
-    invite_col = db['Invite']
-    password_reset_col = db['PasswordReset']
-    payment_account_col = db['PaymentAccount']
-    checkout_session_metadata_col = db['RadomCheckoutSessionMetadata']
-    paypal_checkout_metadata_col = db['PaypalCheckoutMetadata']
-    tos_col = db['TermsOfService']
-    plan_col = db['Plan']
-    usage_history_col = db['UsageHistory']
-    comfyui_col = db['ComfyUI']
-    settings_col = db['Settings']
-    midjourney_col = db['Midjourney']
-    midjourney_prompt_col = db['MidjourneyPrompt']
-    referral_col = db['Referral']
-    payout_submission_col = db['PayoutSubmission']
-    payout_history_col = db['PayoutHistory']
-    earnings_col = db['Earnings']
-    statistics_col = db['Statistics']
-    bug_col = db['Bug']
-    deepfake_col = db['Deepfake']
-    social_account_col = db['SocialAccount']
-    # member_col = db['Member']
+    return get_collections(get_database)
+
+def get_pool_stats() -> dict:
+    return pool_listener.get_stats()
+
+def get_collections(get_database):
+    """Lazy collection handles of a database (sync or async driver)"""
+
+    account_col = LazyCollection(get_database, 'Account')
+    insider_account_col = LazyCollection(get_database, 'InsiderAccount')
+    invite_col = LazyCollection(get_database, 'Invite')
+    password_reset_col = LazyCollection(get_database, 'PasswordReset')
+    payment_account_col = LazyCollection(get_database, 'PaymentAccount')
+    checkout_session_metadata_col = LazyCollection(get_database, 'RadomCheckoutSessionMetadata')
+    paypal_checkout_metadata_col = LazyCollection(get_database, 'PaypalCheckoutMetadata')
+    tos_col = LazyCollection(get_database, 'TermsOfService')
+    plan_col = LazyCollection(get_database, 'Plan')
+    usage_history_col = LazyCollection(get_database, 'UsageHistory')
+    comfyui_col = LazyCollection(get_database, 'ComfyUI')
+    settings_col = LazyCollection(get_database, 'Settings')
+    midjourney_col = LazyCollection(get_database, 'Midjourney')
+    midjourney_prompt_col = LazyCollection(get_database, 'MidjourneyPrompt')
+    referral_col = LazyCollection(get_database, 'Referral')
+    payout_submission_col = LazyCollection(get_database, 'PayoutSubmission')
+    payout_history_col = LazyCollection(get_database, 'PayoutHistory')
+    earnings_col = LazyCollection(get_database, 'Earnings')
+    statistics_col = LazyCollection(get_database, 'Statistics')
+    bug_col = LazyCollection(get_database, 'Bug')
+    deepfake_col = LazyCollection(get_database, 'Deepfake')
+    social_account_col = LazyCollection(get_database, 'SocialAccount')
+    email_outbox_col = LazyCollection(get_database, 'EmailOutbox')
+    webhook_event_col = LazyCollection(get_database, 'WebhookEvent')
+    webhook_receipt_col = LazyCollection(get_database, 'WebhookReceipt')
+    uploadcare_file_col = LazyCollection(get_database, 'UploadcareFile')
+    face_landmarks_col = LazyCollection(get_database, 'FaceLandmarks')
+    job_event_col = LazyCollection(get_database, 'JobEvent')
+    # member_col = LazyCollection(get_database, 'Member')
 
     return (account_col, 
             insider_account_col,
@@ -72,7 +219,13 @@ def get_db():
             statistics_col, 
             bug_col, 
             deepfake_col, 
-            social_account_col)
+            social_account_col,
+            email_outbox_col,
+            webhook_event_col,
+            webhook_receipt_col,
+            uploadcare_file_col,
+            face_landmarks_col,
+            job_event_col)
 
 (account_col, 
  insider_account_col,
@@ -95,4 +248,10 @@ def get_db():
  statistics_col, 
  bug_col, 
  deepfake_col, 
- social_account_col )= get_db()
\ No newline at end of file
+ social_account_col,
+ email_outbox_col,
+ webhook_event_col,
+ webhook_receipt_col,
+ uploadcare_file_col,
+ face_landmarks_col,
+ job_event_col )= get_db()
\ No newline at end of file
@@ -1,44 +1,87 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
+
+import os
+
+from cache import TTLCache
 
 from model.midjourney import Message
 
-from pymongo import ReturnDocument
+from pymongo import ASCENDING, DESCENDING
 from .init import midjourney_col
+from .pagination import after_cursor, get_page, get_page_size, get_projection, get_sort
+
+# Indexes backing the lookups below, created by data.indexes
+INDEXES = [
+    (midjourney_col, [("messageId", ASCENDING)], {"unique": True}),
+    (midjourney_col, [("ref", ASCENDING), ("_id", DESCENDING)], {}),
+]
+
+# Hot query shapes checked for collection scans by data.indexes
+QUERIES = [
+    (midjourney_col, {"messageId": ""}, None),
+    (midjourney_col, {"ref": ""}, [("_id", DESCENDING)]),
+]
+
+# Recent messages keyed by messageId, set by update as the webhooks land so that
+# action validation and message polling rarely go to Mongo. Another worker's
+# webhook isn't seen here until the entry expires.
+message_cache = TTLCache(maxsize=int(os.getenv('MIDJOURNEY_MESSAGE_CACHE_MAXSIZE', 10000)),
+                         ttl=float(os.getenv('MIDJOURNEY_MESSAGE_CACHE_TTL_SECONDS', 30)))
+
+MESSAGE_PROJECTION = {**get_projection(Message), "_id": 0}
 
 
 def update(message: Message) -> None:
-    midjourney_col.find_one_and_update(
+    midjourney_col.update_one(
         {"messageId": message.messageId},
         {"$set": message.dict()},
-        upsert=True,
-        return_document=ReturnDocument.AFTER
+        upsert=True
     )
 
+    # The whole message is $set, so it is exactly what Mongo now holds
+    message_cache.set(message.messageId, message)
+
 def valid_button(messageId: str,
                  button: str) -> bool:
     print("VALIDATING ACTION")
-    result = midjourney_col.find_one({"messageId": messageId})
+    message = message_cache.get(messageId)
 
-    if result is not None:
-        message = Message(**result)
-        
-        if message and message.buttons:
-            return button in message.buttons
+    if message is not None and message.buttons and button in message.buttons:
+        return True
+
+    # Buttons only appear once a job completes, so only a cached yes is final
+    result = midjourney_col.find_one({"messageId": messageId}, {"_id": 0, "buttons": 1})
+
+    if result is not None and result.get("buttons"):
+        return button in result["buttons"]
     
     return False
 
 def get_message(messageId: str) -> Optional[Message]:
     print("GETTING MESSAGE")
-    result =  midjourney_col.find_one({"messageId": messageId})
+    message = message_cache.get(messageId)
+
+    if message is None:
+        result = midjourney_col.find_one({"messageId": messageId}, MESSAGE_PROJECTION)
+
+        if result is None:
+            return None
 
-    if result is not None:
         message = Message(**result)
-        return message
-    return None
+        message_cache.set(messageId, message)
+
+    return message
+
+def get_history(user_id: str,
+                cursor: Optional[str] = None,
+                limit: Optional[int] = None) -> Tuple[List[Message], Optional[str]]:
+    page_size = get_page_size(limit)
 
-def get_history(user_id: str) -> List[Message]:
-    results = midjourney_col.find({"ref": user_id})
+    # Messages carry no creation date of ours, _id keeps them in the order they arrived
+    results = midjourney_col.find(after_cursor({"ref": user_id}, cursor, None), get_projection(Message)) \
+                            .sort(get_sort(None)) \
+                            .limit(page_size + 1)
 
-    messages = [Message(**result) for result in results]
+    results, next_cursor = get_page(list(results), page_size, None)
 
-    return messages[::-1]
\ No newline at end of file
+    return [Message(**result) for result in results], next_cursor
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""Keyset pagination for the history reads.
+
+Pages run newest first on (sort field, _id) and the cursor holds the sort key
+of the last document returned, so every page is a range scan on the
+(user, sort field, _id) index however deep the user pages.
+"""
+
+from typing import List, Optional, Tuple
+
+from datetime import datetime
+
+import base64
+
+import json
+
+import os
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from pymongo import DESCENDING
+
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 20))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv('HISTORY_MAX_PAGE_SIZE', 100))
+
+
+def get_page_size(limit: Optional[int],
+                  default: int = HISTORY_PAGE_SIZE) -> int:
+    if limit is None:
+        return default
+
+    return max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+
+
+def get_projection(model) -> dict:
+    # Only what the response model returns, internal fields never leave Mongo
+    return {field: 1 for field in model.model_fields}
+
+
+def get_sort(sort_field: Optional[str]) -> List[Tuple[str, int]]:
+    # Collections without a creation date page on _id, which follows insertion order
+    if sort_field:
+        return [(sort_field, DESCENDING), ("_id", DESCENDING)]
+
+    return [("_id", DESCENDING)]
+
+
+def encode_cursor(document: dict,
+                  sort_field: Optional[str]) -> str:
+    key = {"_id": str(document["_id"])}
+
+    if sort_field:
+        value = document.get(sort_field)
+        key[sort_field] = value.isoformat() if isinstance(value, datetime) else value
+
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str,
+                  sort_field: Optional[str]) -> dict:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+
+        after = {"_id": ObjectId(key["_id"])}
+
+        if sort_field:
+            value = key[sort_field]
+            after[sort_field] = datetime.fromisoformat(value) if isinstance(value, str) else value
+
+        return after
+    except (ValueError, TypeError, KeyError, InvalidId):
+        raise ValueError("Invalid cursor.")
+
+
+def after_cursor(query: dict,
+                 cursor: Optional[str],
+                 sort_field: Optional[str]) -> dict:
+    """Narrow a history query to the documents that come after the cursor"""
+
+    if not cursor:
+        return query
+
+    after = decode_cursor(cursor, sort_field)
+
+    if not sort_field:
+        return {**query, "_id": {"$lt": after["_id"]}}
+
+    value = after[sort_field]
+    same_key = {sort_field: value, "_id": {"$lt": after["_id"]}}
+
+    # Documents without the sort field come last in a descending sort
+    if value is None:
+        return {**query, **same_key}
+
+    return {**query, "$or": [{sort_field: {"$lt": value}}, same_key, {sort_field: None}]}
+
+
+def get_page(documents: list,
+             page_size: int,
+             sort_field: Optional[str]) -> Tuple[list, Optional[str]]:
+    """Split off the extra document fetched past the page, it only tells whether another page exists"""
+
+    if len(documents) > page_size:
+        documents = documents[:page_size]
+        return documents, encode_cursor(documents[-1], sort_field)
+
+    return documents, None
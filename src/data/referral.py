@@ -4,12 +4,31 @@ from model.referral import Referral, Earnings, Statistics, PayoutSubmission, Pay
 
 from .init import referral_col, payout_submission_col, earnings_col, statistics_col, payout_history_col
 
-from pymongo import DESCENDING
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
 
 from uuid import uuid4
 
 from datetime import datetime, timedelta
 
+# Indexes backing the lookups below, created by data.indexes
+INDEXES = [
+    (referral_col, [("referral_id", ASCENDING)], {"unique": True}),
+    (referral_col, [("host_id", ASCENDING)], {}),
+    (earnings_col, [("user_id", ASCENDING)], {"unique": True}),
+    (statistics_col, [("user_id", ASCENDING), ("period", ASCENDING), ("period_date", ASCENDING)], {"unique": True}),
+    (payout_history_col, [("user_id", ASCENDING)], {}),
+    (payout_submission_col, [("user_id", ASCENDING)], {}),
+]
+
+# Hot query shapes checked for collection scans by data.indexes
+QUERIES = [
+    (referral_col, {"referral_id": ""}, None),
+    (referral_col, {"host_id": ""}, None),
+    (earnings_col, {"user_id": ""}, None),
+    (statistics_col, {"user_id": "", "period": "weekly", "period_date": datetime(1970, 1, 1)}, None),
+    (payout_history_col, {"user_id": ""}, None),
+]
+
 def generate_link(user_id: str) -> str:
     referral_id = str(uuid4())
 
@@ -82,19 +101,20 @@ def get_tier_percentage(user_id: str) -> int:
     if not earnings:
         return 20  # Default tier percentage for users with no earnings record
 
-    total_purchases = earnings.get('total_purchases', 0)
+    return tier_percentage(earnings.get('total_purchases', 0))
 
-    # Define referral levels
-    levels = [
-        (400, 40),
-        (200, 35),
-        (100, 30),
-        (50, 25),
-        (0, 20)  # Default level 1 with 20% recurring
-    ]
+# Referral levels, (total purchases, recurring percentage)
+TIER_LEVELS = [
+    (400, 40),
+    (200, 35),
+    (100, 30),
+    (50, 25),
+    (0, 20)  # Default level 1 with 20% recurring
+]
 
+def tier_percentage(total_purchases: int) -> int:
     # Determine the user's tier percentage based on total_purchases
-    for threshold, percentage in levels:
+    for threshold, percentage in TIER_LEVELS:
         if total_purchases >= threshold:
             return percentage
 
@@ -110,94 +130,90 @@ def get_referral(referral_id: str) -> Optional[Referral]:
 
     return None
 
-# TODO: we should not add earnings and stats for ppl who have created a link and cancelled or bought a plan again,
-#       cause this will update their earnings stats which should not ,cause we only count for ppl who are outsiders
-def update_statistics(user_id: str, 
-                      amount_bought: float, 
-                      clicked: bool, 
-                      signup_ref: bool,
-                      subscription_cancelled: bool):
-    print("UPDATING STATISTICS")
+def get_periods() -> dict:
     now = datetime.now()
     week_start = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)  # Monday at midnight
     month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)  # First day of the month at midnight
     year_start = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)  # First day of the year at midnight
 
-    periods = {
+    return {
         "weekly": week_start,
         "monthly": month_start,
         "yearly": year_start
     }
 
-    print(f"PERIODS: {periods}")
+def get_period_updates(user_id: str,
+                       increments: dict) -> List[UpdateOne]:
+    # One upsert per period, sent together in a single bulk_write
+    return [
+        UpdateOne({"user_id": user_id, "period": period, "period_date": start_date},
+                  {'$inc': increments},
+                  upsert=True)
+        for period, start_date in get_periods().items()
+    ]
+
+def get_earnings_update(amount_bought: float,
+                        mask: int) -> List[dict]:
+    """Pipeline update crediting a purchase at the tier reached before it, in one atomic write"""
+
+    total_purchases = {"$ifNull": ["$total_purchases", 0]}
+    percentage = {
+        "$switch": {
+            "branches": [{"case": {"$gte": [total_purchases, threshold]}, "then": percentage}
+                         for threshold, percentage in TIER_LEVELS],
+            "default": 20
+        }
+    }
+
+    return [{
+        "$set": {
+            "amount": {"$add": [{"$ifNull": ["$amount", 0]},
+                                {"$multiply": [mask * amount_bought / 100, percentage]}]},
+            "total_purchases": {"$add": [total_purchases, mask]}
+        }
+    }]
+
+def get_earned(earnings_before: Optional[dict],
+               amount_bought: float,
+               mask: int) -> float:
+    # Same tier the pipeline used, from the document as it was before the update
+    total_purchases = earnings_before.get('total_purchases', 0) if earnings_before else 0
+
+    return mask * amount_bought * tier_percentage(total_purchases) / 100
+
+# TODO: we should not add earnings and stats for ppl who have created a link and cancelled or bought a plan again,
+#       cause this will update their earnings stats which should not ,cause we only count for ppl who are outsiders
+def update_statistics(user_id: str, 
+                      amount_bought: float, 
+                      clicked: bool, 
+                      signup_ref: bool,
+                      subscription_cancelled: bool):
+    print("UPDATING STATISTICS")
 
     if clicked:
-        for period, start_date in periods.items():
-            updates = {
-                '$inc': {
-                    'referral_link_clicks': 1
-                }
-            }
-            result = statistics_col.find_one_and_update(
-                {"user_id": user_id, "period": period, "period_date": start_date},
-                updates,
-                upsert=True
-            )
-            print(f"Update click stats for {user_id} in {period}: {result}")
+        increments = {'referral_link_clicks': 1}
     elif signup_ref:
-        for period, start_date in periods.items():
-            updates = {
-                '$inc': {
-                    'referral_link_signups': 1
-                }
-            }
-            result = statistics_col.find_one_and_update(
-                {"user_id": user_id, "period": period, "period_date": start_date},
-                updates,
-                upsert=True
-            )
-            print(f"Update signup stats for {user_id} in {period}: {result}")
+        increments = {'referral_link_signups': 1}
     elif (amount_bought is not None) and amount_bought != 0.00:
-        result_earnings = earnings_col.find_one_and_update(
+        mask = -1 if subscription_cancelled else 1
+
+        earnings_before = earnings_col.find_one_and_update(
             {"user_id": user_id},
-            updates_earnings,
-            upsert=True
+            get_earnings_update(amount_bought, mask),
+            projection={"_id": 0, "total_purchases": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
         )
 
-        result_earnings = earnings_col.find_one({"user_id": user_id})
-
-        percentage = result_earnings.percentage if result_earnings else 20
+        amount = get_earned(earnings_before, amount_bought, mask)
+        print(f"Update earnings for {user_id}: {amount}")
 
-        mask = -1 if subscription_cancelled else 1
-        amount = mask * amount_bought * percentage
-        for period, start_date in periods.items():
-            updates_stats = {
-                '$inc': {
-                    'purchases_made': mask,
-                    'earned': amount
-                }
-            }
-
-            result_stats = statistics_col.find_one_and_update(
-                {"user_id": user_id, "period": period, "period_date": start_date},
-                updates_stats,
-                upsert=True
-            )
-            print(f"Update purchase stats for {user_id} in {period}: {result_stats}")
-
-        updates_earnings = {
-            '$inc': {
-                'amount': amount,
-                'total_purchases': mask
-            }
-        }
+        increments = {'purchases_made': mask, 'earned': amount}
+    else:
+        return
 
-        result_earnings = earnings_col.find_one_and_update(
-            {"user_id": user_id},
-            updates_earnings,
-            upsert=True
-        )
-        print(f"Update earnings for {user_id}: {result_earnings}")
+    result = statistics_col.bulk_write(get_period_updates(user_id, increments), ordered=False)
+    print(f"Update stats for {user_id}: {increments}, upserted {result.upserted_count}")
 
 
 def get_statistics(user_id: str) -> List[Statistics]:
@@ -0,0 +1,22 @@
+import os
+
+from pymongo import ASCENDING
+
+from .init import uploadcare_file_col
+
+# Uploadcare file info is cached from the event loop through data.aio.uploadcare,
+# only its indexes are declared here for data.indexes
+
+# Uploadcare files never change, the TTL only drops entries of deleted files eventually
+UPLOADCARE_INFO_MONGO_TTL_SECONDS = int(os.getenv('UPLOADCARE_INFO_MONGO_TTL_SECONDS', 30 * 24 * 3600))
+
+# Indexes backing the lookups below, created by data.indexes
+INDEXES = [
+    (uploadcare_file_col, [("file_id", ASCENDING)], {"unique": True}),
+    (uploadcare_file_col, [("cached_at", ASCENDING)], {"expireAfterSeconds": UPLOADCARE_INFO_MONGO_TTL_SECONDS}),
+]
+
+# Hot query shapes checked for collection scans by data.indexes
+QUERIES = [
+    (uploadcare_file_col, {"file_id": ""}, None),
+]
@@ -2,10 +2,20 @@ from typing import Optional
 
 from model.usage_history import History
 
-from pymongo import ReturnDocument
+from pymongo import ReturnDocument, ASCENDING
 
 from .init import usage_history_col
 
+# Indexes backing the lookups below, created by data.indexes
+INDEXES = [
+    (usage_history_col, [("user_id", ASCENDING)], {"unique": True}),
+]
+
+# Hot query shapes checked for collection scans by data.indexes
+QUERIES = [
+    (usage_history_col, {"user_id": ""}, None),
+]
+
 domain_to_index = {
     "image_generation": "images_generated",
     "deepfake": "deepfakes_generated",
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+import os
+
+from pymongo import ASCENDING
+
+from .init import webhook_event_col, webhook_receipt_col
+
+# How long a delivered event id is remembered for deduplication
+WEBHOOK_RECEIPT_TTL_SECONDS = int(os.getenv('WEBHOOK_RECEIPT_TTL_SECONDS', 7 * 24 * 3600))
+
+# Webhook events are read and written from the event loop through
+# data.aio.webhook, only their indexes are declared here for data.indexes
+
+# Indexes backing the lookups below, created by data.indexes
+INDEXES = [
+    (webhook_event_col, [("status", ASCENDING), ("received_at", ASCENDING)], {}),
+    (webhook_event_col, [("provider", ASCENDING), ("ordering_key", ASCENDING), ("received_at", ASCENDING)], {}),
+    (webhook_receipt_col, [("provider", ASCENDING), ("event_id", ASCENDING)], {"unique": True}),
+    (webhook_receipt_col, [("received_at", ASCENDING)], {"expireAfterSeconds": WEBHOOK_RECEIPT_TTL_SECONDS}),
+]
+
+# Hot query shapes checked for collection scans by data.indexes
+QUERIES = [
+    (webhook_event_col, {"status": "pending"}, [("received_at", ASCENDING)]),
+    (webhook_event_col, {"provider": "", "ordering_key": "", "received_at": {"$lt": datetime(1970, 1, 1)}}, None),
+]
@@ -1,17 +1,65 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from contextlib import asynccontextmanager
+
+import asyncio
+
 import os
 
 import uvicorn
 
 from web import (
     account, ai_verification, deepfake, akool_deepfake, facefusion_deepfake, 
-    billing, bug, image_generation, midjourney, referral, usage_history
+    billing, bug, events, image_generation, metrics, midjourney, referral, usage_history
     # team
 )
 
-app = FastAPI()
+import data.indexes as indexes
+import service.ai_verification as ai_verification_service
+import service.billing as billing_service
+import service.email as email_service
+import service.events as events_service
+import service.image_generation as image_generation_service
+import service.midjourney as midjourney_service
+import service.http_client as http_client
+import service.webhook as webhook_service
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    http_client.start()
+
+    background_tasks = [
+        asyncio.create_task(billing_service.refresh_plan_catalog_periodically()),
+        asyncio.create_task(email_service.dispatch_outbox()),
+        asyncio.create_task(image_generation_service.dispatch_jobs()),
+        asyncio.create_task(midjourney_service.flush_messages_periodically()),
+        *webhook_service.start_workers()
+    ]
+
+    # The first imagine already finds the account's turbo mode known
+    ai_verification_service.refresh_turbo_in_background()
+
+    if events_service.EVENTS_CHANGE_STREAM:
+        background_tasks.append(asyncio.create_task(events_service.watch_events()))
+
+    if os.getenv("MONGODB_ENSURE_INDEXES") == "true":
+        background_tasks.append(asyncio.create_task(asyncio.to_thread(indexes.ensure_indexes)))
+
+    yield
+
+    for task in background_tasks:
+        task.cancel()
+
+    # Progress still buffered would otherwise be lost with the process
+    try:
+        await midjourney_service.flush_messages()
+    except Exception as e:
+        print(f"Error flushing Midjourney messages on shutdown: {e}")
+
+    await http_client.close()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     os.getenv("WEBAPP_DOMAIN"),
@@ -25,6 +73,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets browser clients read the cursor of the next history page
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(account.router)
@@ -32,10 +82,12 @@ app.include_router(ai_verification.router)
 app.include_router(billing.router)
 app.include_router(bug.router)
 app.include_router(deepfake.router)
+app.include_router(events.router)
 app.include_router(akool_deepfake.router)
 app.include_router(facefusion_deepfake.router)
 app.include_router(usage_history.router)
 app.include_router(image_generation.router)
+app.include_router(metrics.router)
 app.include_router(midjourney.router)
 app.include_router(referral.router)
 # app.include_router(team.router)
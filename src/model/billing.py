@@ -37,6 +37,14 @@ class Plan(BaseModel):
     # stripe_price_id: str | None = None
     radom_product_id: str | None = None
     paypal_plan_id: str | None = None
+    priority_weight: float | None = None # share of generation capacity relative to other plans
+
+class Entitlement(BaseModel):
+    user_id: str
+    insider: bool = False
+    plan_id: str | None = None
+    features: List[str] = []
+    priority_weight: float = 1.0
 
 class ProductRequest(BaseModel):
     plan_id: str
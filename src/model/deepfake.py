@@ -4,7 +4,7 @@ from typing import Optional, List
 from datetime import datetime
 
 class Message(BaseModel):
-    user_id: Optional[str] = None, 
+    user_id: Optional[str] = None
     status: Optional[str] = None
     facefusion_source_uris: Optional[List[str]] = None
     facefusion_target_uri: Optional[str] = None
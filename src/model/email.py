@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+
+from typing import Any, Dict
+
+from datetime import datetime
+
+class OutboxEmail(BaseModel):
+    email: str
+    transactional_id: str
+    data_variables: Dict[str, Any] = {}
+    status: str = "pending" # pending, sending, sent, failed
+    attempts: int = 0
+    next_attempt_at: datetime | None = None
+    lease_until: datetime | None = None
+    created_at: datetime | None = None
+    sent_at: datetime | None = None
+    last_error: str | None = None
+    dedup_key: str | None = None # set when the same email may be queued twice, e.g. by a retried webhook
@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+
+from typing import Any, Dict
+
+from datetime import datetime
+
+class WebhookEvent(BaseModel):
+    provider: str
+    ordering_key: str | None = None
+    body: Dict[str, Any] = {}
+    status: str = "pending" # pending, processing, processed, failed
+    attempts: int = 0
+    lease_until: datetime | None = None
+    received_at: datetime | None = None
+    processed_at: datetime | None = None
+    last_error: str | None = None
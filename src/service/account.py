@@ -6,9 +6,14 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 import bcrypt
 
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio
+
 import os
 
 from data import account as data
+from data.aio import account as aio_data
 
 from model.account import Account, Token, PasswordReset
 
@@ -24,6 +29,23 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 3
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+# bcrypt releases the GIL while hashing, so a small thread pool is enough to
+# keep hashing off the event loop. Anything beyond the queue limit is rejected
+# so a login storm cannot stall the rest of the worker.
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv('PASSWORD_HASH_MAX_QUEUE', 64))
+
+password_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                            thread_name_prefix="password-hash")
+
+password_hash_stats = {
+    "queue_depth": 0,
+    "max_queue_depth": 0,
+    "completed": 0,
+    "rejected": 0
+}
 
 
 def verify_password(plain_password: str, 
@@ -40,14 +62,51 @@ def get_password_hash(password: str):
     return password_hash
 
 
-def authenticate_user(username: str, 
-                      password: str) -> Optional[Account]:
+async def run_password_task(func, *args):
+    if password_hash_stats["queue_depth"] >= PASSWORD_HASH_MAX_QUEUE:
+        password_hash_stats["rejected"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests, try again shortly.",
+            headers={"Retry-After": "1"},
+        )
+
+    password_hash_stats["queue_depth"] += 1
+    password_hash_stats["max_queue_depth"] = max(password_hash_stats["max_queue_depth"],
+                                                 password_hash_stats["queue_depth"])
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(password_hash_executor, func, *args)
+    finally:
+        password_hash_stats["queue_depth"] -= 1
+        password_hash_stats["completed"] += 1
+
+
+async def verify_password_async(plain_password: str,
+                                password_hash: str) -> bool:
+    return await run_password_task(verify_password, plain_password, password_hash)
+
+
+async def get_password_hash_async(password: str):
+    return await run_password_task(get_password_hash, password)
+
+
+def get_password_hash_stats() -> dict:
+    return {
+        **password_hash_stats,
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_queue": PASSWORD_HASH_MAX_QUEUE
+    }
+
+
+async def authenticate_user(username: str, 
+                            password: str) -> Optional[Account]:
     user = data.get_by_username(username)
 
     if not user:
         return None
     
-    if not verify_password(password, user.password_hash):
+    if not await verify_password_async(password, user.password_hash):
         return None
     
     return user
@@ -86,7 +145,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> Acc
     except JWTError:
         raise credentials_exception
     
-    user = data.get_by_username(username=username)
+    user = await aio_data.get_cached_by_username(username)
 
     if user is None:
         raise credentials_exception
@@ -103,6 +162,14 @@ async def get_current_active_user(
     return current_user
 
 
+async def get_current_stream_user(header_token: Annotated[Optional[str], Depends(optional_oauth2_scheme)],
+                                  token: Optional[str] = None) -> Account:
+    # EventSource can't set headers, so streams may pass the token as a query parameter
+    current_user = await get_current_user(header_token or token or "")
+
+    return await get_current_active_user(current_user)
+
+
 async def update_session(user: Account) -> Token:
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -113,7 +180,7 @@ async def update_session(user: Account) -> Token:
 
 
 async def login(form_data: OAuth2PasswordRequestForm) -> Token:
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
 
     if not user:
         raise HTTPException(
@@ -135,19 +202,21 @@ async def signup(email: str,
     if not email:
         raise HTTPException(status_code=400, detail="Email cannot be empty")
 
+    password_hash = await get_password_hash_async(form_data.password)
+
     try:
         user = data.signup(email, 
                            form_data.username, 
-                           get_password_hash(form_data.password))
+                           password_hash)
         
         referral_service.generate_link(user)
     except ValueError:
         raise HTTPException(status_code=404, detail="User already exists.")
 
-    email_service.send(email, 
-                       "clv9so1fa029b8k9nig3go17m", 
-                       username=form_data.username,
-                       discord_link=os.getenv("DISCORD_LINK"))
+    await email_service.send(email, 
+                             "clv9so1fa029b8k9nig3go17m", 
+                             username=form_data.username,
+                             discord_link=os.getenv("DISCORD_LINK"))
 
     return await login(form_data)
 
@@ -158,7 +227,7 @@ async def signup_ref(email: str,
     jwt_token = await signup(email, form_data)
 
     if jwt_token:
-        user = get_by_email(email)
+        user = await get_by_email_async(email)
         try:
             referral_service.log_signup_ref(referral_id, 
                                             user)
@@ -180,7 +249,9 @@ async def change_password(password_reset_id: str,
 
         if password_reset.is_used == False and now <= expiry_time:
             print("SETTING NEW PASWORD AND MAKING THE CURRENT LINK DISABLED")
-            if data.set_new_password(get_password_hash(password), password_reset.user_id) \
+            password_hash = await get_password_hash_async(password)
+
+            if data.set_new_password(password_hash, password_reset.user_id) \
                 and data.disable_password_reset(password_reset_id):
                 
                 return
@@ -189,10 +260,14 @@ async def change_password(password_reset_id: str,
 
 def is_insider(user: Account) -> bool:
     return data.is_insider(user.user_id)
+
+
+async def is_insider_async(user: Account) -> bool:
+    return await aio_data.is_insider(user.user_id)
                 
 
-def request_one_time_link(email: str) -> None:
-    user = get_by_email(email)
+async def request_one_time_link(email: str) -> None:
+    user = await get_by_email_async(email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -214,10 +289,10 @@ def request_one_time_link(email: str) -> None:
     data.create_password_reset(password_reset)
 
     # for env
-    email_service.send(email, 
-                       'clv2h2bt800bm1147nw7gtngv', 
-                       password_reset_link=password_reset_link,
-                       discord_link=os.getenv("DISCORD_LINK"))
+    await email_service.send(email, 
+                             'clv2h2bt800bm1147nw7gtngv', 
+                             password_reset_link=password_reset_link,
+                             discord_link=os.getenv("DISCORD_LINK"))
 
 def change_email(email: str, 
                  user: Account) -> None:
@@ -234,6 +309,12 @@ def get_by_id(user_id: str) -> None:
 def get_by_email(email: str) -> Optional[Account]:
     return data.get_by_email(email)
 
+async def get_by_id_async(user_id: str) -> Optional[Account]:
+    return await aio_data.get_by_id(user_id)
+
+async def get_by_email_async(email: str) -> Optional[Account]:
+    return await aio_data.get_by_email(email)
+
 def change_profile_picture(profile_uri: str, 
                            user: Account) -> None:
     try:
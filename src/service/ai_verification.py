@@ -1,8 +1,10 @@
 from fastapi import HTTPException
 
+import asyncio
+
 import os
 
-import httpx
+import time
 
 from typing import Optional, List, Tuple
 
@@ -13,9 +15,30 @@ from model.ai_verification import Prompt, SocialAccount
 from model.midjourney import Message, Response
 
 import service.billing as billing_service
+import service.http_client as http_client
+import service.scheduler as scheduler
 import service.usage_history as usage_history_service
 import service.midjourney as midjourney_service
 
+# The fast command answers the same for minutes at a time, so imagine reuses its last answer
+MIDJOURNEY_TURBO_TTL_SECONDS = float(os.getenv('MIDJOURNEY_TURBO_TTL_SECONDS', 300))
+MIDJOURNEY_TURBO_RETRY_SECONDS = float(os.getenv('MIDJOURNEY_TURBO_RETRY_SECONDS', 30))
+MIDJOURNEY_RATE_LIMIT_RETRIES = int(os.getenv('MIDJOURNEY_RATE_LIMIT_RETRIES', 2))
+MIDJOURNEY_RATE_LIMIT_PAUSE_SECONDS = 5
+
+# Last known turbo availability of the mymidjourney account
+turbo_state = {
+    "available": False,
+    "checked_at": None,
+    "refresh": None
+}
+
+turbo_stats = {
+    "checks": 0,
+    "failed_checks": 0,
+    "exhausted": 0
+}
+
 def check_prompt(prompt: Prompt):
     versions = ['1', '2', '3', '4', '5', '5.0', '5.1', '5.2', '6']
     if prompt.version != '' and (prompt.version not in versions):
@@ -83,7 +106,13 @@ def create_prompt_string(prompt: Prompt,
     return prompt_string
 
 
-async def increase_speed() -> bool:
+def is_turbo_exhausted(message: Optional[str]) -> bool:
+    return "turbo hours" in (message or "").lower()
+
+
+async def increase_speed() -> Optional[bool]:
+    """Switch the account to fast mode and tell whether turbo is available, None when the check failed"""
+
     try:
         # Make a request to activate fast mode
         fast_url = "https://api.mymidjourney.ai/api/v1/midjourney/commands"
@@ -95,32 +124,135 @@ async def increase_speed() -> bool:
             "cmd": "fast"
         }
 
-        async with httpx.AsyncClient() as client:
-            fast_resp = await client.post(fast_url, headers=fast_headers, json=fast_data)
-            print(f"Fast mode response status: {fast_resp.status_code}")
-            print(f"Fast mode response body: {fast_resp.text}")
-
-            if fast_resp.status_code != 200:
-                print("Failed to activate fast mode.")
-                return False
-
-            response_json = fast_resp.json()
-            error_message = response_json.get("message", "")
-
-            if response_json.get("success", False):
-                if error_message:
-                    print(f"Fast mode activated but with error: {error_message}")
-                    if "turbo hours" in error_message.lower():
-                        print("Turbo hours have run out.")
-                        return False
-                return True
-            else:
-                print(f"Fast mode activation failed: {error_message}")
-                return False
+        fast_resp = await post_to_midjourney(fast_url, fast_headers, fast_data)
+        print(f"Fast mode response status: {fast_resp.status_code}")
+        print(f"Fast mode response body: {fast_resp.text}")
+
+        if fast_resp.status_code != 200:
+            print("Failed to activate fast mode.")
+            return None
+
+        response_json = fast_resp.json()
+        error_message = response_json.get("message", "")
+
+        if response_json.get("success", False):
+            if error_message:
+                print(f"Fast mode activated but with error: {error_message}")
+                if is_turbo_exhausted(error_message):
+                    print("Turbo hours have run out.")
+                    return False
+            return True
+        else:
+            print(f"Fast mode activation failed: {error_message}")
+            return False
 
     except Exception as e:
         print(f"Error increasing speed: {e}")
-        return False
+        return None
+
+
+async def post_to_midjourney(url: str,
+                             headers: dict,
+                             data: dict):
+    """POST to mymidjourney, holding every submission back while it rate limits the account.
+
+    The caller has already taken a token from the Midjourney bucket, retries take their own.
+    """
+
+    bucket = scheduler.get_bucket("midjourney")
+
+    for attempt in range(MIDJOURNEY_RATE_LIMIT_RETRIES + 1):
+        resp = await http_client.get_client("mymidjourney").post(url, headers=headers, json=data)
+
+        if resp.status_code != 429 or attempt == MIDJOURNEY_RATE_LIMIT_RETRIES:
+            return resp
+
+        try:
+            pause = float(resp.headers.get("Retry-After", MIDJOURNEY_RATE_LIMIT_PAUSE_SECONDS))
+        except ValueError:
+            pause = MIDJOURNEY_RATE_LIMIT_PAUSE_SECONDS
+
+        print(f"MIDJOURNEY RATE LIMITED, PAUSING SUBMISSIONS FOR {pause} SECONDS")
+        bucket.pause(pause)
+        await bucket.acquire()
+
+
+async def refresh_turbo() -> bool:
+    # The fast command counts against the account's rate limit like any submission,
+    # and since the refresh is single-flight it is sent once however many imagines wait
+    await scheduler.get_bucket("midjourney").acquire()
+
+    turbo = await increase_speed()
+    turbo_stats["checks"] += 1
+
+    if turbo is None:
+        # Keep the last known mode and check again soon rather than after a full TTL
+        turbo_stats["failed_checks"] += 1
+        turbo_state["checked_at"] = time.monotonic() - MIDJOURNEY_TURBO_TTL_SECONDS + MIDJOURNEY_TURBO_RETRY_SECONDS
+        return turbo_state["available"]
+
+    turbo_state["available"] = turbo
+    turbo_state["checked_at"] = time.monotonic()
+
+    return turbo
+
+
+def refresh_turbo_in_background() -> None:
+    # A single check at a time however many imagines find the state stale
+    refresh = turbo_state["refresh"]
+
+    if refresh is None or refresh.done():
+        turbo_state["refresh"] = asyncio.create_task(refresh_turbo())
+
+
+def get_turbo() -> bool:
+    """Last known turbo availability, a stale answer is served while it is checked again"""
+
+    checked_at = turbo_state["checked_at"]
+
+    if checked_at is None or time.monotonic() - checked_at > MIDJOURNEY_TURBO_TTL_SECONDS:
+        refresh_turbo_in_background()
+
+    return turbo_state["available"]
+
+
+def turn_off_turbo() -> None:
+    # Upstream told us turbo hours ran out, no need to wait for the next check
+    print("TURBO HOURS HAVE RUN OUT, TURNING TURBO OFF")
+    turbo_stats["exhausted"] += 1
+    turbo_state["available"] = False
+    turbo_state["checked_at"] = time.monotonic()
+
+
+def get_turbo_stats() -> dict:
+    checked_at = turbo_state["checked_at"]
+
+    return {
+        **turbo_stats,
+        "available": turbo_state["available"],
+        "age_seconds": time.monotonic() - checked_at if checked_at is not None else None
+    }
+
+
+async def submit_imagine(prompt_string: str,
+                         user: Account,
+                         turbo: bool) -> Tuple[Response, int, str]:
+    url = "https://api.mymidjourney.ai/api/v1/midjourney/imagine"
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {os.getenv('MIDJOURNEY_TOKEN')}",
+    }
+
+    data = {
+        "prompt": f"{prompt_string} --turbo" if turbo else prompt_string,
+        "ref": user.user_id,
+        "webhookOverride": f"{os.getenv('ROOT_DOMAIN')}/midjourney/webhook"
+    }
+
+    print("MAKING REQUEST TO MIDJOURNEY IMAGINE ENDPOINT API")
+    resp = await post_to_midjourney(url, headers, data)
+
+    return Response.parse_raw(resp.text), resp.status_code, resp.text
 
 
 async def imagine(prompt: Prompt, 
@@ -147,51 +279,44 @@ async def imagine(prompt: Prompt,
         # - quality: --quality x    ; only accepts the values: .25, .5, and 1 for the current model. Larger values are rounded down to 1
 
     print("CHECKING PERMISSIONS")
-    if billing_service.has_permissions("AI Dating App Verification", user):
+    if await billing_service.has_permissions_async("AI Dating App Verification", user):
         print("CHECKING PROMPT PASSED: ", prompt)
         check = check_prompt(prompt)
         if check is not True:
             print(check)
             raise HTTPException(status_code=400, detail=check)
         
-        print("CREATING PAYLOAD")
-        url = "https://api.mymidjourney.ai/api/v1/midjourney/imagine"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {os.getenv('MIDJOURNEY_TOKEN')}",
-        }
+        await midjourney_service.check_active_jobs(user)
 
+        print("CREATING PAYLOAD")
         prompt_string = create_prompt_string(prompt,
                                              img_ref_cdn_url_list,
                                              cref_cdn_url_list,
                                              sref_cdn_url_list)
 
-        turbo = await increase_speed()
+        # Waits for the user's fair share of the Midjourney account and a token of its rate limit
+        async with scheduler.slot("midjourney", user):
+            turbo = get_turbo()
 
-        if turbo:
-            prompt_string += " --turbo"
+            response_data, status_code, text = await submit_imagine(prompt_string, user, turbo)
 
-        data = {
-            "prompt": prompt_string,
-            "ref": user.user_id,
-            "webhookOverride": f"{os.getenv('ROOT_DOMAIN')}/midjourney/webhook"
-        }
+            # Turbo ran out since the last check, the prompt still goes through without it
+            if turbo and is_turbo_exhausted(response_data.error):
+                turn_off_turbo()
+                await scheduler.get_bucket("midjourney").acquire()
+                response_data, status_code, text = await submit_imagine(prompt_string, user, False)
+
+        if response_data.success:
+            await midjourney_service.register_job(response_data.messageId, user)
+            await usage_history_service.update_async("ai_verification", user.user_id)
 
-        async with httpx.AsyncClient() as client:
-            print("MAKING REQUEST TO MIDJOURNEY IMAGINE ENDPOINT API")
-            resp = await client.post(url, headers=headers, json=data)
-            response_data = Response.parse_raw(resp.text)
-
-            if response_data.success:
-                usage_history_service.update("ai_verification", user.user_id)
-
-            if resp.status_code != 200 or response_data.error:
-                error_detail = response_data.error if response_data.error else resp.text
-                raise HTTPException(status_code=500, detail=f"Prompt execution failed: {error_detail}")
-            
-            print(response_data)
-            
-            return response_data
+        if status_code != 200 or response_data.error:
+            error_detail = response_data.error if response_data.error else text
+            raise HTTPException(status_code=500, detail=f"Prompt execution failed: {error_detail}")
+        
+        print(response_data)
+        
+        return response_data
     else:
         raise HTTPException(status_code=403, detail="Upgrade your plan to unlock permissions.")
 
@@ -200,11 +325,13 @@ async def action(messageId: str,
                  button: str, 
                  user: Account) -> None:
 
-    if not billing_service.has_permissions("AI Dating App Verification", user):
+    if not await billing_service.has_permissions_async("AI Dating App Verification", user):
         raise HTTPException(status_code=403, detail="Upgrade your plan to unlock permissions.")
 
-    if not midjourney_service.valid_button(messageId, button):
+    if not await midjourney_service.valid_button(messageId, button):
         raise HTTPException(status_code=405, detail="Requested action is not valid.")
+
+    await midjourney_service.check_active_jobs(user)
     
     url = "https://api.mymidjourney.ai/api/v1/midjourney/button"
     headers = {
@@ -220,12 +347,14 @@ async def action(messageId: str,
 
     # turbo = await increase_speed(user)
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(url, headers=headers, json=data)
-        response_data = Response.parse_raw(resp.text)
+    async with scheduler.slot("midjourney", user):
+        resp = await post_to_midjourney(url, headers, data)
+
+    response_data = Response.parse_raw(resp.text)
 
     if response_data.success:
-        usage_history_service.update('ai_verification', user.user_id)
+        await midjourney_service.register_job(response_data.messageId, user)
+        await usage_history_service.update_async('ai_verification', user.user_id)
     
     if resp.status_code != 200 or response_data.error:
         error_detail = response_data.error if response_data.error else resp.text
@@ -262,8 +391,13 @@ def delete_account(account_id: str) -> None:
         raise HTTPException(status_code=500, detail="Failed to delete social account")
 
 
-def get_accounts(user: Account) -> Optional[List[SocialAccount]]:
-    return data.get_accounts(user.user_id)
+def get_accounts(user: Account,
+                 cursor: Optional[str] = None,
+                 limit: Optional[int] = None) -> Tuple[List[SocialAccount], Optional[str]]:
+    try:
+        return data.get_accounts(user.user_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 def update_prompt(prompt: Prompt) -> None:
@@ -277,12 +411,18 @@ def get_prompts(user: Account) -> Optional[List[Prompt]]:
     return data.get_prompts(user.user_id)
 
 
-def get_message(messageId: str) -> Optional[Message]:
-    return midjourney_service.get_message(messageId)
+async def get_message(messageId: str) -> Optional[Message]:
+    return await midjourney_service.get_message(messageId)
+
+
+def get_queue_position(user: Account) -> dict:
+    return scheduler.get_queue("midjourney").position(user.user_id)
 
 
-def get_history(user: Account) -> List[Message]:
-    return midjourney_service.get_history(user)
+async def get_history(user: Account,
+                      cursor: Optional[str] = None,
+                      limit: Optional[int] = None) -> Tuple[List[Message], Optional[str]]:
+    return await midjourney_service.get_history(user, cursor, limit)
 
 # async def cancel_job(messageId: str,
 #                      user: Account) -> None:
@@ -2,26 +2,70 @@ from fastapi import HTTPException
 
 from typing import Optional
 
+import asyncio
+
 import os
 
 import json
 
-import requests
-
 import hashlib
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import unpad
 import base64
 
 import data.deepfake as data
+from data.aio import deepfake as aio_data
+
+from cache import TTLCache
 
 from model.account import Account
 from model.deepfake import Message
 
 import service.billing as billing_service
 import service.deepfake as deepfake_service
+import service.events as events_service
+import service.http_client as http_client
+import service.scheduler as scheduler
 import service.usage_history as usage_history_service
 
+AKOOL_MAX_PARALLEL = int(os.getenv('AKOOL_MAX_PARALLEL', 16))
+AKOOL_CALL_TIMEOUT = float(os.getenv('AKOOL_CALL_TIMEOUT', 20))
+
+AKOOL_LANDMARK_CACHE_MAXSIZE = int(os.getenv('AKOOL_LANDMARK_CACHE_MAXSIZE', 10000))
+
+# Caps the file checks and face detections in flight across all requests
+upstream_semaphore = asyncio.Semaphore(AKOOL_MAX_PARALLEL)
+
+# Landmarks of recently swapped faces by image key, backed by the FaceLandmarks collection
+landmark_cache = TTLCache(AKOOL_LANDMARK_CACHE_MAXSIZE, data.AKOOL_LANDMARK_TTL_SECONDS)
+
+landmark_stats = {
+    "mongo_hits": 0,
+    "detections": 0
+}
+
+
+async def call_upstream(coro):
+    async with upstream_semaphore:
+        try:
+            return await asyncio.wait_for(coro, timeout=AKOOL_CALL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Timed out while preparing the deepfake.")
+
+
+async def gather_upstream(*coros) -> list:
+    """Run independent upstream calls concurrently, the first failure cancels the rest"""
+
+    tasks = [asyncio.ensure_future(call_upstream(coro)) for coro in coros]
+
+    try:
+        return await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
 # Generate signature
 def generate_msg_signature(client_id, 
                            timestamp, 
@@ -58,7 +102,7 @@ def decipher_status_message(status_code: int) -> str:
     else:
         return "unknown"
 
-def webhook(response: dict) -> None:
+async def webhook(response: dict) -> None:
     clientId = os.getenv('AKOOL_CLIENT_ID')
     clientSecret = os.getenv('AKOOL_CLIENT_SECRET')
 
@@ -80,77 +124,83 @@ def webhook(response: dict) -> None:
 
         job_id = result.get("_id", "")
 
-        data.update_message(job_id=job_id,
-                            status=status_msg)
+        user_id = await aio_data.update_message(job_id=job_id,
+                                                status=status_msg)
+
+        await events_service.publish(user_id, "deepfake", {"job_id": job_id, "status": status_msg})
 
     else:
         raise ValueError("Invalid signature.")
     
 
-def initiate_photo_faceswap(source_uri: str,
+async def initiate_photo_faceswap(source_uri: str,
                             target_uri: str,
                             user: Account) -> Optional[Message]:
     
-    if billing_service.has_permissions("Realistic AI Content Deepfake", user):
+    if await billing_service.has_permissions_async("Realistic AI Content Deepfake", user):
+        await deepfake_service.check_active_jobs(user)
+
         valid_formats = ['jpeg', 'png']
 
-        deepfake_service.check_file_formats(target_uri,
-                                            valid_formats)
-        deepfake_service.check_file_formats(source_uri,
-                                            valid_formats)
-                       
-        source_opts = face_detect(source_uri)
-        target_opts = face_detect(target_uri)
+        # Waits for the user's fair share of Akool before any upstream call
+        async with scheduler.slot("akool", user):
+            _, _, source_opts, target_opts = await gather_upstream(
+                deepfake_service.check_file_formats(target_uri, valid_formats),
+                deepfake_service.check_file_formats(source_uri, valid_formats),
+                face_detect(source_uri),
+                face_detect(target_uri)
+            )
           
-        try:
-            message = run_photo_faceswap(source_uri,
-                                         target_uri,
-                                         source_opts,
-                                         target_opts,
-                                         user.user_id)
-
-            return message
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Failed to generate a photo deepfake.")
+            try:
+                message = await run_photo_faceswap(source_uri,
+                                                   target_uri,
+                                                   source_opts,
+                                                   target_opts,
+                                                   user.user_id)
+
+                return message
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Failed to generate a photo deepfake.")
     else:
         raise HTTPException(status_code=403, detail="Upgrade your plan to unlock permissions.")
     
 
-def initiate_video_faceswap(source_uri: str,
+async def initiate_video_faceswap(source_uri: str,
                             target_uri: str,
                             video_uri: str,
                             user: Account) -> Optional[Message]:
     
-    if billing_service.has_permissions("Realistic AI Content Deepfake", user):
+    if await billing_service.has_permissions_async("Realistic AI Content Deepfake", user):
+        await deepfake_service.check_active_jobs(user)
+
         valid_formats = ['jpeg', 'png', 'mp4']
 
-        deepfake_service.check_file_formats(target_uri,
-                                            valid_formats)
-        deepfake_service.check_file_formats(source_uri,
-                                            valid_formats)
-        
-        deepfake_service.check_file_formats(video_uri,
-                                            valid_formats)
-                       
-        source_opts = face_detect(source_uri)
-        target_opts = face_detect(target_uri)
+        # Waits for the user's fair share of Akool before any upstream call
+        async with scheduler.slot("akool", user):
+            _, _, _, source_opts, target_opts = await gather_upstream(
+                deepfake_service.check_file_formats(target_uri, valid_formats),
+                deepfake_service.check_file_formats(source_uri, valid_formats),
+                deepfake_service.check_file_formats(video_uri, valid_formats),
+                face_detect(source_uri),
+                face_detect(target_uri)
+            )
           
-        try:
-            message = run_video_faceswap(source_uri,
-                                         target_uri,
-                                         video_uri,
-                                         source_opts,
-                                         target_opts,
-                                         user.user_id)
-
-            return message
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Failed to generate a video deepfake.")
+            try:
+                message = await run_video_faceswap(source_uri,
+                                                   target_uri,
+                                                   video_uri,
+                                                   source_opts,
+                                                   target_opts,
+                                                   user.user_id)
+
+                return message
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Failed to generate a video deepfake.")
     else:
         raise HTTPException(status_code=403, detail="Upgrade your plan to unlock permissions.")
 
     
-def run_photo_faceswap(source_uri: str, # photo of the old face from the photo
+async def run_photo_faceswap(source_uri: str, # photo of the old face from the photo
                        target_uri: str, # photo of the new face for the photo
                        source_opts: str, # some params for the old face
                        target_opts: str, # some params for the new face
@@ -179,12 +229,12 @@ def run_photo_faceswap(source_uri: str, # photo of the old face from the photo
 
     print("SENDING REQUEST TO AKOOL")
     try:
-        message = send_post_request(url,
-                                    headers,
-                                    payload,
-                                    source_uri,
-                                    target_uri,
-                                    user_id)
+        message = await send_post_request(url,
+                                          headers,
+                                          payload,
+                                          source_uri,
+                                          target_uri,
+                                          user_id)
         
         return message
     except ValueError:
@@ -192,7 +242,7 @@ def run_photo_faceswap(source_uri: str, # photo of the old face from the photo
                             detail="Failed to generate photo deepfake.")
     
 
-def run_video_faceswap(source_uri: str, # photo of the old face from the photo
+async def run_video_faceswap(source_uri: str, # photo of the old face from the photo
                        target_uri: str, # photo of the new face for the photo
                        video_uri: str,
                        source_opts: str, # some params for the old face
@@ -222,12 +272,12 @@ def run_video_faceswap(source_uri: str, # photo of the old face from the photo
 
     print("SENDING REQUEST TO AKOOL")
     try:
-        message = send_post_request(url,
-                                    headers,
-                                    payload,
-                                    source_uri,
-                                    target_uri,
-                                    user_id)
+        message = await send_post_request(url,
+                                          headers,
+                                          payload,
+                                          source_uri,
+                                          target_uri,
+                                          user_id)
         
         return message
     except ValueError:
@@ -235,14 +285,14 @@ def run_video_faceswap(source_uri: str, # photo of the old face from the photo
                             detail="Failed to generate video deepfake.")
     
 
-def send_post_request(url: str, 
+async def send_post_request(url: str, 
                       headers: dict, 
                       payload: dict,
                       source_uri: str,
                       target_uri: str,
                       user_id: str) -> Optional[Message]:
     print("SENDING POST REQUEST")
-    response = requests.post(url, headers=headers, json=payload)
+    response = await http_client.get_client("akool").post(url, headers=headers, json=payload)
 
     response_data = response.json()  # Convert response to JSON
 
@@ -259,19 +309,72 @@ def send_post_request(url: str,
 
     output_url = response_data.get("url")
 
-    message = data.create_message(user_id=user_id,
-                                  status='in progress' if code == 1000 else 'failed',
-                                  akool_source_uri=source_uri,
-                                  akool_target_uri=target_uri,
-                                  job_id=job_id,
-                                  output_url=output_url)
+    message = await deepfake_service.create_message(user_id=user_id,
+                                                    status='in progress' if code == 1000 else 'failed',
+                                                    akool_source_uri=source_uri,
+                                                    akool_target_uri=target_uri,
+                                                    job_id=job_id,
+                                                    output_url=output_url)
         
     
-    usage_history_service.update('deepfake', user_id)
+    await usage_history_service.update_async('deepfake', user_id)
 
     return message
 
-def face_detect(uploadcare_uri: str):
+def get_landmark_key(uploadcare_uri: str) -> Optional[str]:
+    file_id = deepfake_service.extract_id_from_uploadcare_uri(uploadcare_uri)
+
+    if not file_id:
+        return None
+
+    # CDN operations change the image, so they are part of the key
+    operations = uploadcare_uri.split(file_id, 1)[1].split("/-/", 1)
+
+    return file_id if len(operations) == 1 else f"{file_id}/-/{operations[1]}"
+
+
+async def face_detect(uploadcare_uri: str):
+    image_key = get_landmark_key(uploadcare_uri)
+
+    if image_key is None:
+        return await detect_landmarks(uploadcare_uri)
+
+    landmarks_str = landmark_cache.get(image_key)
+
+    if landmarks_str is not None:
+        return landmarks_str
+
+    landmarks_str = await aio_data.get_landmarks(image_key)
+
+    if landmarks_str:
+        landmark_stats["mongo_hits"] += 1
+    else:
+        landmarks_str = await detect_landmarks(uploadcare_uri)
+        landmark_stats["detections"] += 1
+
+        # Failed detections are retried next time
+        if not landmarks_str:
+            return landmarks_str
+
+        await aio_data.save_landmarks(image_key, landmarks_str)
+
+    landmark_cache.set(image_key, landmarks_str)
+
+    return landmarks_str
+
+
+def get_landmark_stats() -> dict:
+    memory = landmark_cache.stats()
+    lookups = memory["hits"] + memory["misses"]
+
+    return {
+        **landmark_stats,
+        "memory": memory,
+        "hit_rate": (memory["hits"] + landmark_stats["mongo_hits"]) / lookups if lookups else 0.0
+    }
+
+
+async def detect_landmarks(uploadcare_uri: str):
     url = "https://sg3.akool.com/detect"
 
     payload = json.dumps({
@@ -283,7 +386,7 @@ def face_detect(uploadcare_uri: str):
       'Content-Type': 'application/json'
     }
 
-    response = requests.request("POST", url, headers=headers, data=payload)
+    response = await http_client.get_client("akool_detect").post(url, headers=headers, content=payload)
     response_data = json.loads(response.text)
 
     landmarks_str = response_data.get("landmarks_str", "")
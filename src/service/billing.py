@@ -1,10 +1,10 @@
-from fastapi import Request, HTTPException
+from fastapi import HTTPException
 
 from typing import Optional, Dict, Any
 
 import os
 
-import requests
+import httpx
 
 import json
 
@@ -16,42 +16,95 @@ from uuid import uuid4
 
 import base64
 
+import asyncio
+
 import data.billing as data
+from data.aio import billing as aio_data
+
+from cache import TTLCache
 
 from model.account import Account
 
 from model.billing import (Plan, RadomCheckoutRequest, 
                            RadomCheckoutSessionMetadata, PaymentAccount,
-                           PaypalCheckoutMetadata, GCRequest)
+                           PaypalCheckoutMetadata, GCRequest, Entitlement)
 
 import service.account as account_service
 
 import service.email as email_service
+import service.http_client as http_client
 
 import service.referral as referral_service
 
 from datetime import datetime
 
+# Per-user entitlement snapshots keyed by user_id. Webhook handlers invalidate
+# them through create_payment_account / set_payment_account_status, the TTL
+# bounds staleness for changes made by other workers.
+entitlement_cache = TTLCache(maxsize=int(os.getenv('ENTITLEMENT_CACHE_MAXSIZE', 10000)),
+                             ttl=float(os.getenv('ENTITLEMENT_CACHE_TTL_SECONDS', 300)))
+
+def make_entitlement(user: Account,
+                     insider: bool,
+                     plan: Optional[Plan]) -> Entitlement:
+    if insider:
+        return Entitlement(user_id=user.user_id,
+                           insider=True)
+
+    return Entitlement(user_id=user.user_id,
+                       plan_id=plan.plan_id if plan else None,
+                       features=(plan.features or []) if plan else [],
+                       priority_weight=(plan.priority_weight or 1.0) if plan else 1.0)
+
+def get_entitlement(user: Account) -> Entitlement:
+    entitlement = entitlement_cache.get(user.user_id)
+
+    if entitlement is None:
+        insider = account_service.is_insider(user)
+        entitlement = make_entitlement(user, insider, None if insider else get_current_plan(user))
+
+        entitlement_cache.set(user.user_id, entitlement)
+
+    return entitlement
+
+
+async def get_entitlement_async(user: Account) -> Entitlement:
+    entitlement = entitlement_cache.get(user.user_id)
+
+    if entitlement is None:
+        insider = await account_service.is_insider_async(user)
+        entitlement = make_entitlement(user, insider, None if insider else await get_current_plan_async(user))
+
+        entitlement_cache.set(user.user_id, entitlement)
+
+    return entitlement
+
+
+def invalidate_entitlement(user_id: Optional[str]) -> None:
+    if user_id:
+        entitlement_cache.invalidate(user_id)
+
+
 def has_permissions(feature: str, 
                     user: Account) -> bool:
-    
-    if account_service.is_insider(user):
-        return True
+    entitlement = get_entitlement(user)
 
-    plan = get_current_plan(user)
+    return entitlement.insider or feature in entitlement.features
 
-    if plan and feature in plan.features:
-        return True
-            
-    return False
+
+async def has_permissions_async(feature: str,
+                                user: Account) -> bool:
+    entitlement = await get_entitlement_async(user)
+
+    return entitlement.insider or feature in entitlement.features
 
 # TODO: test the expired subscription for radom and paypal
 
-def create_radom_checkout_session(
+async def create_radom_checkout_session(
     req: RadomCheckoutRequest,
     user: Account
 ) -> Dict[str, Any]:
-    payment_account = get_payment_account(user_id=user.user_id)
+    payment_account = await get_payment_account_async(user_id=user.user_id)
 
     if payment_account and payment_account.status == "active":
         raise HTTPException(
@@ -135,7 +188,7 @@ def create_radom_checkout_session(
 
     print("CREATING RADOM CHECKOUT SESSION...")
     try:
-        response = requests.request("POST", url, json=payload, headers=headers)
+        response = await http_client.get_client("radom").post(url, json=payload, headers=headers)
         response.raise_for_status()  # Raise an exception for any HTTP error
         response_data = response.json()
         print(f"RADOM RESPONSE: {response_data}")
@@ -152,18 +205,21 @@ def create_radom_checkout_session(
             print("RADOM CHECKOUT SESSION ID IS NULL")
         
         return response_data
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print("Error creating checkout session:", e)
         return {}  # Return an empty dictionary in case of error
 
 
-async def radom_webhook(request: Request) -> None:
-    body = await request.body()
-    body_str = body.decode()
+def radom_ordering_key(body_dict: dict) -> Optional[str]:
+    # Every subscription event carries its subscription id under its own event type
+    for event_data in (body_dict.get("eventData") or {}).values():
+        if isinstance(event_data, dict) and event_data.get("subscriptionId"):
+            return event_data["subscriptionId"]
 
-    # Parse JSON string into a Python dictionary
-    body_dict = json.loads(body_str)
+    return None
 
+
+async def radom_webhook(body_dict: dict) -> None:
     print(f"RADOM REQUEST BODY: {body_dict}")
 
     # Extract the event type
@@ -228,26 +284,28 @@ async def radom_webhook(request: Request) -> None:
 
         print(f"GOT REFERRAL ID FROM CHECKOUT SESSION METADATA: {referral_id}")
 
-        create_payment_account(user_id=user_id, 
-                               provider="radom",
-                               paypal_plan_id=None,
-                               paypal_subscription_id=None,
-                               radom_subscription_id=radom_subscription_id, 
-                               radom_checkout_session_id=radom_checkout_session_id, 
-                               amount=amount,
-                               radom_product_id=radom_product_id,
-                               gc_billing_request_id=None,
-                               gc_subscription_id=None,
-                               plan_id=None,
-                               referral_id=referral_id,
-                               status="active")
+        payment_account = create_payment_account(user_id=user_id, 
+                                                 provider="radom",
+                                                 paypal_plan_id=None,
+                                                 paypal_subscription_id=None,
+                                                 radom_subscription_id=radom_subscription_id, 
+                                                 radom_checkout_session_id=radom_checkout_session_id, 
+                                                 amount=amount,
+                                                 radom_product_id=radom_product_id,
+                                                 gc_billing_request_id=None,
+                                                 gc_subscription_id=None,
+                                                 plan_id=None,
+                                                 referral_id=referral_id,
+                                                 status="active")
         
-        account = account_service.get_by_id(user_id=internal_metadata.user_id)
-
-        email_service.send(account.email, 
-                           "clwxmnsll00vvrmqenbal0jln",
-                           username=account.username,
-                           discord_link=os.getenv("DISCORD_LINK"))
+        account = await account_service.get_by_id_async(user_id=internal_metadata.user_id if internal_metadata else user_id)
+
+        # Keyed on the event so a retried webhook doesn't send the email twice
+        await email_service.send(account.email, 
+                                 "clwxmnsll00vvrmqenbal0jln",
+                                 dedup_key=f"radom:{event_type}:{radom_subscription_id}",
+                                 username=account.username,
+                                 discord_link=os.getenv("DISCORD_LINK"))
         
         if payment_account and referral_id:
             referral = referral_service.get_referral(referral_id)
@@ -259,48 +317,57 @@ async def radom_webhook(request: Request) -> None:
                                              subscription_cancelled=False)
         
     elif event_type == "subscriptionExpired":
-        radom_subscription_id = body_dict.get("eventData", {}).get("newSubscription", {}).get("subscriptionId")
+        event_data = body_dict.get("eventData", {})
+        radom_subscription_id = event_data.get("subscriptionExpired", {}).get("subscriptionId") \
+                                or event_data.get("newSubscription", {}).get("subscriptionId")
+
+        payment_account = await get_payment_account_async(radom_subscription_id=radom_subscription_id)
+
+        if payment_account is None:
+            raise HTTPException(status_code=404, detail="Payment account not found for subscription")
+
+        internal_metadata = get_radom_checkout_session_metadata(payment_account.radom_checkout_session_id)
 
         set_payment_account_status(radom_subscription_id=radom_subscription_id,
                                    status="disabled")
         
-        account = account_service.get_by_id(user_id=internal_metadata.user_id)
+        account = await account_service.get_by_id_async(user_id=internal_metadata.user_id if internal_metadata else payment_account.user_id)
 
-        email_service.send(account.email, 
-                           "clwy121tq01hh7cvn4qwz3rjc",
-                           username=account.username,
-                           discord_link=os.getenv("DISCORD_LINK"))
+        await email_service.send(account.email, 
+                                 "clwy121tq01hh7cvn4qwz3rjc",
+                                 dedup_key=f"radom:{event_type}:{radom_subscription_id}",
+                                 username=account.username,
+                                 discord_link=os.getenv("DISCORD_LINK"))
         
     elif event_type == "subscriptionCancelled":
         radom_subscription_id = body_dict.get("eventData", {}).get("subscriptionCancelled", {}).get("subscriptionId")
 
-        payment_account = get_payment_account(radom_subscription_id=radom_subscription_id)
+        payment_account = await get_payment_account_async(radom_subscription_id=radom_subscription_id)
 
         internal_metadata = get_radom_checkout_session_metadata(payment_account.radom_checkout_session_id)
 
         set_payment_account_status(user_id=internal_metadata.user_id,
                                    status="cancelled")
         
-        account = account_service.get_by_id(user_id=internal_metadata.user_id)
+        account = await account_service.get_by_id_async(user_id=internal_metadata.user_id)
 
-        email_service.send(account.email, 
-                           "clwxm0der014zw2uff7l0pu9w",
-                           username=account.username,
-                           discord_link=os.getenv("DISCORD_LINK"))
+        await email_service.send(account.email, 
+                                 "clwxm0der014zw2uff7l0pu9w",
+                                 dedup_key=f"radom:{event_type}:{radom_subscription_id}",
+                                 username=account.username,
+                                 discord_link=os.getenv("DISCORD_LINK"))
 
     return
 
 
-async def paypal_webhook(request: Request) -> None:
-    # Read the request body
-    body = await request.body()
-        
-    # Decode the body content to a string
-    body_str = body.decode("utf-8")
+def paypal_ordering_key(body_dict: dict) -> Optional[str]:
+    resource = body_dict.get("resource") or {}
 
-    # Parse the JSON string into a dictionary
-    body_dict = dict(json.loads(body_str))
+    # Sale events reference the subscription as billing_agreement_id, subscription events by their own id
+    return resource.get("billing_agreement_id") or resource.get("id")
 
+
+async def paypal_webhook(body_dict: dict) -> None:
     print(f"PAYPAL REQUEST BODY: {body_dict}")
 
     event_type = body_dict.get('event_type')
@@ -354,31 +421,39 @@ async def paypal_webhook(request: Request) -> None:
                                                  referral_id=internal_metadata.referral_id,
                                                  status="active")
         
-        account = account_service.get_by_id(user_id=internal_metadata.user_id)
+        account = await account_service.get_by_id_async(user_id=internal_metadata.user_id)
 
-        email_service.send(account.email, 
-                           "clwxmnsll00vvrmqenbal0jln",
-                           username=account.username,
-                           discord_link=os.getenv("DISCORD_LINK"))
+        await email_service.send(account.email, 
+                                 "clwxmnsll00vvrmqenbal0jln",
+                                 dedup_key=f"paypal:{body_dict.get('id')}",
+                                 username=account.username,
+                                 discord_link=os.getenv("DISCORD_LINK"))
 
 
     elif event_type == "BILLING.SUBSCRIPTION.EXPIRED":
         print("EVENT: BILLING.SUBSCRIPTION.EXPIRED")
         
-        print("GETTING CUSTOM ID...")
-        subscription_id = body_dict.get("id", {})
+        print("GETTING SUBSCRIPTION ID...")
+        subscription_id = body_dict.get("resource", {}) \
+                                   .get("id")
 
         print(f"GOT SUBSCRIPTION ID: {subscription_id}")
+
+        payment_account = await get_payment_account_async(paypal_subscription_id=subscription_id)
+
+        if payment_account is None:
+            raise HTTPException(status_code=404, detail="Payment account not found for subscription")
     
         set_payment_account_status(paypal_subscription_id=subscription_id,
                                    status="disabled")
         
-        account = account_service.get_by_id(user_id=internal_metadata.user_id)
+        account = await account_service.get_by_id_async(user_id=payment_account.user_id)
 
-        email_service.send(account.email, 
-                           "clwy121tq01hh7cvn4qwz3rjc",
-                           username=account.username,
-                           discord_link=os.getenv("DISCORD_LINK"))
+        await email_service.send(account.email, 
+                                 "clwy121tq01hh7cvn4qwz3rjc",
+                                 dedup_key=f"paypal:{body_dict.get('id')}",
+                                 username=account.username,
+                                 discord_link=os.getenv("DISCORD_LINK"))
     
     elif event_type == "PAYMENT.SALE.COMPLETED":
         print(f"EVENT: PAYMENT SALE COMPLETED")
@@ -390,14 +465,15 @@ async def paypal_webhook(request: Request) -> None:
         
         internal_metadata = get_paypal_checkout_metadata(custom_id)
 
-        account = account_service.get_by_id(user_id=internal_metadata.user_id)
+        account = await account_service.get_by_id_async(user_id=internal_metadata.user_id)
 
-        email_service.send(account.email, 
-                           "clwxmcrp7005y5htkedf5th36",
-                           username=account.username,
-                           discord_link=os.getenv("DISCORD_LINK"))
+        await email_service.send(account.email, 
+                                 "clwxmcrp7005y5htkedf5th36",
+                                 dedup_key=f"paypal:{body_dict.get('id')}",
+                                 username=account.username,
+                                 discord_link=os.getenv("DISCORD_LINK"))
 
-        payment_account = get_payment_account(user_id=internal_metadata.user_id)
+        payment_account = await get_payment_account_async(user_id=internal_metadata.user_id)
 
         print("CHECKING IF ACCOUNT IS FROM REFERRAL")
         if payment_account and internal_metadata.referral_id:
@@ -425,12 +501,13 @@ async def paypal_webhook(request: Request) -> None:
         set_payment_account_status(user_id=internal_metadata.user_id,
                                    status="disabled")
 
-        account = account_service.get_by_id(user_id=internal_metadata.user_id)
+        account = await account_service.get_by_id_async(user_id=internal_metadata.user_id)
 
-        email_service.send(account.email, 
-                           "clwxmnsll00vvrmqenbal0jln",
-                           username=account.username,
-                           discord_link=os.getenv("DISCORD_LINK"))
+        await email_service.send(account.email, 
+                                 "clwxmnsll00vvrmqenbal0jln",
+                                 dedup_key=f"paypal:{body_dict.get('id')}",
+                                 username=account.username,
+                                 discord_link=os.getenv("DISCORD_LINK"))
 
     # Handle subscription events
     elif event_type == "BILLING.SUBSCRIPTION.CANCELLED":
@@ -446,12 +523,13 @@ async def paypal_webhook(request: Request) -> None:
         set_payment_account_status(user_id=internal_metadata.user_id,
                                    status="cancelled")
 
-        account = account_service.get_by_id(user_id=internal_metadata.user_id)
+        account = await account_service.get_by_id_async(user_id=internal_metadata.user_id)
 
-        email_service.send(account.email, 
-                           "clwxm0der014zw2uff7l0pu9w",
-                           username=account.username,
-                           discord_link=os.getenv("DISCORD_LINK"))
+        await email_service.send(account.email, 
+                                 "clwxm0der014zw2uff7l0pu9w",
+                                 dedup_key=f"paypal:{body_dict.get('id')}",
+                                 username=account.username,
+                                 discord_link=os.getenv("DISCORD_LINK"))
     else:
         print("Unhandled event type:", event_type)
     
@@ -516,8 +594,13 @@ async def create_gc_checkout_session(req: GCRequest,
 
     return authorisation_url
 
-async def gc_webhook(request: Request):
-    payload = await request.json()
+def gc_ordering_key(event: dict) -> Optional[str]:
+    links = event.get("links") or {}
+
+    return links.get("subscription") or links.get("billing_request") or links.get("mandate")
+
+
+async def gc_webhook(payload: dict):
     print("GC REQUEST BODY:", json.dumps(payload, indent=4))
 
     for event in payload.get("events", []):
@@ -538,7 +621,7 @@ async def gc_webhook(request: Request):
             billing_request = event.get("links").get("billing_request")
             mandate = event.get("links").get("mandate")
 
-            payment_account = get_payment_account(gc_billing_request_id=billing_request)
+            payment_account = await get_payment_account_async(gc_billing_request_id=billing_request)
 
             if payment_account.gc_mandate_count == 1:
                 print("#################################################################")
@@ -563,10 +646,11 @@ async def gc_webhook(request: Request):
                             "mandate": mandate
                         },
                         "metadata": {
-                            "subscription_number": str(uuid4())
+                            "subscription_number": billing_request
                         }
                     }, headers={
-                        'Idempotency-Key': str(uuid4())
+                        # One subscription per billing request, a retried event gets back the one already created
+                        'Idempotency-Key': f"subscription-{billing_request}"
                 })
 
                 print("SUBSCRIPTION CREATED:", subscription)
@@ -575,12 +659,13 @@ async def gc_webhook(request: Request):
                                                          gc_subscription_id=subscription.id,
                                                          status="active")
                 
-                account = account_service.get_by_id(user_id=payment_account.user_id)
+                account = await account_service.get_by_id_async(user_id=payment_account.user_id)
 
-                email_service.send(account.email, 
-                                   "clwxmnsll00vvrmqenbal0jln",
-                                   username=account.username,
-                                   discord_link=os.getenv("DISCORD_LINK"))
+                await email_service.send(account.email, 
+                                         "clwxmnsll00vvrmqenbal0jln",
+                                         dedup_key=f"gocardless:{event.get('id')}",
+                                         username=account.username,
+                                         discord_link=os.getenv("DISCORD_LINK"))
                 
                 # if payment_account and payment_account.referral_id:
                 #     referral = referral_service.get_referral(payment_account.referral_id)
@@ -602,12 +687,13 @@ async def gc_webhook(request: Request):
                                                      gc_mandate_count=-2,
                                                      status="cancelled")
             
-            account = account_service.get_by_id(user_id=payment_account.user_id)
+            account = await account_service.get_by_id_async(user_id=payment_account.user_id)
 
-            email_service.send(account.email, 
-                               "clwxm0der014zw2uff7l0pu9w",
-                               username=account.username,
-                               discord_link=os.getenv("DISCORD_LINK"))
+            await email_service.send(account.email, 
+                                     "clwxm0der014zw2uff7l0pu9w",
+                                     dedup_key=f"gocardless:{event.get('id')}",
+                                     username=account.username,
+                                     discord_link=os.getenv("DISCORD_LINK"))
             
     return {"status": "ok"}
 
@@ -624,7 +710,7 @@ def get_paypal_checkout_metadata(uuid: str) -> Optional[PaypalCheckoutMetadata]:
     return data.get_paypal_checkout_metadata(uuid)
 
 
-def get_paypal_access_token():
+async def get_paypal_access_token():
     client_id = os.getenv("PAYPAL_CLIENT_ID")
     client_secret = os.getenv("PAYPAL_CLIENT_SECRET")
 
@@ -643,7 +729,7 @@ def get_paypal_access_token():
     }
 
     # Make the POST request
-    response = requests.post(f"{os.getenv('PAYPAL_DOMAIN')}/oauth2/token", headers=headers, data=data)
+    response = await http_client.get_client("paypal").post(f"{os.getenv('PAYPAL_DOMAIN')}/oauth2/token", headers=headers, data=data)
 
     # Check the response
     if response.status_code == 200:
@@ -652,35 +738,34 @@ def get_paypal_access_token():
         print("Error getting access token:", response.status_code, response.json())
 
 
-def fetch_subscription_details(subscription_id: str, access_token: str):
+async def fetch_subscription_details(subscription_id: str, access_token: str):
     url = f"{os.getenv('PAYPAL_DOMAIN')}/billing/subscriptions/{subscription_id}"
     headers = {
         'Content-Type': 'application/json',
         'Accept': 'application/json',
         'Authorization': f'Bearer {access_token}',
     }
-    response = requests.get(url, headers=headers)
+    response = await http_client.get_client("paypal").get(url, headers=headers)
     return response
 
 
-def cancel_plan(user: Account) -> bool:
-    access_token = get_paypal_access_token()
+async def cancel_plan(user: Account) -> bool:
 
-    payment_account = get_payment_account(user_id=user.user_id)
+    payment_account = await get_payment_account_async(user_id=user.user_id)
     
     if payment_account and hasattr(payment_account, 'paypal_subscription_id') \
        and payment_account.paypal_subscription_id is not None \
        and payment_account.provider == "paypal":
         subscription_id = payment_account.paypal_subscription_id
 
-        access_token = get_paypal_access_token()
+        access_token = await get_paypal_access_token()
 
         if access_token is None:
             print("Failed to obtain access token.")
             return False
 
         # Fetch subscription details to verify existence
-        details_response = fetch_subscription_details(subscription_id, access_token)
+        details_response = await fetch_subscription_details(subscription_id, access_token)
         if details_response.status_code != 200:
             print(f'Failed to fetch subscription details for {subscription_id}. Response: {details_response.text}')
             return False
@@ -697,7 +782,7 @@ def cancel_plan(user: Account) -> bool:
 
         url = f"{os.getenv('PAYPAL_DOMAIN')}/billing/subscriptions/{subscription_id}/cancel"
 
-        response = requests.post(url, headers=headers, json=data)
+        response = await http_client.get_client("paypal").post(url, headers=headers, json=data)
 
         if response.status_code == 204:
             print(f'Subscription {subscription_id} cancelled successfully.')
@@ -716,7 +801,7 @@ def cancel_plan(user: Account) -> bool:
             "Authorization": os.getenv('RADOM_ACCESS_TOKEN')
         }
 
-        response = requests.request("POST", url, headers=headers)
+        response = await http_client.get_client("radom").post(url, headers=headers)
 
         if response.status_code == 200:
             return True
@@ -770,6 +855,30 @@ def get_product(paypal_plan_id: Optional[str] = None,
                             plan_id)
 
 
+def reload_plan_catalog(user: Optional[Account] = None) -> int:
+    if user is not None and not account_service.is_insider(user):
+        raise HTTPException(status_code=403, detail="Only insiders can reload the plan catalog.")
+
+    count = data.load_plan_catalog()
+
+    # Cached entitlements carry plan features, refresh them with the catalog
+    entitlement_cache.clear()
+
+    return count
+
+
+async def refresh_plan_catalog_periodically() -> None:
+    interval = float(os.getenv('PLAN_CATALOG_REFRESH_SECONDS', 600))
+
+    while True:
+        try:
+            await asyncio.to_thread(reload_plan_catalog)
+        except Exception as e:
+            print(f"Error refreshing plan catalog: {e}")
+
+        await asyncio.sleep(interval)
+
+
 def create_payment_account(user_id: Optional[str] = None,
                            provider: Optional[str] = None,
                            paypal_plan_id: Optional[str] = None,
@@ -785,20 +894,27 @@ def create_payment_account(user_id: Optional[str] = None,
                            status: Optional[str] = None,
                            referral_id: Optional[str] = None) -> Optional[PaymentAccount]:
     
-    return data.create_payment_account(user_id, 
-                                       provider,
-                                       paypal_plan_id,
-                                       paypal_subscription_id,
-                                       radom_subscription_id,
-                                       radom_checkout_session_id,
-                                       amount,
-                                       radom_product_id,
-                                       gc_billing_request_id,
-                                       gc_subscription_id,
-                                       gc_mandate_count,
-                                       plan_id,
-                                       status,
-                                       referral_id)
+    payment_account = data.create_payment_account(user_id, 
+                                                  provider,
+                                                  paypal_plan_id,
+                                                  paypal_subscription_id,
+                                                  radom_subscription_id,
+                                                  radom_checkout_session_id,
+                                                  amount,
+                                                  radom_product_id,
+                                                  gc_billing_request_id,
+                                                  gc_subscription_id,
+                                                  gc_mandate_count,
+                                                  plan_id,
+                                                  status,
+                                                  referral_id)
+
+    invalidate_entitlement(user_id)
+
+    if payment_account:
+        invalidate_entitlement(payment_account.user_id)
+
+    return payment_account
 
 
 def set_payment_account_status(user_id: Optional[str] = None,
@@ -807,12 +923,15 @@ def set_payment_account_status(user_id: Optional[str] = None,
                                gc_billing_request_id: Optional[str] = None,
                                gc_subscription_id: Optional[str] = None,
                                status: Optional[str] = None) -> None:
-    return data.set_payment_account_status(user_id,
-                                           paypal_subscription_id,
-                                           radom_subscription_id,
-                                           gc_billing_request_id,
-                                           gc_subscription_id,
-                                           status)
+    updated_user_id = data.set_payment_account_status(user_id,
+                                                      paypal_subscription_id,
+                                                      radom_subscription_id,
+                                                      gc_billing_request_id,
+                                                      gc_subscription_id,
+                                                      status)
+
+    invalidate_entitlement(user_id)
+    invalidate_entitlement(updated_user_id)
 
 
 def get_payment_account(user_id: str = None,
@@ -828,9 +947,31 @@ def get_payment_account(user_id: str = None,
                                     gc_billing_request_id)
 
 
+async def get_payment_account_async(user_id: str = None,
+                                    paypal_subscription_id: str = None,
+                                    radom_checkout_session_id: str = None,
+                                    radom_subscription_id: str = None,
+                                    gc_billing_request_id: str = None) -> Optional[PaymentAccount]:
+    
+    return await aio_data.get_payment_account(user_id,
+                                              paypal_subscription_id,
+                                              radom_checkout_session_id,
+                                              radom_subscription_id,
+                                              gc_billing_request_id)
+
+
 def get_current_plan(user: Account) -> Optional[Plan]:
     payment_account = get_payment_account(user.user_id)
 
+    if payment_account and (payment_account.status == "active"):
+        return get_product(paypal_plan_id=payment_account.paypal_plan_id,
+                           radom_product_id=payment_account.radom_product_id,
+                           plan_id=payment_account.plan_id)
+
+
+async def get_current_plan_async(user: Account) -> Optional[Plan]:
+    payment_account = await get_payment_account_async(user.user_id)
+
     if payment_account and (payment_account.status == "active"):
         return get_product(paypal_plan_id=payment_account.paypal_plan_id,
                            radom_product_id=payment_account.radom_product_id,
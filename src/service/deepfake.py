@@ -1,27 +1,23 @@
 from fastapi import HTTPException
 
-from typing import List, Optional
-
-import os
+from typing import List, Optional, Tuple
 
 import re
 
-from pyuploadcare import Uploadcare
-
-import data.deepfake as data
+from data.aio import deepfake as aio_data
 
 from model.account import Account
 from model.deepfake import Message
 
-def get_file_format(file_id: str):
+import service.scheduler as scheduler
+import service.uploadcare as uploadcare_service
+
+async def get_file_format(file_id: str):
     print("GETTING FILE FORMAT")
     print(file_id)
-    uploadcare = Uploadcare(public_key=os.getenv('UPLOADCARE_PUBLIC_KEY'), 
-                            secret_key=os.getenv('UPLOADCARE_SECRET_KEY'))
-
-    file_info = uploadcare.file(file_id).info
+    file_info = await uploadcare_service.get_file_info(file_id)
 
-    return file_info['mime_type'].split('/')[1]
+    return uploadcare_service.get_file_format(file_info)
 
 def extract_id_from_uploadcare_uri(uploadcare_uri):
     print("EXTRACTING ID FROM UPLODCARE URI")
@@ -33,55 +29,67 @@ def extract_id_from_uploadcare_uri(uploadcare_uri):
     else:
         return None
 
-def check_file_formats(uploadcare_uri, valid_formats):
-    print("CHECKING FILE FORMATS")
-    file_id = extract_id_from_uploadcare_uri(uploadcare_uri)
-    file_format = get_file_format(file_id)
-
+def validate_file_format(file_format, valid_formats):
     print("FILE FORMAT: ", file_format)
 
     if file_format not in valid_formats:
 
         raise HTTPException(status_code=400, detail=f"Invalid file format. \
                             Valid ones are {valid_formats}")
-    
-def get_file_formats(uploadcare_uris):
-    print("GETTINGS FILE FORMATS FROM LIST")
-    file_formats = []
 
-    for uri in uploadcare_uris:
-        file_id = extract_id_from_uploadcare_uri(uri)
-        file_format = get_file_format(file_id)
+async def check_file_formats(uploadcare_uri, valid_formats):
+    print("CHECKING FILE FORMATS")
+    file_id = extract_id_from_uploadcare_uri(uploadcare_uri)
+    file_format = await get_file_format(file_id)
+
+    validate_file_format(file_format, valid_formats)
 
-        if file_format == "quicktime":
-            file_format = "mp4"
+async def fetch_file_formats(uploadcare_uris):
+    # Looks up all files of a request concurrently
+    file_ids = [extract_id_from_uploadcare_uri(uri) for uri in uploadcare_uris]
+    file_infos = await uploadcare_service.get_file_infos(file_ids)
 
-        file_formats.append(file_format)
+    return [uploadcare_service.get_file_format(file_info) for file_info in file_infos]
+
+def normalize_file_formats(file_formats):
+    return ["mp4" if file_format == "quicktime" else file_format for file_format in file_formats]
+    
+async def get_file_formats(uploadcare_uris):
+    print("GETTINGS FILE FORMATS FROM LIST")
+    file_formats = normalize_file_formats(await fetch_file_formats(uploadcare_uris))
 
     print("FILE FORMATS: ", file_formats)
 
     return file_formats
 
-def create_message(user_id: Optional[str] = None,
-                   status: Optional[str] = None,
-                   facefusion_source_uris: Optional[List[str]] = None,
-                   facefusion_target_uri: Optional[str] = None,
-                   akool_source_uri: Optional[str] = None,
-                   akool_target_uri: Optional[str] = None,
-                   job_id: Optional[str] = None,
-                   output_url: Optional[str] = None) -> Optional[Message]:
+async def create_message(user_id: Optional[str] = None,
+                         status: Optional[str] = None,
+                         facefusion_source_uris: Optional[List[str]] = None,
+                         facefusion_target_uri: Optional[str] = None,
+                         akool_source_uri: Optional[str] = None,
+                         akool_target_uri: Optional[str] = None,
+                         job_id: Optional[str] = None,
+                         output_url: Optional[str] = None) -> Optional[Message]:
     
-    return data.create_message(user_id,
-                          status,
-                          facefusion_source_uris,
-                          facefusion_target_uri,
-                          akool_source_uri,
-                          akool_target_uri,
-                          job_id,
-                          output_url)
-
-def get_message(job_id: str) -> Optional[Message]:
-    return data.get_message(job_id)
-
-def get_history(user: Account) -> Optional[List[Message]]:
-    return data.get_history(user.user_id)
\ No newline at end of file
+    return await aio_data.create_message(user_id,
+                                         status,
+                                         facefusion_source_uris,
+                                         facefusion_target_uri,
+                                         akool_source_uri,
+                                         akool_target_uri,
+                                         job_id,
+                                         output_url)
+
+async def get_message(job_id: str) -> Optional[Message]:
+    return await aio_data.get_message(job_id)
+
+async def check_active_jobs(user: Account) -> None:
+    scheduler.check_active_jobs(await aio_data.count_active_jobs(user.user_id, scheduler.get_active_since()))
+
+async def get_history(user: Account,
+                      cursor: Optional[str] = None,
+                      limit: Optional[int] = None) -> Tuple[List[Message], Optional[str]]:
+    try:
+        return await aio_data.get_history(user.user_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
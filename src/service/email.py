@@ -1,20 +1,142 @@
-import requests
+from typing import Optional
+
+from datetime import datetime, timedelta
+
+import asyncio
+
+import httpx
 
 import os
 
-def send(email: str, transactional_id: str, **data_variables):
+from data.aio import email as aio_data
+
+from model.email import OutboxEmail
+
+import service.http_client as http_client
+
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', 20))
+EMAIL_OUTBOX_POLL_SECONDS = float(os.getenv('EMAIL_OUTBOX_POLL_SECONDS', 5))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', 8))
+EMAIL_OUTBOX_BACKOFF_SECONDS = float(os.getenv('EMAIL_OUTBOX_BACKOFF_SECONDS', 10))
+EMAIL_OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv('EMAIL_OUTBOX_MAX_BACKOFF_SECONDS', 3600))
+EMAIL_OUTBOX_LEASE_SECONDS = 60
+
+# Set by send so the dispatcher picks up new emails without waiting for the next poll
+outbox_wakeup = asyncio.Event()
+
+outbox_stats = {
+    "enqueued": 0,
+    "sent": 0,
+    "retried": 0,
+    "failed": 0
+}
+
+
+async def send(email: str, 
+               transactional_id: str, 
+               dedup_key: Optional[str] = None, 
+               **data_variables) -> str:
+    """Queue an email, sends sharing a dedup_key are only queued once"""
+
+    print("QUEUEING EMAIL")
+    now = datetime.now()
+
+    record_id = await aio_data.enqueue(OutboxEmail(email=email,
+                                                   transactional_id=transactional_id,
+                                                   data_variables=data_variables,
+                                                   next_attempt_at=now,
+                                                   created_at=now,
+                                                   dedup_key=dedup_key))
+
+    outbox_stats["enqueued"] += 1
+    outbox_wakeup.set()
+
+    return record_id
+
+
+async def deliver(record: dict) -> None:
     print("SENDING EMAIL")
-    response = requests.request(
-        "POST", 
-        "https://app.loops.so/api/v1/transactional", 
+    response = await http_client.get_client("loops").post(
+        "https://app.loops.so/api/v1/transactional",
         json={
-            "transactionalId": transactional_id,
-            "email": email,
-            "dataVariables": data_variables
+            "transactionalId": record["transactional_id"],
+            "email": record["email"],
+            "dataVariables": record.get("data_variables", {})
         },
         headers={
             "Authorization": f"Bearer {os.getenv('LOOPS_ACCESS_TOKEN')}",
-            "Content-Type": "application/json"
+            "Content-Type": "application/json",
+            # A retry after a lost response is recognised by Loops instead of sending twice
+            "Idempotency-Key": str(record["_id"])
         }
     )
-    return response
+
+    # Loops answers a key it has already seen with 409, that email went out
+    if response.status_code == 409:
+        return
+
+    response.raise_for_status()
+
+
+def is_permanent(error: Exception) -> bool:
+    # Loops rejected the email itself, sending it again gets the same answer
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return 400 <= status_code < 500 and status_code not in (408, 429)
+
+    return False
+
+
+async def deliver_and_record(record: dict) -> None:
+    try:
+        await deliver(record)
+        await aio_data.mark_sent(record["_id"])
+        outbox_stats["sent"] += 1
+    except Exception as e:
+        attempts = record.get("attempts", 0) + 1
+
+        if is_permanent(e):
+            print(f"EMAIL {record['_id']} REJECTED BY LOOPS: {e}")
+            await aio_data.mark_failed(record["_id"], attempts, str(e))
+            outbox_stats["failed"] += 1
+        elif attempts >= EMAIL_OUTBOX_MAX_ATTEMPTS:
+            print(f"GIVING UP ON EMAIL {record['_id']} AFTER {attempts} ATTEMPTS: {e}")
+            await aio_data.mark_failed(record["_id"], attempts, str(e))
+            outbox_stats["failed"] += 1
+        else:
+            backoff = min(EMAIL_OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1), EMAIL_OUTBOX_MAX_BACKOFF_SECONDS)
+            await aio_data.mark_retry(record["_id"],
+                                      attempts,
+                                      datetime.now() + timedelta(seconds=backoff),
+                                      str(e))
+            outbox_stats["retried"] += 1
+
+
+async def dispatch_outbox() -> None:
+    while True:
+        outbox_wakeup.clear()
+
+        try:
+            batch = await aio_data.claim_batch(EMAIL_OUTBOX_BATCH_SIZE,
+                                               EMAIL_OUTBOX_LEASE_SECONDS)
+
+            if batch:
+                await asyncio.gather(*[deliver_and_record(record) for record in batch])
+
+            # A full batch means more emails are probably waiting
+            if len(batch) == EMAIL_OUTBOX_BATCH_SIZE:
+                continue
+        except Exception as e:
+            print(f"Error dispatching email outbox: {e}")
+
+        try:
+            await asyncio.wait_for(outbox_wakeup.wait(), timeout=EMAIL_OUTBOX_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def get_outbox_stats() -> dict:
+    return {
+        **outbox_stats,
+        "queue_depth": await aio_data.count_pending()
+    }
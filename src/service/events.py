@@ -0,0 +1,121 @@
+from fastapi.encoders import jsonable_encoder
+
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+import asyncio
+
+import json
+
+import os
+
+from data.aio import events as aio_data
+
+# With several workers a webhook may land on a different one than the user's stream,
+# the change stream on the JobEvent collection fans every event out to all of them
+EVENTS_CHANGE_STREAM = os.getenv('EVENTS_CHANGE_STREAM') == "true"
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', 100))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv('EVENTS_HEARTBEAT_SECONDS', 15))
+
+# Open streams by user_id
+subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+event_stats = {
+    "published": 0,
+    "delivered": 0,
+    "dropped": 0
+}
+
+
+def subscribe(user_id: str) -> asyncio.Queue:
+    queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+    subscribers.setdefault(user_id, set()).add(queue)
+
+    return queue
+
+
+def unsubscribe(user_id: str,
+                queue: asyncio.Queue) -> None:
+    queues = subscribers.get(user_id)
+
+    if queues is not None:
+        queues.discard(queue)
+
+        if not queues:
+            del subscribers[user_id]
+
+
+def deliver(user_id: str,
+            event: dict) -> None:
+    for queue in subscribers.get(user_id, ()):
+        # A stalled client loses its oldest updates rather than holding memory
+        if queue.full():
+            queue.get_nowait()
+            event_stats["dropped"] += 1
+
+        queue.put_nowait(event)
+        event_stats["delivered"] += 1
+
+
+async def publish(user_id: Optional[str],
+                  event_type: str,
+                  message) -> None:
+    if not user_id:
+        return
+
+    event = {"type": event_type, "data": jsonable_encoder(message)}
+
+    # Webhooks must not fail because a notification couldn't be sent
+    try:
+        if EVENTS_CHANGE_STREAM:
+            # Delivered by watch_events on every worker, this one included
+            await aio_data.create_event(user_id, event)
+        else:
+            deliver(user_id, event)
+
+        event_stats["published"] += 1
+    except Exception as e:
+        print(f"Error publishing {event_type} event: {e}")
+
+
+async def watch_events() -> None:
+    resume_after = None
+
+    while True:
+        try:
+            async with aio_data.watch_events(resume_after) as stream:
+                async for change in stream:
+                    resume_after = change["_id"]
+                    document = change["fullDocument"]
+                    deliver(document["user_id"], document["event"])
+        except Exception as e:
+            print(f"Error watching job events: {e}")
+            await asyncio.sleep(5)
+
+
+async def stream(user_id: str,
+                 is_disconnected: Callable[[], Awaitable[bool]]) -> AsyncIterator[str]:
+    """Server-sent events of the user's jobs until the client goes away"""
+
+    queue = subscribe(user_id)
+
+    try:
+        yield ": connected\n\n"
+
+        while not await is_disconnected():
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+
+            yield f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+    finally:
+        unsubscribe(user_id, queue)
+
+
+def get_event_stats() -> dict:
+    return {
+        **event_stats,
+        "streams": sum(len(queues) for queues in subscribers.values())
+    }
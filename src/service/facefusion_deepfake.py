@@ -1,4 +1,4 @@
-from fastapi import BackgroundTasks, HTTPException
+from fastapi import HTTPException
 
 from typing import List, Optional
 
@@ -6,51 +6,58 @@ import os
 
 from uuid import uuid4
 
-import requests
-
-import data.deepfake as data
+from data.aio import deepfake as aio_data
 
 from model.account import Account
 from model.deepfake import Message
 
 import service.billing as billing_service
+import service.http_client as http_client
 import service.deepfake as deepfake_service
+import service.events as events_service
+import service.scheduler as scheduler
 import service.usage_history as usage_history_service
 
-def webhook(message: Message) -> None:
-    data.update_message(user_id=message.user_id,
-                        job_id=message.job_id,
-                        status=message.status,
-                        output_url=message.output_url)
+async def webhook(message: Message) -> None:
+    await aio_data.update_message(user_id=message.user_id,
+                                  job_id=message.job_id,
+                                  status=message.status,
+                                  output_url=message.output_url)
     
     if message.status == 'completed':
-        usage_history_service.update('deepfake', message.user_id)
+        await usage_history_service.update_async('deepfake', message.user_id)
+
+    await events_service.publish(message.user_id, "deepfake", message)
 
-def send_post_request(url: str, headers: dict, payload: dict) -> None:
-    requests.post(url, headers=headers, json=payload)
+async def send_post_request(url: str, headers: dict, payload: dict) -> None:
+    await http_client.get_client("runpod").post(url, headers=headers, json=payload)
 
-def run_video_faceswap(source_uris: str,
-                       target_uri: str,
-                       user: Account,
-                       background_tasks: BackgroundTasks) -> str:
+async def run_video_faceswap(source_uris: str,
+                             target_uri: str,
+                             user: Account) -> str:
     
-    if billing_service.has_permissions("Realistic AI Content Deepfake", user):
+    if await billing_service.has_permissions_async("Realistic AI Content Deepfake", user):
+        await deepfake_service.check_active_jobs(user)
+
         print("RUNNING VIDEO FACESWAP")
         photo_file_formats = ['jpeg', 'png']
 
         source_uris = [source_uris]
+
+        # Every file is looked up once, the formats serve both validation and the payload
+        print('GETTING FILE FORMATS')
+        uploaded_formats = await deepfake_service.fetch_file_formats(source_uris+[target_uri])
         
         print('CHECKING PHOTO FILE FORMATS')
-        for source_uri in source_uris:
-            deepfake_service.check_file_formats(source_uri, photo_file_formats)
+        for source_format in uploaded_formats[:-1]:
+            deepfake_service.validate_file_format(source_format, photo_file_formats)
 
         video_file_formats = ['mp4']
 
         print('CHECKING VIDEO FILE FORMATS')
-        deepfake_service.check_file_formats(target_uri, video_file_formats)
+        deepfake_service.validate_file_format(uploaded_formats[-1], video_file_formats)
 
-        print('GETTING FILE FORMATS')
-        file_formats = deepfake_service.get_file_formats(source_uris+[target_uri])
+        file_formats = deepfake_service.normalize_file_formats(uploaded_formats)
 
         print("FILE FORMATS: ", file_formats)
 
@@ -58,29 +65,31 @@ def run_video_faceswap(source_uris: str,
 
         job_id = str(uuid4())
 
-        print("CREATING A MESSAGE")
-        deepfake_service.create_message(user_id=user.user_id, 
-                                        status="started", 
-                                        facefusion_source_uris=source_uris,
-                                        facefusion_target_uri=target_uri,
-                                        job_id=job_id,
-                                        output_url=None)
-
-        # Define the headers for the request
-        headers = {
-            'Content-Type': 'application/json'
-        }
-
-        # Define the payload for the request
-        payload = {
-            'source_uris': source_uris,
-            'target_uri': target_uri,
-            'job_id': job_id,
-            'file_formats': file_formats,
-            'user_id': user.user_id
-        }
-
-        background_tasks.add_task(send_post_request, url, headers, payload)
+        # Waits for the user's fair share of the FaceFusion backend before submitting
+        async with scheduler.slot("facefusion", user):
+            print("CREATING A MESSAGE")
+            await deepfake_service.create_message(user_id=user.user_id,
+                                                  status="started", 
+                                                  facefusion_source_uris=source_uris,
+                                                  facefusion_target_uri=target_uri,
+                                                  job_id=job_id,
+                                                  output_url=None)
+
+            # Define the headers for the request
+            headers = {
+                'Content-Type': 'application/json'
+            }
+
+            # Define the payload for the request
+            payload = {
+                'source_uris': source_uris,
+                'target_uri': target_uri,
+                'job_id': job_id,
+                'file_formats': file_formats,
+                'user_id': user.user_id
+            }
+
+            await send_post_request(url, headers, payload)
 
         return job_id
     else:
@@ -0,0 +1,58 @@
+from typing import Dict
+
+import os
+
+import httpx
+
+# HTTP/2 needs the optional h2 package, fall back to HTTP/1.1 keep-alive without it
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Request timeout in seconds for every upstream we call
+UPSTREAM_TIMEOUTS = {
+    "akool": 30.0,
+    "akool_detect": 30.0,
+    "loops": 10.0,
+    "mymidjourney": 30.0,
+    "paypal": 20.0,
+    "radom": 20.0,
+    "runpod": 30.0
+}
+
+clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_client(upstream: str) -> httpx.AsyncClient:
+    """Shared keep-alive client of an upstream, created on first use"""
+
+    client = clients.get(upstream)
+
+    if client is None or client.is_closed:
+        max_connections = int(os.getenv('HTTP_MAX_CONNECTIONS_PER_HOST', 20))
+
+        client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(UPSTREAM_TIMEOUTS.get(upstream, 30.0), connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections,
+                                keepalive_expiry=float(os.getenv('HTTP_KEEPALIVE_EXPIRY_SECONDS', 60)))
+        )
+
+        clients[upstream] = client
+
+    return client
+
+
+def start() -> None:
+    for upstream in UPSTREAM_TIMEOUTS:
+        get_client(upstream)
+
+
+async def close() -> None:
+    for client in clients.values():
+        await client.aclose()
+
+    clients.clear()
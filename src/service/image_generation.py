@@ -1,39 +1,101 @@
 from fastapi import BackgroundTasks, HTTPException
 
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from uuid import uuid4
 
+from collections import deque
+
+from datetime import datetime, timedelta
+
+import asyncio
+
+import httpx
+
 import os
 
+import random
+
 import re
 
 import json
 
-from pyuploadcare import Uploadcare
+import service.http_client as http_client
 
-import requests
-
-from comfyui.ModelInterface import generate_workflow
+from comfyui.ModelInterface import generate_workflow, reload_template
 
 import data.image_generation as data
+from data.aio import image_generation as aio_data
 
 from model.account import Account
 from model.image_generation import Settings, Message
 
+import service.account as account_service
 import service.billing as billing_service
+import service.events as events_service
+import service.scheduler as scheduler
+import service.uploadcare as uploadcare_service
 import service.usage_history as usage_history_service
 
+# Fraction of generations whose workflow is captured for debugging, off by default
+WORKFLOW_CAPTURE_RATE = float(os.getenv('WORKFLOW_CAPTURE_RATE', 0))
+WORKFLOW_CAPTURE_DIR = os.getenv('WORKFLOW_CAPTURE_DIR')
+
+COMFYUI_MAX_IN_FLIGHT_PER_BACKEND = int(os.getenv('COMFYUI_MAX_IN_FLIGHT_PER_BACKEND', 4))
+COMFYUI_POLL_SECONDS = float(os.getenv('COMFYUI_POLL_SECONDS', 5))
+COMFYUI_MAX_ATTEMPTS = int(os.getenv('COMFYUI_MAX_ATTEMPTS', 5))
+COMFYUI_BACKOFF_SECONDS = float(os.getenv('COMFYUI_BACKOFF_SECONDS', 5))
+COMFYUI_MAX_BACKOFF_SECONDS = float(os.getenv('COMFYUI_MAX_BACKOFF_SECONDS', 300))
+COMFYUI_JOB_TIMEOUT_SECONDS = float(os.getenv('COMFYUI_JOB_TIMEOUT_SECONDS', 1800))
+COMFYUI_LEASE_SECONDS = 120
+
+# Statuses after which the backend is done with a job and its slot is free again
+TERMINAL_STATUSES = ["completed", "failed"]
+
+# Set when a job is queued or a slot frees up so the dispatcher doesn't wait for the next poll
+queue_wakeup = asyncio.Event()
+
+queue_stats = {
+    "queued": 0,
+    "dispatched": 0,
+    "retried": 0,
+    "failed": 0,
+    "timed_out": 0,
+    "unconfirmed": 0
+}
 
-def webhook(message: Message) -> None:
+# Seconds between queueing and dispatch of the most recent jobs
+recent_waits = deque(maxlen=1000)
+
+# Keeps the running dispatches referenced until they finish
+dispatch_tasks = set()
+
+# Only tags jobs here, the queue itself lives in the ComfyUI collection
+comfyui_queue = scheduler.get_queue("comfyui")
+
+
+def get_backends() -> List[str]:
+    # Comma separated base urls of the GPU backends, the RunPod domain by default
+    backends = os.getenv('COMFYUI_BACKENDS') or os.getenv('RUNPOD_DOMAIN') or ""
+
+    return [backend.strip() for backend in backends.split(",") if backend.strip()]
+
+
+async def webhook(message: Message) -> None:
     print(message)
-    update_message(user_id=message.user_id, 
-                   message_id=message.message_id, 
-                   status=message.status, 
-                   s3_uris=message.s3_uris)
+    await aio_data.update_message(user_id=message.user_id, 
+                                  message_id=message.message_id, 
+                                  status=message.status, 
+                                  s3_uris=message.s3_uris)
 
     if message.status == 'in progress':
-        usage_history_service.update('image_generation', message.user_id)
+        await usage_history_service.update_async('image_generation', message.user_id)
+
+    await events_service.publish(message.user_id, "image_generation", message)
+
+    if message.status in TERMINAL_STATUSES:
+        await aio_data.finish_job(message.message_id)
+        queue_wakeup.set()
 
 
 def save_settings(settings: Settings):
@@ -75,16 +137,183 @@ def map_model(curr_model):
     return model
 
     
-def send_post_request(url: str, headers: dict, payload: dict) -> None:
-    requests.post(url, headers=headers, json=payload)
+async def send_post_request(url: str, headers: dict, payload: dict) -> None:
+    response = await http_client.get_client("runpod").post(url, headers=headers, json=payload)
+    response.raise_for_status()
 
 
-def get_image_path(image_url: str):
-    if image_url:
-        uploadcare = Uploadcare(public_key=os.getenv('UPLOADCARE_PUBLIC_KEY'), secret_key=os.getenv('UPLOADCARE_SECRET_KEY'))
+def may_have_been_sent(error: Exception) -> bool:
+    """Whether RunPod may have received the job despite the error"""
+
+    # Nothing reached the backend if no connection was made, and an error
+    # response means it answered without taking the job
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.HTTPStatusError)):
+        return False
+
+    # A read timeout or a dropped connection can come after the backend accepted it
+    return isinstance(error, httpx.TransportError)
+
+
+async def retry_job(job: dict,
+                    error: Exception) -> None:
+    if job["attempts"] >= COMFYUI_MAX_ATTEMPTS:
+        print(f"GIVING UP ON COMFYUI JOB {job['_id']} AFTER {job['attempts']} ATTEMPTS: {error}")
+        await aio_data.mark_failed(job["_id"], str(error))
+        queue_stats["failed"] += 1
+    else:
+        backoff = min(COMFYUI_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1), COMFYUI_MAX_BACKOFF_SECONDS)
+        await aio_data.mark_retry(job["_id"],
+                                  datetime.now() + timedelta(seconds=backoff),
+                                  str(error))
+        queue_stats["retried"] += 1
+
+
+async def record_dispatched(job: dict) -> None:
+    # The job is already with the backend, left in "dispatching" it would be
+    # reclaimed and sent again once its lease ran out, so the write is retried
+    # until it lands rather than given up on
+    attempt = 0
+
+    while True:
+        try:
+            await aio_data.mark_dispatched(job["_id"])
+            return
+        except Exception as e:
+            attempt += 1
+            print(f"COULDN'T MARK COMFYUI JOB {job['_id']} AS DISPATCHED, RETRYING: {e}")
+            await asyncio.sleep(min(COMFYUI_BACKOFF_SECONDS * 2 ** (attempt - 1), COMFYUI_LEASE_SECONDS / 4))
+
+
+async def dispatch_job(job: dict) -> None:
+    url = f"{job['backend']}/image-generation/"
+
+    # Define the headers for the request
+    headers = {
+        'Content-Type': 'application/json'
+    }
+
+    try:
+        await send_post_request(url, headers, job["payload"])
+    except Exception as e:
+        if not may_have_been_sent(e):
+            await retry_job(job, e)
+            return
+
+        # Sending it again could run and bill the job twice, COMFYUI_JOB_TIMEOUT_SECONDS
+        # fails it instead if the webhook never comes
+        print(f"COMFYUI JOB {job['_id']} MAY HAVE REACHED {job['backend']}, NOT RESENDING: {e!r}")
+        queue_stats["unconfirmed"] += 1
+
+    await record_dispatched(job)
+
+    wait = (datetime.now() - job["queued_at"]).total_seconds()
+    recent_waits.append(wait)
+    comfyui_queue.record_wait(wait)
+    queue_stats["dispatched"] += 1
+
+
+async def seed_fair_queue() -> None:
+    virtual_time = await aio_data.get_virtual_time()
+
+    if virtual_time is not None:
+        comfyui_queue.seed(virtual_time)
+
 
+async def tag_job(user: Account,
+                  cost: float) -> Tuple[float, float]:
+    # Tags are persisted with the jobs and compared across workers and restarts,
+    # so they are computed against the virtual time and user backlog in Mongo
+    await seed_fair_queue()
+
+    return comfyui_queue.tag(user.user_id,
+                             scheduler.get_weight(user),
+                             cost,
+                             await aio_data.get_last_finish_tag(user.user_id) or 0.0)
+
+
+async def dispatch_jobs() -> None:
+    try:
+        await seed_fair_queue()
+    except Exception as e:
+        print(f"Error seeding the comfyui fair queue: {e}")
+
+    while True:
+        queue_wakeup.clear()
+
+        try:
+            timed_out = await aio_data.time_out_jobs(datetime.now() - timedelta(seconds=COMFYUI_JOB_TIMEOUT_SECONDS))
+            queue_stats["timed_out"] += timed_out
+
+            jobs = []
+
+            for backend in get_backends():
+                free_slots = COMFYUI_MAX_IN_FLIGHT_PER_BACKEND - await aio_data.count_in_flight(backend)
+
+                for _ in range(free_slots):
+                    job = await aio_data.claim_job(backend, COMFYUI_LEASE_SECONDS)
+
+                    if job is None:
+                        break
+
+                    comfyui_queue.advance(job.get("fair_start", 0.0))
+                    jobs.append(job)
+
+            comfyui_queue.prune()
+
+            # Dispatching runs alongside the loop so a slow backend doesn't hold up the others
+            for job in jobs:
+                task = asyncio.create_task(dispatch_job(job))
+                dispatch_tasks.add(task)
+                task.add_done_callback(dispatch_tasks.discard)
+        except Exception as e:
+            print(f"Error dispatching comfyui jobs: {e}")
+
+        try:
+            await asyncio.wait_for(queue_wakeup.wait(), timeout=COMFYUI_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def get_queue_stats() -> dict:
+    waits = sorted(recent_waits)
+    oldest_queued_at = await aio_data.get_oldest_queued_at()
+
+    return {
+        **queue_stats,
+        "queue_depth": await aio_data.count_queued(),
+        "in_flight": {backend: await aio_data.count_in_flight(backend) for backend in get_backends()},
+        "oldest_wait_seconds": (datetime.now() - oldest_queued_at).total_seconds() if oldest_queued_at else 0.0,
+        "avg_wait_seconds": sum(waits) / len(waits) if waits else 0.0,
+        "p95_wait_seconds": waits[int(len(waits) * 0.95)] if waits else 0.0
+    }
+
+
+def should_capture_workflow() -> bool:
+    return WORKFLOW_CAPTURE_RATE > 0 and random.random() < WORKFLOW_CAPTURE_RATE
+
+
+def write_workflow_file(message_id: str, workflow: dict) -> None:
+    os.makedirs(WORKFLOW_CAPTURE_DIR, exist_ok=True)
+
+    with open(os.path.join(WORKFLOW_CAPTURE_DIR, f"{message_id}.json"), 'w') as file:
+        json.dump(workflow, file)
+
+
+async def capture_workflow(message_id: str, workflow: dict) -> None:
+    # Keeps a copy of the submitted workflow for debugging, next to the message unless a directory is set
+    try:
+        if WORKFLOW_CAPTURE_DIR:
+            await asyncio.to_thread(write_workflow_file, message_id, workflow)
+        else:
+            await aio_data.save_workflow(message_id, workflow)
+    except Exception as e:
+        print(f"Error capturing workflow of message {message_id}: {e}")
+
+
+async def get_image_path(image_url: str):
+    if image_url:
         image_id = extract_id_from_uri(image_url)
-        image_format = uploadcare.file(image_id).info['mime_type'].split('/')[1]
+        image_format = uploadcare_service.get_file_format(await uploadcare_service.get_file_info(image_id))
 
         if image_format not in ['jpeg', 'png']:
             raise HTTPException(status_code=400, detail=f"Invalid {image_format} image format. Valid ones are jpeg and png.")
@@ -98,11 +327,14 @@ def get_image_path(image_url: str):
 async def generate(settings: Settings, 
                    user: Account, 
                    background_tasks: BackgroundTasks) -> None:
-    if billing_service.has_permissions("Realistic AI Content Creation", user):
-        
+    if await billing_service.has_permissions_async("Realistic AI Content Creation", user):
+        scheduler.check_active_jobs(await aio_data.count_active_jobs(user.user_id))
         
-        reference_image_path = get_image_path(settings.reference_image_url)
-        controlnet_reference_image_path = get_image_path(settings.controlnet_reference_image_url)
+        # Both images are looked up on Uploadcare concurrently
+        reference_image_path, controlnet_reference_image_path = await asyncio.gather(
+            get_image_path(settings.reference_image_url),
+            get_image_path(settings.controlnet_reference_image_url)
+        )
 
         message_id = update_message(user_id=user.user_id, 
                                     status="started", 
@@ -118,29 +350,12 @@ async def generate(settings: Settings,
                                      reference_image_path,
                                      controlnet_reference_image_path)
         
-        # Specify the file path
-        file_path = '/data.json'
-
-        # Ensure the directory exists
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-        # Open the file in write mode and use json.dump to write the data
-        with open(file_path, 'w') as file:
-            json.dump(workflow, file, indent=2)  # indent=4 for pretty printing
-
         if workflow is None:
             update_message(user.user_id, 
                            message_id, 
                            "failed")
             raise HTTPException(status_code=500, detail="Error while processing the workflow.")
         
-        url = f"{os.getenv('RUNPOD_DOMAIN')}/image-generation/"
-
-        # Define the headers for the request
-        headers = {
-            'Content-Type': 'application/json'
-        }
-
         # Define the payload for the request
         payload = {
             'workflow': workflow,
@@ -152,13 +367,33 @@ async def generate(settings: Settings,
             'user_id': user.user_id,
         }
 
-        background_tasks.add_task(send_post_request, url, headers, payload)
+        # Sent to a GPU backend by dispatch_jobs once one has a free slot, in fair order across users
+        fair_start, fair_tag = await tag_job(user, cost=max(settings.n_images or 1, 1))
+
+        await aio_data.enqueue_job(message_id, payload, fair_start, fair_tag)
+        queue_stats["queued"] += 1
+        queue_wakeup.set()
+
+        if should_capture_workflow():
+            background_tasks.add_task(capture_workflow, message_id, workflow)
     else:
         raise HTTPException(status_code=403, detail="Upgrade your plan to unlock permissions.")
     
 
-def get_batch(user: Account) -> Optional[Message]:
-    return data.get_batch(user.user_id)
+def reload_workflow_template(user: Account) -> int:
+    if not account_service.is_insider(user):
+        raise HTTPException(status_code=403, detail="Only insiders can reload the workflow template.")
+
+    return reload_template()
+
+
+async def get_batch(user: Account) -> Optional[Message]:
+    return await aio_data.get_batch(user.user_id)
 
-def get_history(user: Account) -> Optional[List[Message]]:
-    return data.get_history(user.user_id)
\ No newline at end of file
+async def get_history(user: Account,
+                      cursor: Optional[str] = None,
+                      limit: Optional[int] = None) -> Tuple[Optional[List[Message]], Optional[str]]:
+    try:
+        return await aio_data.get_history(user.user_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
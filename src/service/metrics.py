@@ -0,0 +1,36 @@
+import data.account as account_data
+import data.midjourney as midjourney_data
+import data.init as data_init
+import data.aio.init as aio_data_init
+
+import service.account as account_service
+import service.ai_verification as ai_verification_service
+import service.akool_deepfake as akool_deepfake_service
+import service.billing as billing_service
+import service.email as email_service
+import service.events as events_service
+import service.image_generation as image_generation_service
+import service.midjourney as midjourney_service
+import service.scheduler as scheduler
+import service.uploadcare as uploadcare_service
+import service.webhook as webhook_service
+
+
+async def get() -> dict:
+    return {
+        "user_cache": account_data.user_cache.stats(),
+        "password_hash_pool": account_service.get_password_hash_stats(),
+        "entitlement_cache": billing_service.entitlement_cache.stats(),
+        "uploadcare_info_cache": uploadcare_service.info_cache.stats(),
+        "akool_landmarks": akool_deepfake_service.get_landmark_stats(),
+        "midjourney_message_cache": midjourney_data.message_cache.stats(),
+        "midjourney_turbo": ai_verification_service.get_turbo_stats(),
+        "midjourney_writes": midjourney_service.get_write_stats(),
+        "mongo_pool": data_init.get_pool_stats(),
+        "mongo_async_pool": aio_data_init.get_pool_stats(),
+        "email_outbox": await email_service.get_outbox_stats(),
+        "image_generation_queue": await image_generation_service.get_queue_stats(),
+        "scheduler": scheduler.get_stats(),
+        "events": events_service.get_event_stats(),
+        "webhooks": webhook_service.get_webhook_stats()
+    }
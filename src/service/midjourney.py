@@ -1,21 +1,123 @@
-from typing import Optional, List
+from fastapi import HTTPException
+
+from typing import Dict, Optional, List, Tuple
+
+import asyncio
+
+import os
 
 import data.midjourney as data
+from data.aio import midjourney as aio_data
 from data.midjourney import Message
 
 from model.account import Account
 
+import service.events as events_service
+import service.scheduler as scheduler
+
+# mymidjourney sends a webhook per progress step, only the latest one of each job
+# within this window is written
+MIDJOURNEY_FLUSH_SECONDS = float(os.getenv('MIDJOURNEY_FLUSH_SECONDS', 2))
+
+# Latest unwritten progress by messageId
+pending_messages: Dict[str, Message] = {}
+
+# Keeps a flush from overwriting a terminal state written while it ran
+write_lock = asyncio.Lock()
+
+write_stats = {
+    "received": 0,
+    "coalesced": 0,
+    "written": 0,
+    "flushes": 0
+}
+
+
+def is_terminal(message: Message) -> bool:
+    return message.progress == 100 or bool(message.error)
+
+
+async def flush_messages() -> int:
+    async with write_lock:
+        if not pending_messages:
+            return 0
+
+        messages = list(pending_messages.values())
+        pending_messages.clear()
+
+        try:
+            await aio_data.update_many(messages)
+        except BaseException:
+            # Put them back unless a newer webhook came in meanwhile, the next flush retries
+            for message in messages:
+                pending_messages.setdefault(message.messageId, message)
+            raise
+
+    write_stats["written"] += len(messages)
+    write_stats["flushes"] += 1
+
+    return len(messages)
+
+
+async def flush_messages_periodically() -> None:
+    while True:
+        await asyncio.sleep(MIDJOURNEY_FLUSH_SECONDS)
+
+        try:
+            await flush_messages()
+        except Exception as e:
+            print(f"Error flushing Midjourney messages: {e}")
+
+
+async def webhook(message: Message) -> None:
+    write_stats["received"] += 1
+
+    if is_terminal(message):
+        # Final results are written right away, superseding any buffered progress
+        async with write_lock:
+            pending_messages.pop(message.messageId, None)
+            await aio_data.update(message)
+
+        write_stats["written"] += 1
+    else:
+        if message.messageId in pending_messages:
+            write_stats["coalesced"] += 1
+
+        pending_messages[message.messageId] = message
+
+        # Polling sees the progress before it reaches Mongo
+        data.message_cache.set(message.messageId, message)
+
+    # Prompts are submitted with the user id as their ref
+    await events_service.publish(message.ref, "midjourney", message)
+
+
+def get_write_stats() -> dict:
+    return {
+        **write_stats,
+        "pending": len(pending_messages)
+    }
+
+async def register_job(messageId: Optional[str],
+                       user: Account) -> None:
+    if messageId:
+        await aio_data.register_job(messageId, user.user_id)
 
-def webhook(message: Message) -> None:
-    data.update(message)
+async def check_active_jobs(user: Account) -> None:
+    scheduler.check_active_jobs(await aio_data.count_active_jobs(user.user_id, scheduler.get_active_since()))
 
-def valid_button(messageId: str, 
-                 button: str) -> bool:
-    return data.valid_button(messageId, 
-                             button)
+async def valid_button(messageId: str, 
+                       button: str) -> bool:
+    return await aio_data.valid_button(messageId, 
+                                       button)
 
-def get_message(messageId: str) -> Optional[Message]:
-    return data.get_message(messageId)
+async def get_message(messageId: str) -> Optional[Message]:
+    return await aio_data.get_message(messageId)
 
-def get_history(user: Account) -> List[Message]:
-    return data.get_history(user.user_id)
\ No newline at end of file
+async def get_history(user: Account,
+                      cursor: Optional[str] = None,
+                      limit: Optional[int] = None) -> Tuple[List[Message], Optional[str]]:
+    try:
+        return await aio_data.get_history(user.user_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
@@ -3,6 +3,7 @@ from fastapi import HTTPException
 from typing import Optional
 
 from data import referral as data
+from data.aio import referral as aio_data
 
 from model.account import Account
 from model.referral import PayoutSubmission, Referral
@@ -13,17 +14,17 @@ import service.email as email_service
 def generate_link(user: Account) -> str:
     return data.generate_link(user.user_id)
 
-def link_clicked(referral_id: str) -> None:
+async def link_clicked(referral_id: str) -> None:
     print("LINK CLICKED")
     try:
         referral = get_referral(referral_id)
 
         print(f"REFERRAL: {referral.dict()}")
-        update_statistics(referral.host_id, 
-                          amount=0, 
-                          clicked=True, 
-                          signup_ref=False,
-                          subscription_cancelled=False)
+        await update_statistics_async(referral.host_id, 
+                                      amount=0, 
+                                      clicked=True, 
+                                      signup_ref=False,
+                                      subscription_cancelled=False)
     except ValueError:
         raise ValueError(f"Referral with ID {referral_id} does not exist.")
 
@@ -62,6 +63,17 @@ def update_statistics(user_id: str,
                                   signup_ref,
                                   subscription_cancelled)
 
+async def update_statistics_async(user_id: str, 
+                                  amount: float, 
+                                  clicked: bool, 
+                                  signup_ref: bool,
+                                  subscription_cancelled: bool):
+    return await aio_data.update_statistics(user_id, 
+                                            amount, 
+                                            clicked, 
+                                            signup_ref,
+                                            subscription_cancelled)
+
 def log_signup_ref(referral_id: str,
                    user: Account) -> None:
     print("LOGGING REFERRAL")
@@ -0,0 +1,291 @@
+from fastapi import HTTPException
+
+from typing import Dict, List, Optional, Tuple
+
+from collections import deque
+
+from contextlib import asynccontextmanager
+
+from datetime import datetime, timedelta
+
+import asyncio
+
+import heapq
+
+import itertools
+
+import os
+
+import time
+
+from model.account import Account
+
+import service.billing as billing_service
+
+SCHEDULER_MAX_PENDING_PER_USER = int(os.getenv('SCHEDULER_MAX_PENDING_PER_USER', 4))
+# Jobs older than this stop counting as outstanding, so a lost webhook can't lock a user out
+SCHEDULER_ACTIVE_JOB_SECONDS = int(os.getenv('SCHEDULER_ACTIVE_JOB_SECONDS', 3600))
+
+# Generation requests sent to each upstream at once, the rest wait their fair turn
+LANE_CONCURRENCY = {
+    "akool": int(os.getenv('SCHEDULER_AKOOL_CONCURRENCY', 8)),
+    "facefusion": int(os.getenv('SCHEDULER_FACEFUSION_CONCURRENCY', 4)),
+    "midjourney": int(os.getenv('SCHEDULER_MIDJOURNEY_CONCURRENCY', 4))
+}
+
+# Requests per second and burst an upstream account accepts, for lanes that have a rate limit
+LANE_RATE_LIMITS = {
+    "midjourney": (float(os.getenv('SCHEDULER_MIDJOURNEY_RATE_PER_SECOND', 1)),
+                   int(os.getenv('SCHEDULER_MIDJOURNEY_BURST', 3)))
+}
+
+
+class TokenBucket:
+    """Spaces requests out to an upstream's rate limit, bursts up to capacity go straight through"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.throttled = 0
+        self._lock = asyncio.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        # The lock keeps waiters in arrival order
+        async with self._lock:
+            self.refill()
+
+            if self.tokens < 1:
+                self.throttled += 1
+
+            # Checked again after every sleep, a pause() may have emptied the bucket meanwhile
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+
+            self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        # The upstream asked us to slow down, nothing goes out for that long
+        self.refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+    def stats(self) -> dict:
+        self.refill()
+
+        return {
+            "tokens": round(self.tokens, 2),
+            "rate_per_second": self.rate,
+            "capacity": self.capacity,
+            "throttled": self.throttled
+        }
+
+
+class FairQueue:
+    """Weighted fair queueing across users using start-time fair queueing.
+
+    Every job gets a virtual start tag, max(virtual time, the user's last
+    finish tag), and a finish tag, start + cost / weight. Jobs are served in
+    finish tag order, so a user with a backlog only delays others by its
+    weighted share and heavier plan weights drain proportionally faster.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, bucket: Optional[TokenBucket] = None):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.bucket = bucket
+        self.virtual_time = 0.0
+        self.finish_tags: Dict[str, float] = {}
+        self.pending: Dict[str, int] = {}
+        self.running = 0
+        self.waiting: List[Tuple[float, int, float, asyncio.Future, str]] = []
+        self.waits = deque(maxlen=1000)
+        self._sequence = itertools.count()
+
+    def tag(self, user_id: str, weight: float, cost: float, last_finish: float = 0.0) -> Tuple[float, float]:
+        # last_finish carries a user's finish tag from outside this process, e.g. persisted jobs
+        start = max(self.virtual_time, self.finish_tags.get(user_id, 0.0), last_finish)
+        finish = start + cost / max(weight, 0.01)
+
+        self.finish_tags[user_id] = finish
+
+        return start, finish
+
+    def seed(self, virtual_time: float) -> None:
+        # Catch up with a virtual time kept elsewhere, a fresh process starts at 0
+        self.virtual_time = max(self.virtual_time, virtual_time)
+
+    def advance(self, start: float) -> None:
+        # Virtual time follows the start tag of the job being served
+        self.virtual_time = max(self.virtual_time, start)
+
+    def prune(self) -> None:
+        # Tags behind virtual time no longer hold anyone back
+        for user_id in [user_id for user_id, finish in self.finish_tags.items() 
+                        if finish <= self.virtual_time and user_id not in self.pending]:
+            del self.finish_tags[user_id]
+
+    def admit(self, user_id: str) -> None:
+        if self.pending.get(user_id, 0) >= SCHEDULER_MAX_PENDING_PER_USER:
+            raise HTTPException(status_code=429, detail="Too many generations in progress, wait for one to finish.")
+
+    def record_wait(self, seconds: float) -> None:
+        self.waits.append(seconds)
+
+    def wake(self) -> None:
+        while self.running < self.max_concurrency and self.waiting:
+            _, _, start, future, _ = heapq.heappop(self.waiting)
+
+            if future.done():
+                continue
+
+            self.running += 1
+            self.advance(start)
+            future.set_result(None)
+
+    def release(self) -> None:
+        self.running -= 1
+        self.wake()
+
+    def forget(self, user_id: str) -> None:
+        pending = self.pending.get(user_id, 0) - 1
+
+        if pending > 0:
+            self.pending[user_id] = pending
+            return
+
+        self.pending.pop(user_id, None)
+
+        # Users without work only need their tag while it is ahead of virtual time,
+        # and once the lane is idle nobody carries a backlog into the next busy period
+        if not self.pending:
+            self.finish_tags.clear()
+        elif self.finish_tags.get(user_id, 0.0) <= self.virtual_time:
+            self.finish_tags.pop(user_id, None)
+
+    @asynccontextmanager
+    async def slot(self, user_id: str, weight: float = 1.0, cost: float = 1.0):
+        self.admit(user_id)
+        self.pending[user_id] = self.pending.get(user_id, 0) + 1
+
+        try:
+            start, finish = self.tag(user_id, weight, cost)
+            queued_at = time.monotonic()
+
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.waiting, (finish, next(self._sequence), start, future, user_id))
+            self.wake()
+
+            try:
+                await future
+            except asyncio.CancelledError:
+                # The slot may have been handed over right before the cancellation
+                if future.done() and not future.cancelled():
+                    self.release()
+                else:
+                    future.cancel()
+                raise
+
+            try:
+                # Rate limited upstreams also wait for a token once the job has its turn
+                if self.bucket is not None:
+                    await self.bucket.acquire()
+
+                self.record_wait(time.monotonic() - queued_at)
+
+                yield
+            finally:
+                self.release()
+        finally:
+            self.forget(user_id)
+
+    def position(self, user_id: str) -> dict:
+        """Where the user's jobs stand on this worker, position 1 is served next"""
+
+        waiting = sorted(entry for entry in self.waiting if not entry[3].done())
+        mine = [index for index, entry in enumerate(waiting) if entry[4] == user_id]
+
+        return {
+            "position": mine[0] + 1 if mine else None,
+            "queued": len(mine),
+            "in_progress": self.pending.get(user_id, 0) - len(mine),
+            "waiting": len(waiting)
+        }
+
+    def stats(self) -> dict:
+        waits = sorted(self.waits)
+
+        stats = {
+            "running": self.running,
+            "waiting": len(self.waiting),
+            "max_concurrency": self.max_concurrency,
+            "users": len(self.pending),
+            "p95_wait_seconds": waits[int(len(waits) * 0.95)] if waits else 0.0
+        }
+
+        if self.bucket is not None:
+            stats["rate_limit"] = self.bucket.stats()
+
+        return stats
+
+
+queues: Dict[str, FairQueue] = {}
+
+buckets: Dict[str, TokenBucket] = {}
+
+
+def get_bucket(lane: str) -> Optional[TokenBucket]:
+    bucket = buckets.get(lane)
+
+    if bucket is None and lane in LANE_RATE_LIMITS:
+        bucket = TokenBucket(*LANE_RATE_LIMITS[lane])
+        buckets[lane] = bucket
+
+    return bucket
+
+
+def get_queue(lane: str) -> FairQueue:
+    queue = queues.get(lane)
+
+    if queue is None:
+        queue = FairQueue(lane, LANE_CONCURRENCY.get(lane, 4), get_bucket(lane))
+        queues[lane] = queue
+
+    return queue
+
+
+def get_weight(user: Account) -> float:
+    return billing_service.get_entitlement(user).priority_weight
+
+
+def slot(lane: str,
+         user: Account,
+         cost: float = 1.0):
+    """Wait for the user's fair turn on a lane, 429 once they have too much in flight"""
+
+    return get_queue(lane).slot(user.user_id, get_weight(user), cost)
+
+
+def get_active_since() -> datetime:
+    return datetime.now() - timedelta(seconds=SCHEDULER_ACTIVE_JOB_SECONDS)
+
+
+def check_active_jobs(active_jobs: int) -> None:
+    """429 once the user has as many jobs outstanding upstream as allowed.
+
+    Slots only cover the submission, the jobs themselves run on the upstream
+    until their webhook arrives, so they are counted from Mongo.
+    """
+
+    if active_jobs >= SCHEDULER_MAX_PENDING_PER_USER:
+        raise HTTPException(status_code=429, detail="Too many generations in progress, wait for one to finish.")
+
+
+def get_stats() -> dict:
+    return {lane: queue.stats() for lane, queue in queues.items()}
@@ -0,0 +1,80 @@
+from typing import List, Optional
+
+import asyncio
+
+import os
+
+import threading
+
+from pyuploadcare import Uploadcare
+
+from cache import TTLCache
+
+from data.aio import uploadcare as aio_data
+
+UPLOADCARE_INFO_CACHE_MAXSIZE = int(os.getenv('UPLOADCARE_INFO_CACHE_MAXSIZE', 10000))
+UPLOADCARE_INFO_CACHE_TTL_SECONDS = int(os.getenv('UPLOADCARE_INFO_CACHE_TTL_SECONDS', 24 * 3600))
+UPLOADCARE_INFO_MONGO_CACHE = os.getenv('UPLOADCARE_INFO_MONGO_CACHE') == "true"
+
+# Uploadcare files are immutable, so their info can be cached for as long as we like
+info_cache = TTLCache(UPLOADCARE_INFO_CACHE_MAXSIZE, UPLOADCARE_INFO_CACHE_TTL_SECONDS)
+
+client: Optional[Uploadcare] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> Uploadcare:
+    global client
+
+    if client is None:
+        with _client_lock:
+            if client is None:
+                client = Uploadcare(public_key=os.getenv('UPLOADCARE_PUBLIC_KEY'),
+                                    secret_key=os.getenv('UPLOADCARE_SECRET_KEY'))
+
+    return client
+
+
+def fetch_file_info(file_id: str) -> dict:
+    print(f"FETCHING UPLOADCARE FILE INFO {file_id}")
+    info = get_client().file(file_id).info
+
+    # Only the fields we validate on are kept
+    return {
+        "mime_type": info.get("mime_type"),
+        "size": info.get("size")
+    }
+
+
+async def get_file_info(file_id: str) -> dict:
+    info = info_cache.get(file_id)
+
+    if info is not None:
+        return info
+
+    if UPLOADCARE_INFO_MONGO_CACHE:
+        info = await aio_data.get_file_info(file_id)
+
+    if info is None:
+        info = await asyncio.to_thread(fetch_file_info, file_id)
+
+        if UPLOADCARE_INFO_MONGO_CACHE:
+            await aio_data.save_file_info(file_id, info)
+
+    info_cache.set(file_id, info)
+
+    return info
+
+
+async def get_file_infos(file_ids: List[str]) -> List[dict]:
+    """Info of every file, the ones not cached yet are fetched concurrently"""
+
+    unique_ids = list(dict.fromkeys(file_ids))
+    infos = await asyncio.gather(*[get_file_info(file_id) for file_id in unique_ids])
+    info_by_id = dict(zip(unique_ids, infos))
+
+    return [info_by_id[file_id] for file_id in file_ids]
+
+
+def get_file_format(info: dict) -> str:
+    return info['mime_type'].split('/')[1]
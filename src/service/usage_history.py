@@ -3,6 +3,7 @@ from fastapi import HTTPException
 from typing import Optional
 
 import data.usage_history as data
+from data.aio import usage_history as aio_data
 
 from model.account import Account
 from model.usage_history import History
@@ -15,6 +16,13 @@ def update(domain: str, user_id: str) -> None:
         raise ValueError("Failed to update the usage history.")
 
 
+async def update_async(domain: str, user_id: str) -> None:
+    try:
+        await aio_data.update(domain, user_id)
+    except ValueError:
+        raise ValueError("Failed to update the usage history.")
+
+
 def get(user: Account) -> Optional[History]:
     try:
         return data.get(user.user_id)
@@ -0,0 +1,280 @@
+from fastapi import HTTPException
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from datetime import datetime
+
+import asyncio
+
+import hashlib
+
+import inspect
+
+import json
+
+import os
+
+import zlib
+
+from data.aio import webhook as aio_data
+
+from cache import TTLCache
+
+from model.webhook import WebhookEvent
+
+import service.billing as billing_service
+
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 5))
+WEBHOOK_BACKOFF_SECONDS = float(os.getenv('WEBHOOK_BACKOFF_SECONDS', 2))
+WEBHOOK_MAX_BACKOFF_SECONDS = float(os.getenv('WEBHOOK_MAX_BACKOFF_SECONDS', 60))
+WEBHOOK_RECOVERY_SECONDS = float(os.getenv('WEBHOOK_RECOVERY_SECONDS', 60))
+WEBHOOK_RECOVERY_LIMIT = 1000
+WEBHOOK_LEASE_SECONDS = 300
+WEBHOOK_SEEN_CACHE_MAXSIZE = int(os.getenv('WEBHOOK_SEEN_CACHE_MAXSIZE', 50000))
+WEBHOOK_SEEN_CACHE_TTL_SECONDS = int(os.getenv('WEBHOOK_SEEN_CACHE_TTL_SECONDS', 3600))
+
+# Processes the stored body of an event, keyed by provider
+HANDLERS: Dict[str, Callable[[dict], Awaitable[Any]]] = {
+    "radom": billing_service.radom_webhook,
+    "paypal": billing_service.paypal_webhook,
+    "gocardless": billing_service.gc_webhook
+}
+
+# Failures that come from a bug in the handler rather than from Mongo or an upstream
+PROGRAMMING_ERRORS = (NameError, AttributeError, TypeError, KeyError)
+
+# One queue per worker, events of the same ordering key always land on the same one
+shards: List[asyncio.Queue] = []
+
+# Recently delivered (provider, event id) pairs, answers most redeliveries without a round trip
+seen_events = TTLCache(WEBHOOK_SEEN_CACHE_MAXSIZE, WEBHOOK_SEEN_CACHE_TTL_SECONDS)
+
+webhook_stats = {
+    "received": 0,
+    "duplicates": 0,
+    "processed": 0,
+    "retried": 0,
+    "deferred": 0,
+    "failed": 0
+}
+
+
+def get_shard(event_id: str,
+              ordering_key: Optional[str]) -> asyncio.Queue:
+    key = ordering_key or event_id
+
+    return shards[zlib.crc32(key.encode()) % len(shards)]
+
+
+def enqueue(event_id: str,
+            ordering_key: Optional[str]) -> None:
+    # Without running workers the event stays pending until recovery picks it up
+    if shards:
+        get_shard(event_id, ordering_key).put_nowait(event_id)
+
+
+def get_delivery_id(body: dict,
+                    event_id: Optional[str] = None) -> str:
+    """Provider event id, or a hash of the body for providers that don't send one"""
+
+    if event_id:
+        return str(event_id)
+
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+
+
+async def first_delivery(provider: str,
+                         delivery_id: str,
+                         durable: bool = True) -> bool:
+    if seen_events.get((provider, delivery_id)):
+        webhook_stats["duplicates"] += 1
+        return False
+
+    seen_events.set((provider, delivery_id), True)
+
+    # Deliveries that are harmless to repeat are only remembered in memory
+    if not durable:
+        return True
+
+    try:
+        created = await aio_data.create_receipt(provider, delivery_id)
+    except Exception:
+        seen_events.invalidate((provider, delivery_id))
+        raise
+
+    if not created:
+        webhook_stats["duplicates"] += 1
+        return False
+
+    return True
+
+
+async def forget_delivery(provider: str,
+                          delivery_id: str,
+                          durable: bool = True) -> None:
+    # Lets the provider's redelivery through when we failed to handle the first one
+    seen_events.invalidate((provider, delivery_id))
+
+    if durable:
+        await aio_data.delete_receipt(provider, delivery_id)
+
+
+async def run_once(provider: str,
+                   body: dict,
+                   handler: Callable,
+                   *args,
+                   event_id: Optional[str] = None,
+                   durable: bool = True) -> Any:
+    """Run a webhook handler unless this delivery was already handled.
+
+    Non durable deliveries skip the Mongo receipt and are only deduplicated
+    by this worker's cache, for frequent updates that are safe to apply twice.
+    """
+
+    delivery_id = get_delivery_id(body, event_id)
+
+    if not await first_delivery(provider, delivery_id, durable):
+        print(f"SKIPPING DUPLICATE {provider.upper()} WEBHOOK {delivery_id}")
+        return None
+
+    try:
+        result = handler(*args)
+
+        if inspect.isawaitable(result):
+            result = await result
+
+        return result
+    except Exception:
+        await forget_delivery(provider, delivery_id, durable)
+        raise
+
+
+async def ingest(provider: str,
+                 body: dict,
+                 ordering_key: Optional[str] = None,
+                 event_id: Optional[str] = None) -> Optional[str]:
+    delivery_id = get_delivery_id(body, event_id)
+
+    if not await first_delivery(provider, delivery_id):
+        print(f"SKIPPING DUPLICATE {provider.upper()} WEBHOOK {delivery_id}")
+        return None
+
+    try:
+        stored_id = await aio_data.create_event(WebhookEvent(provider=provider,
+                                                             ordering_key=ordering_key,
+                                                             body=body,
+                                                             received_at=datetime.now()))
+    except Exception:
+        await forget_delivery(provider, delivery_id)
+        raise
+
+    print(f"STORED {provider.upper()} WEBHOOK EVENT {stored_id}")
+
+    webhook_stats["received"] += 1
+    enqueue(stored_id, ordering_key)
+
+    return stored_id
+
+
+async def requeue_later(event_id: str,
+                        ordering_key: Optional[str]) -> None:
+    await asyncio.sleep(WEBHOOK_BACKOFF_SECONDS)
+    enqueue(event_id, ordering_key)
+
+
+async def process(event_id: str) -> None:
+    while True:
+        event = await aio_data.claim_event(event_id, WEBHOOK_LEASE_SECONDS)
+
+        # Already handled, or being handled by another worker
+        if event is None:
+            return
+
+        if await aio_data.has_earlier_unprocessed(event):
+            print(f"DEFERRING WEBHOOK EVENT {event_id} BEHIND AN EARLIER ONE")
+            await aio_data.defer_event(event["_id"])
+            webhook_stats["deferred"] += 1
+            asyncio.create_task(requeue_later(event_id, event.get("ordering_key")))
+            return
+
+        try:
+            await HANDLERS[event["provider"]](event["body"])
+            await aio_data.mark_processed(event["_id"])
+            webhook_stats["processed"] += 1
+            return
+        except HTTPException as e:
+            # The event itself is invalid, retrying won't help
+            print(f"REJECTED WEBHOOK EVENT {event_id}: {e.detail}")
+            await aio_data.mark_failed(event["_id"], str(e.detail))
+            webhook_stats["failed"] += 1
+            return
+        except PROGRAMMING_ERRORS as e:
+            # A bug in the handler fails the same way every time, retrying would only repeat its side effects
+            print(f"WEBHOOK HANDLER ERROR FOR EVENT {event_id}: {type(e).__name__}: {e}")
+            await aio_data.mark_failed(event["_id"], f"{type(e).__name__}: {e}")
+            webhook_stats["failed"] += 1
+            return
+        except Exception as e:
+            if event["attempts"] >= WEBHOOK_MAX_ATTEMPTS:
+                print(f"GIVING UP ON WEBHOOK EVENT {event_id} AFTER {event['attempts']} ATTEMPTS: {e}")
+                await aio_data.mark_failed(event["_id"], str(e))
+                webhook_stats["failed"] += 1
+                return
+
+            print(f"RETRYING WEBHOOK EVENT {event_id}: {e}")
+            await aio_data.release_event(event["_id"], str(e))
+            webhook_stats["retried"] += 1
+
+        # Retrying in place holds back later events of the same shard, which keeps them in order
+        await asyncio.sleep(min(WEBHOOK_BACKOFF_SECONDS * 2 ** (event["attempts"] - 1), WEBHOOK_MAX_BACKOFF_SECONDS))
+
+
+async def work(queue: asyncio.Queue) -> None:
+    while True:
+        event_id = await queue.get()
+
+        try:
+            await process(event_id)
+        except Exception as e:
+            print(f"Error processing webhook event {event_id}: {e}")
+        finally:
+            queue.task_done()
+
+
+async def recover_events() -> int:
+    events = await aio_data.get_unprocessed(WEBHOOK_RECOVERY_LIMIT)
+
+    for event in events:
+        enqueue(str(event["_id"]), event.get("ordering_key"))
+
+    return len(events)
+
+
+async def recover_events_periodically() -> None:
+    # Picks up events left behind by a restart or by a worker whose lease expired
+    while True:
+        try:
+            recovered = await recover_events()
+
+            if recovered:
+                print(f"RECOVERED {recovered} WEBHOOK EVENTS")
+        except Exception as e:
+            print(f"Error recovering webhook events: {e}")
+
+        await asyncio.sleep(WEBHOOK_RECOVERY_SECONDS)
+
+
+def start_workers() -> List[asyncio.Task]:
+    shards[:] = [asyncio.Queue() for _ in range(WEBHOOK_WORKERS)]
+
+    return [asyncio.create_task(work(queue)) for queue in shards] + \
+           [asyncio.create_task(recover_events_periodically())]
+
+
+def get_webhook_stats() -> dict:
+    return {
+        **webhook_stats,
+        "queue_depth": sum(queue.qsize() for queue in shards),
+        "seen_cache": seen_events.stats()
+    }
@@ -52,7 +52,7 @@ async def request_one_time_link(email: dict) -> None:
     if not email:
         raise HTTPException(status_code=400, detail="Email field is required")
     
-    return service.request_one_time_link(email)
+    return await service.request_one_time_link(email)
 
 # TODO: we should do authentication of new email
 
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 
 from typing import Annotated, Optional, List, Tuple
 
@@ -91,8 +91,17 @@ async def update(social_account: SocialAccount,
 
 
 @router.get("/social-accounts", status_code=200)  # Retrieves all social accounts
-async def get(user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> Optional[List[SocialAccount]]:
-    return service.get_accounts(user)
+async def get(response: Response,
+              user: Annotated[Account, Depends(account_service.get_current_active_user)],
+              cursor: Optional[str] = None,
+              limit: Optional[int] = None) -> Optional[List[SocialAccount]]:
+    social_accounts, next_cursor = service.get_accounts(user, cursor, limit)
+
+    # Absent on the last page, passed back as ?cursor= for the next one
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    return social_accounts
 
 
 @router.delete("/social-account/{account_id}", status_code=204)
@@ -119,12 +128,25 @@ async def get_prompts(user: Annotated[Account, Depends(account_service.get_curre
 @router.get("/message", status_code=200)  # Retrieves specific message
 async def get_message(messageId: str,
                       _: Annotated[Account, Depends(account_service.get_current_active_user)]) -> Optional[Message]:
-    return service.get_message(messageId)
+    return await service.get_message(messageId)
+
+
+@router.get("/queue", status_code=200)  # Retrieves the user's place in the submission queue
+async def get_queue_position(user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> dict:
+    return service.get_queue_position(user)
 
 
 @router.get("/history", status_code=200)  # Retrieves history
-async def get_history(user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> List[Message]:
-    return service.get_history(user)
+async def get_history(response: Response,
+                      user: Annotated[Account, Depends(account_service.get_current_active_user)],
+                      cursor: Optional[str] = None,
+                      limit: Optional[int] = None) -> List[Message]:
+    messages, next_cursor = await service.get_history(user, cursor, limit)
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    return messages
 
 
 # @router.delete("/message/{messageId}", status_code=204)  # Cancels a specific job, status 204 for No Content
@@ -9,6 +9,7 @@ from model.deepfake import Message
 
 from service import account as account_service
 from service import akool_deepfake as service
+from service import webhook as webhook_service
 
 router = APIRouter(prefix="/akool-deepfake")
 
@@ -17,7 +18,7 @@ async def webhook(response: dict) -> None:
     print("AKOOL WEBHOOK ACTIVATED")
     print(response)
     try:
-        service.webhook(response)
+        await webhook_service.run_once("akool", response, service.webhook, response)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid signature.")
 
@@ -31,9 +32,9 @@ class AkoolGeneratePhotoRequest(BaseModel):
 @router.post("/photo", status_code=201)
 async def generate_photo(req: AkoolGeneratePhotoRequest,
                          user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> Optional[Message]:
-    return service.initiate_photo_faceswap(req.source_uri, 
-                                           req.target_uri,
-                                           user)
+    return await service.initiate_photo_faceswap(req.source_uri, 
+                                                 req.target_uri,
+                                                 user)
 
 
 class AkoolGenerateVideoRequest(BaseModel):
@@ -44,7 +45,7 @@ class AkoolGenerateVideoRequest(BaseModel):
 @router.post("/video", status_code=201)
 async def generate_video(req: AkoolGenerateVideoRequest,
                          user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> Optional[Message]:
-    return service.initiate_video_faceswap(req.source_uri, 
-                                           req.target_uri,
-                                           req.video_uri,
-                                           user)
\ No newline at end of file
+    return await service.initiate_video_faceswap(req.source_uri, 
+                                                 req.target_uri,
+                                                 req.video_uri,
+                                                 user)
\ No newline at end of file
@@ -16,6 +16,7 @@ from model.billing import (Plan,
 
 from service import account as account_service
 import service.billing as service
+import service.webhook as webhook_service
 
 router = APIRouter(prefix="/billing")
 
@@ -26,15 +27,15 @@ class FeatureRequest(BaseModel):
 @router.post("/has-permissions", status_code=200)  # Retrieves the check of access tothe feature
 async def has_permissions(req: FeatureRequest,
                           user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> bool:
-    return service.has_permissions(req.feature,
-                                   user)
+    return await service.has_permissions_async(req.feature,
+                                               user)
 
 
 @router.post('/create-radom-checkout-session', status_code=200)
 async def create_radom_checkout_session(req: RadomCheckoutRequest,
                                         user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> None:
-    return service.create_radom_checkout_session(req,
-                                                 user)
+    return await service.create_radom_checkout_session(req,
+                                                       user)
 
 @router.post('/gc/create-checkout', status_code=200)
 async def create_gc_checkout_session(req: GCRequest,
@@ -59,19 +60,41 @@ async def webhook(request: Request) -> None:
         )
 
 
-    return await service.radom_webhook(request)
+    body_dict = await request.json()
+
+    # Processed in the background by the webhook workers
+    await webhook_service.ingest("radom",
+                                 body_dict,
+                                 service.radom_ordering_key(body_dict))
 
 
 @router.post('/paypal-webhook')
 async def paypal_webhook(request: Request) -> None:
     print("\n\nPAYPAL WEBHOOK HIT")
-    return await service.paypal_webhook(request)
+    body_dict = dict(await request.json())
+
+    if body_dict.get('event_type') is None:
+        raise HTTPException(status_code=400, detail="Event type not found in request")
+
+    await webhook_service.ingest("paypal",
+                                 body_dict,
+                                 service.paypal_ordering_key(body_dict),
+                                 event_id=body_dict.get("id"))
 
 
 @router.post('/gc-webhook')
 async def gc_webhook(request: Request) -> None:
     print("\n\nGO CARDLESS WEBHOOK HIT")
-    return await service.gc_webhook(request)
+    payload = await request.json()
+
+    # Each event is stored on its own so it is ordered by its own subscription
+    for event in payload.get("events", []):
+        await webhook_service.ingest("gocardless",
+                                     {"events": [event]},
+                                     service.gc_ordering_key(event),
+                                     event_id=event.get("id"))
+
+    return {"status": "ok"}
 
 
 @router.post("/paypal/create-checkout-metadata", status_code=201)  # Links user id with generated uuid which then is passed as custom_id in paypal button
@@ -83,7 +106,7 @@ async def paypal_create_checkout_metadata(req: PaypalCheckoutSessionRequest,
 
 @router.post("/cancel-plan", status_code=201)  # Attempts to cancel current plan of the user
 async def cancel_plan(user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> bool:
-    return service.cancel_plan(user)
+    return await service.cancel_plan(user)
 
 
 @router.get("/available-plans", status_code=200)  # Retrieves all available plans
@@ -91,6 +114,11 @@ async def get_available_plans(user: Annotated[Account, Depends(account_service.g
     return service.get_available_plans(user)
 
 
+@router.post("/reload-plans", status_code=200)  # Reloads the in-memory plan catalog (insiders only)
+async def reload_plans(user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> int:
+    return service.reload_plan_catalog(user)
+
+
 @router.get("/product", status_code=200)  # Retrieves the specific product
 async def get_product(plan_id: str,
                       _: Annotated[Account, Depends(account_service.get_current_active_user)]) -> Optional[Plan]:
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
 
 from typing import List, Optional, Annotated
 
@@ -13,9 +13,18 @@ router = APIRouter(prefix="/deepfake")
 @router.get("/message", status_code=200)  # Retrieves history
 async def get_message(job_id: str,
                       _: Annotated[Account, Depends(account_service.get_current_active_user)]) -> Optional[Message]:
-    return service.get_message(job_id)
+    return await service.get_message(job_id)
 
 
 @router.get("/history", status_code=200)  # Retrieves history
-async def get_history(user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> Optional[List[Message]]:
-    return service.get_history(user)
+async def get_history(response: Response,
+                      user: Annotated[Account, Depends(account_service.get_current_active_user)],
+                      cursor: Optional[str] = None,
+                      limit: Optional[int] = None) -> Optional[List[Message]]:
+    messages, next_cursor = await service.get_history(user, cursor, limit)
+
+    # Absent on the last page, passed back as ?cursor= for the next one
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    return messages
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+
+from typing import Annotated
+
+from model.account import Account
+
+from service import account as account_service
+from service import events as service
+
+router = APIRouter(prefix="/events")
+
+
+@router.get("/stream", status_code=200)  # Streams status updates of the user's generations as server-sent events
+async def stream(request: Request,
+                 user: Annotated[Account, Depends(account_service.get_current_stream_user)]) -> StreamingResponse:
+    return StreamingResponse(service.stream(user.user_id, request.is_disconnected),
+                             media_type="text/event-stream",
+                             headers={
+                                 "Cache-Control": "no-cache",
+                                 "X-Accel-Buffering": "no"
+                             })
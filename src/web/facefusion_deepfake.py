@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, BackgroundTasks
+from fastapi import APIRouter, Depends
 
 from pydantic import BaseModel
 
@@ -9,6 +9,7 @@ from model.deepfake import Message
 
 from service import account as account_service
 from service import facefusion_deepfake as service
+from service import webhook as webhook_service
 
 router = APIRouter(prefix="/facefusion-deepfake")
 
@@ -16,7 +17,7 @@ router = APIRouter(prefix="/facefusion-deepfake")
 async def webhook(message: Message) -> None:
     print("FACEFUSION WEBHOOK ACTIVATED")
     print(message)
-    service.webhook(message)
+    await webhook_service.run_once("facefusion", message.dict(), service.webhook, message)
 
 
 class FacefusionGenerateRequest(BaseModel):
@@ -27,9 +28,7 @@ class FacefusionGenerateRequest(BaseModel):
 # TODO: accept array of target uris and return an array of job_ids?? how would this work?
 @router.post("/generate", status_code=201)
 async def generate(req: FacefusionGenerateRequest,
-                   user: Annotated[Account, Depends(account_service.get_current_active_user)],
-                   background_tasks: BackgroundTasks) -> str:
-    return service.run_video_faceswap(req.source_uris, 
-                                      req.target_uri,
-                                      user,
-                                      background_tasks)
\ No newline at end of file
+                   user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> str:
+    return await service.run_video_faceswap(req.source_uris, 
+                                            req.target_uri,
+                                            user)
\ No newline at end of file
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, BackgroundTasks
+from fastapi import APIRouter, Depends, BackgroundTasks, Response
 
 from typing import Annotated, Optional, List
 
@@ -7,6 +7,7 @@ from model.image_generation import Settings, Message
 
 from service import account as account_service
 import service.image_generation as service
+import service.webhook as webhook_service
 
 router = APIRouter(prefix="/image-generation")
 
@@ -14,7 +15,7 @@ router = APIRouter(prefix="/image-generation")
 @router.post("/webhook", status_code=200)
 async def webhook(message: Message) -> None:
     print("COMFYUI WEBHOOK ACTIVATED")
-    return service.webhook(message)
+    return await webhook_service.run_once("comfyui", message.dict(), service.webhook, message)
 
 
 @router.post("/generate", status_code=201)
@@ -29,9 +30,23 @@ async def generate(settings: Settings,
 
 @router.get("/recent-batch", status_code=200)  # Retrieves most recent batch
 async def get_batch(user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> Optional[Message]:
-    return service.get_batch(user)
+    return await service.get_batch(user)
 
 
 @router.get("/history", status_code=200)  # Retrieves most recent batch
-async def get_history(user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> Optional[List[Message]]:
-    return service.get_history(user)
\ No newline at end of file
+async def get_history(response: Response,
+                      user: Annotated[Account, Depends(account_service.get_current_active_user)],
+                      cursor: Optional[str] = None,
+                      limit: Optional[int] = None) -> Optional[List[Message]]:
+    messages, next_cursor = await service.get_history(user, cursor, limit)
+
+    # Absent on the last page, passed back as ?cursor= for the next one
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    return messages
+
+
+@router.post("/reload-workflow", status_code=200)  # Reloads the ComfyUI workflow template (insiders only)
+async def reload_workflow(user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> int:
+    return service.reload_workflow_template(user)
@@ -0,0 +1,20 @@
+from fastapi import APIRouter, HTTPException, Request
+
+import os
+
+from service import metrics as service
+
+router = APIRouter(prefix="/metrics")
+
+
+@router.get("/", status_code=200)  # Retrieves in-process cache, pool and queue statistics
+async def get(request: Request) -> dict:
+    metrics_key = request.headers.get("metrics-key")
+
+    if not os.getenv("METRICS_SECRET") or metrics_key != os.getenv("METRICS_SECRET"):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid metrics key"
+        )
+
+    return await service.get()
@@ -3,6 +3,7 @@ from fastapi import APIRouter
 from model.midjourney import Message
 
 from service import midjourney as service
+from service import webhook as webhook_service
 
 from typing import Any
 from fastapi import Body, FastAPI
@@ -14,4 +15,10 @@ router = APIRouter(prefix = "/midjourney")
 async def webhook(message: Message) -> None:
     print("MIDJOURNEY WEBHOOK ACTIVATED")
     print(message)
-    return service.webhook(message)
\ No newline at end of file
+    # Progress updates only overwrite the buffered message, a receipt per update
+    # would cost a Mongo write each, only the final one is worth recording
+    return await webhook_service.run_once("mymidjourney", 
+                                          message.dict(), 
+                                          service.webhook, 
+                                          message, 
+                                          durable=service.is_terminal(message))
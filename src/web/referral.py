@@ -20,7 +20,7 @@ async def generate_link(user: Annotated[Account, Depends(account_service.get_cur
 
 @router.post("/link-clicked", status_code=201)
 async def link_clicked(referral_id: str) -> None:
-    service.link_clicked(referral_id)
+    await service.link_clicked(referral_id)
 
 class PayoutRequest(BaseModel):
     paypal_email: str | None = None
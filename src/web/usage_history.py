@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends
 
 from typing import Annotated
 
-import data.usage_history as data
+from data.aio import usage_history as aio_data
 
 from model.account import Account
 from model.usage_history import History
@@ -14,4 +14,4 @@ router = APIRouter(prefix="/usage-history")
 
 @router.get("/", status_code=200)  # Retrieves account details
 async def get(user: Annotated[Account, Depends(account_service.get_current_active_user)]) -> History:
-    return data.get(user.user_id)
+    return await aio_data.get(user.user_id)